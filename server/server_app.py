@@ -1,26 +1,75 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import Optional
-import shutil
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
 import os
+import threading
+import time
+import uuid
 from pathlib import Path
 import sys
-from openai import OpenAI
 import json
 
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.rag_system import IncrementalRAGSystem
-from src.database import get_db_session, DocumentVersion, DocumentChunk
+# Heavy dependencies (torch, sentence-transformers, faiss, pypdf, openai) are
+# imported lazily: the model and index load on a background thread after the
+# server is already answering liveness checks.
+from src.timing import timed_phase
+from src.hashing import FileHasher, HASH_BLOCK_SIZE
+from src.analysis_cache import (
+    AnalysisCache,
+    SingleFlight,
+    analysis_cache_key,
+    prompt_template_hash,
+)
+from src.diff_engine import ChunkDiff, diff_chunks
+from src.database import (
+    get_db_session,
+    dispose_engines,
+    DocumentVersion,
+    DocumentChunk,
+)
+
 
+_llm_client = None
 
-client = OpenAI(
-    api_key=os.getenv("GROQ_API_KEY"), base_url="https://api.groq.com/openai/v1"
+
+def llm_client():
+    global _llm_client
+    if _llm_client is None:
+        from openai import AsyncOpenAI
+
+        _llm_client = AsyncOpenAI(
+            api_key=os.getenv("GROQ_API_KEY"),
+            base_url="https://api.groq.com/openai/v1",
+        )
+    return _llm_client
+
+
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+
+# Blocking work (model encode, FAISS search, SQLAlchemy, file I/O) runs on
+# a bounded pool so the event loop keeps serving other requests. Ingestion runs
+# in the background pipeline (src/ingestion.py) so large uploads cannot starve
+# queries.
+blocking_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BLOCKING_WORKERS", "8")),
+    thread_name_prefix="blocking",
 )
 
 
+async def run_blocking(func, *args, executor=None, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor or blocking_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
 app = FastAPI(
     title="Incremental RAG API",
     description="API for document Q&A RAG System",
@@ -38,12 +87,106 @@ app.add_middleware(
 )
 
 rag_system = None
+ingestion = None
+analysis_cache = None
+analysis_flights = SingleFlight()
+
+
+startup_state = {
+    "status": "starting",
+    "error": None,
+    "phases": {},
+    "started_at": time.monotonic(),
+    "ready_at": None,
+}
+
+
+def load_services():
+    global rag_system, ingestion, analysis_cache
+    phases = startup_state["phases"]
+
+    try:
+        with timed_phase(phases, "imports"):
+            from src.rag_system import IncrementalRAGSystem
+            from src.ingestion import IngestionPipeline
+
+        system = IncrementalRAGSystem()
+        phases.update(system.startup_timings)
+
+        system.warmup()
+        phases["warmup"] = system.startup_timings["warmup"]
+
+        with timed_phase(phases, "ingestion_pipeline"):
+            pipeline = IngestionPipeline(system)
+            cache = AnalysisCache(system.database_url)
+
+        rag_system, ingestion, analysis_cache = system, pipeline, cache
+        startup_state["ready_at"] = time.monotonic()
+        startup_state["status"] = "ready"
+        print(f"Startup complete: {phases}")
+    except Exception as e:
+        startup_state["error"] = str(e)
+        startup_state["status"] = "failed"
+        print(f"Startup failed: {e}")
 
 
 @app.on_event("startup")
 def startup():
-    global rag_system
-    rag_system = IncrementalRAGSystem()
+    if os.getenv("STARTUP_BACKGROUND", "true").lower() in ("1", "true", "yes"):
+        threading.Thread(target=load_services, name="startup", daemon=True).start()
+    else:
+        load_services()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    blocking_executor.shutdown(wait=True)
+    if rag_system is not None:
+        from src.document_processor import shutdown_pdf_pools
+
+        shutdown_pdf_pools()
+        rag_system.embedder.close()
+    dispose_engines()
+
+
+@app.middleware("http")
+async def require_ready(request: Request, call_next):
+    if request.url.path.startswith("/api/") and startup_state["status"] != "ready":
+        return JSONResponse(
+            status_code=503,
+            content={"detail": f"Service is {startup_state['status']}"},
+            headers={"Retry-After": "5"},
+        )
+    return await call_next(request)
+
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and the event loop is responsive.
+    return {
+        "status": "alive",
+        "uptime_s": round(time.monotonic() - startup_state["started_at"], 3),
+    }
+
+
+@app.get("/readyz")
+async def readyz():
+    ready = startup_state["status"] == "ready"
+    startup_seconds = None
+    if ready:
+        startup_seconds = round(
+            startup_state["ready_at"] - startup_state["started_at"], 3
+        )
+
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": startup_state["status"],
+            "error": startup_state["error"],
+            "startup_s": startup_seconds,
+            "phases_s": dict(startup_state["phases"]),
+        },
+    )
 
 
 TEMP_UPLOAD_DIR = "./temp_uploads"
@@ -54,6 +197,30 @@ class QueryRequest(BaseModel):
     question: str
     version_id: Optional[int] = None
     k: int = 5
+    # Without a version_id, search only each document's newest version.
+    latest_only: bool = False
+    # dense (default), lexical (BM25 keyword match, no embedding) or hybrid.
+    mode: Optional[Literal["dense", "lexical", "hybrid"]] = None
+    # Per-query IVF nprobe / HNSW efSearch, trading latency for recall.
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
+
+
+class BatchQuestion(BaseModel):
+    question: str
+    version_id: Optional[int] = None
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQuestion]
+    k: int = 5
+    latest_only: bool = False
+    mode: Optional[Literal["dense", "lexical", "hybrid"]] = None
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
+
+
+QUERY_BATCH_MAX_QUESTIONS = int(os.getenv("QUERY_BATCH_MAX_QUESTIONS", "10000"))
 
 
 class ComparisonRequest(BaseModel):
@@ -73,7 +240,9 @@ async def root():
 
 @app.post("/api/documents/upload")
 async def upload_document(
-    file: UploadFile = File(...), doc_name: Optional[str] = Form(None)
+    file: UploadFile = File(...),
+    doc_name: Optional[str] = Form(None),
+    wait: bool = False,
 ):
     temp_file_path = None
     try:
@@ -85,33 +254,85 @@ async def upload_document(
                 status_code=400, detail=f"File type {file_ext} not supported"
             )
 
-        temp_file_path = Path(TEMP_UPLOAD_DIR) / file.filename
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Jobs outlive the request, so concurrent uploads of the same file
+        # name must not share a temp path.
+        temp_file_path = (
+            Path(TEMP_UPLOAD_DIR) / f"{uuid.uuid4().hex}_{Path(file.filename).name}"
+        )
+        file_hash = await run_blocking(save_upload_file, file, temp_file_path)
 
         if not doc_name:
             doc_name = Path(file.filename).stem
 
-        result = rag_system.add_document(
-            file_path=str(temp_file_path), doc_name=doc_name
+        duplicate = await run_blocking(
+            rag_system.find_duplicate_version, doc_name, file_hash
         )
+        if duplicate is not None:
+            temp_file_path.unlink()
+            return JSONResponse(content=upload_response(duplicate))
 
-        temp_file_path.unlink()
+        from src.ingestion import QueueFullError
 
-        return JSONResponse(
-            content={
-                "success": True,
-                "message": f"Document uploaded as version {result['version_number']}",
-                "data": result,
-            }
-        )
+        try:
+            job = ingestion.submit(
+                str(temp_file_path), doc_name, delete_source=True, file_hash=file_hash
+            )
+        except QueueFullError as e:
+            temp_file_path.unlink()
+            raise HTTPException(status_code=503, detail=str(e))
+
+        if not wait:
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "success": True,
+                    "message": "Document queued for ingestion",
+                    "data": {
+                        "job_id": job.id,
+                        "status": job.status,
+                        "status_url": f"/api/jobs/{job.id}",
+                    },
+                },
+            )
+
+        result = await asyncio.wrap_future(job.future)
 
+        return JSONResponse(content=upload_response(result))
+
+    except HTTPException:
+        raise
     except Exception as e:
         if temp_file_path and temp_file_path.exists():
             temp_file_path.unlink()
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingestion.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return {"success": True, "data": job.to_dict()}
+
+
+def upload_response(result: dict) -> dict:
+    if result.get("duplicate"):
+        message = f"Identical to existing version {result['version_number']}"
+    else:
+        message = f"Document uploaded as version {result['version_number']}"
+    return {"success": True, "message": message, "data": result}
+
+
+def save_upload_file(file: UploadFile, dest: Path) -> str:
+    # Hash while copying so the upload is read once.
+    hasher = FileHasher()
+    with open(dest, "wb") as buffer:
+        for block in iter(lambda: file.file.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+            buffer.write(block)
+    return hasher.hexdigest()
+
+
 def build_source_context(results):
     parts = []
     for i, r in enumerate(results, start=1):
@@ -122,7 +343,7 @@ def build_source_context(results):
     return "\n\n".join(parts)
 
 
-def extract_document_topics(chunks: list, max_topics: int = 5) -> list:
+async def extract_document_topics(chunks: list, max_topics: int = 5) -> list:
 
     sample_text = "\n".join([c["content"] for c in chunks[:3]])
 
@@ -141,8 +362,8 @@ Return JSON with main topics/sections:
 Keep topics concise (2-4 words each). Maximum {max_topics} topics.
 """
 
-        resp = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        resp = await llm_client().chat.completions.create(
+            model=LLM_MODEL,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.3,
             max_tokens=200,
@@ -174,10 +395,92 @@ Keep topics concise (2-4 words each). Maximum {max_topics} topics.
         )
 
 
-@app.post("/api/query/generate")
-async def query_with_llm(query_request: QueryRequest):
-    question = query_request.question.strip()
+ANSWER_SYSTEM_MSG = """You are a helpful document Q&A assistant.
+
+IMPORTANT RULES:
+1. Answer using ONLY the provided context
+2. If context is relevant, provide an answer even if partial
+3. Only return not_found=true if context is COMPLETELY unrelated
+4. For general questions (like "policy" or "document"), summarize key points
+
+You must return valid JSON in this format:
+{
+  "not_found": false,
+  "answer": "Your answer here",
+  "confidence": "high|medium|low"
+}
+
+Only use not_found=true if truly nothing relevant exists."""
+
+STREAM_ANSWER_SYSTEM_MSG = """You are a helpful document Q&A assistant.
+
+IMPORTANT RULES:
+1. Answer using ONLY the provided context
+2. If context is relevant, provide an answer even if partial
+3. For general questions (like "policy" or "document"), summarize key points
+
+Reply with the answer text only, no JSON and no preamble."""
+
+
+def build_answer_prompt(question: str, context: str, avg_sim: float) -> str:
+    return f"""
+Context (avg similarity: {avg_sim:.2f}):
+{context}
+
+Question: {question}
+
+Provide a helpful answer based on the context. If the question is general, summarize the main points."""
+
 
+# Cut-offs on similarity_score: below no_match nothing is sent to the LLM,
+# below weak the answer is forced to low confidence, above medium/strong more
+# sources are kept (those scoring over keep_medium/keep_strong). Dense and
+# hybrid scores are 1 / (1 + L2 distance); lexical ones are squashed BM25,
+# which runs higher for the same relevance, so they have their own scale.
+SIMILARITY_THRESHOLDS = {
+    "dense": {
+        "no_match": 0.35,
+        "weak": 0.4,
+        "medium": 0.45,
+        "strong": 0.6,
+        "keep_medium": 0.4,
+        "keep_strong": 0.5,
+    },
+    "lexical": {
+        "no_match": 0.5,
+        "weak": 0.6,
+        "medium": 0.67,
+        "strong": 0.8,
+        "keep_medium": 0.6,
+        "keep_strong": 0.75,
+    },
+}
+
+
+def similarity_thresholds(mode: Optional[str]) -> dict:
+    mode = mode or rag_system.default_query_mode
+    return SIMILARITY_THRESHOLDS["lexical" if mode == "lexical" else "dense"]
+
+
+def similarity_confidence(avg_sim: float, thresholds: dict) -> str:
+    if avg_sim > thresholds["strong"]:
+        return "high"
+    elif avg_sim > thresholds["medium"]:
+        return "medium"
+    return "low"
+
+
+async def retrieve_answer_context(
+    question: str,
+    version_id: Optional[int],
+    k: int,
+    latest_only: bool = False,
+    mode: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+):
+    # Returns (early_response, None) when there is nothing to send to the LLM,
+    # otherwise (None, retrieval) with the sources and prompt context.
     if len(question) < 3:
         return {
             "question": question,
@@ -185,12 +488,17 @@ async def query_with_llm(query_request: QueryRequest):
             "answer": "",
             "message": "Question too short (minimum 3 characters)",
             "sources": [],
-        }
+        }, None
 
-    results = rag_system.query(
+    results = await run_blocking(
+        rag_system.query,
         question=question,
-        version_id=query_request.version_id,
-        k=query_request.k,
+        version_id=version_id,
+        k=k,
+        latest_only=latest_only,
+        mode=mode,
+        nprobe=nprobe,
+        ef_search=ef_search,
     )
 
     if not results:
@@ -201,12 +509,13 @@ async def query_with_llm(query_request: QueryRequest):
             "message": "No content found in this document version",
             "suggestion": "Check if you selected the correct version or try searching all versions",
             "sources": [],
-        }
+        }, None
 
+    thresholds = similarity_thresholds(mode)
     top_score = results[0]["similarity_score"]
 
-    if top_score < 0.35:
-        topics = extract_document_topics(results)
+    if top_score < thresholds["no_match"]:
+        topics = await extract_document_topics(results)
 
         return {
             "question": question,
@@ -225,53 +534,58 @@ async def query_with_llm(query_request: QueryRequest):
             ],
             "top_score": round(top_score, 3),
             "sources": [],
-        }
+        }, None
 
     force_low_confidence = False
 
-    if top_score < 0.4:
+    if top_score < thresholds["weak"]:
         filtered = results[:3]
         force_low_confidence = True
-    elif top_score > 0.6:
-        filtered = [r for r in results if r["similarity_score"] > 0.5][:3]
-    elif top_score > 0.45:
-        filtered = [r for r in results if r["similarity_score"] > 0.4][:2]
+    elif top_score > thresholds["strong"]:
+        filtered = [
+            r for r in results if r["similarity_score"] > thresholds["keep_strong"]
+        ][:3]
+    elif top_score > thresholds["medium"]:
+        filtered = [
+            r for r in results if r["similarity_score"] > thresholds["keep_medium"]
+        ][:2]
     else:
         filtered = results[:1]
 
-    context = build_source_context(filtered)
-    avg_sim = sum(r["similarity_score"] for r in filtered) / len(filtered)
-
-    system_msg = """You are a helpful document Q&A assistant.
-
-IMPORTANT RULES:
-1. Answer using ONLY the provided context
-2. If context is relevant, provide an answer even if partial
-3. Only return not_found=true if context is COMPLETELY unrelated
-4. For general questions (like "policy" or "document"), summarize key points
-
-You must return valid JSON in this format:
-{
-  "not_found": false,
-  "answer": "Your answer here",
-  "confidence": "high|medium|low"
-}
+    return None, {
+        "sources": filtered,
+        "context": build_source_context(filtered),
+        "avg_sim": sum(r["similarity_score"] for r in filtered) / len(filtered),
+        "force_low_confidence": force_low_confidence,
+        "thresholds": thresholds,
+    }
 
-Only use not_found=true if truly nothing relevant exists."""
 
-    user_prompt = f"""
-Context (avg similarity: {avg_sim:.2f}):
-{context}
+@app.post("/api/query/generate")
+async def query_with_llm(query_request: QueryRequest):
+    question = query_request.question.strip()
 
-Question: {question}
+    early_response, retrieval = await retrieve_answer_context(
+        question,
+        query_request.version_id,
+        query_request.k,
+        query_request.latest_only,
+        query_request.mode,
+        query_request.nprobe,
+        query_request.ef_search,
+    )
+    if early_response:
+        return early_response
 
-Provide a helpful answer based on the context. If the question is general, summarize the main points."""
+    filtered = retrieval["sources"]
+    avg_sim = retrieval["avg_sim"]
+    user_prompt = build_answer_prompt(question, retrieval["context"], avg_sim)
 
     try:
-        resp = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        resp = await llm_client().chat.completions.create(
+            model=LLM_MODEL,
             messages=[
-                {"role": "system", "content": system_msg},
+                {"role": "system", "content": ANSWER_SYSTEM_MSG},
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.1,
@@ -308,24 +622,142 @@ Provide a helpful answer based on the context. If the question is general, summa
     j["avg_similarity"] = round(avg_sim, 3)
 
     if "confidence" not in j:
-        if avg_sim > 0.6:
-            j["confidence"] = "high"
-        elif avg_sim > 0.45:
-            j["confidence"] = "medium"
-        else:
-            j["confidence"] = "low"
+        j["confidence"] = similarity_confidence(avg_sim, retrieval["thresholds"])
 
-    if force_low_confidence:
+    if retrieval["force_low_confidence"]:
         j["confidence"] = "low"
         j["warning"] = "Answer based on limited context relevance"
 
     return j
 
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/api/query/generate/stream")
+async def query_with_llm_stream(query_request: QueryRequest):
+    question = query_request.question.strip()
+
+    async def event_stream():
+        early_response, retrieval = await retrieve_answer_context(
+            question,
+            query_request.version_id,
+            query_request.k,
+            query_request.latest_only,
+            query_request.mode,
+            query_request.nprobe,
+            query_request.ef_search,
+        )
+        if early_response:
+            yield sse_event("done", early_response)
+            return
+
+        avg_sim = retrieval["avg_sim"]
+
+        # Sources go out as soon as retrieval finishes; the answer follows.
+        yield sse_event(
+            "sources",
+            {
+                "question": question,
+                "sources": retrieval["sources"],
+                "avg_similarity": round(avg_sim, 3),
+            },
+        )
+
+        user_prompt = build_answer_prompt(question, retrieval["context"], avg_sim)
+
+        try:
+            stream = await llm_client().chat.completions.create(
+                model=LLM_MODEL,
+                messages=[
+                    {"role": "system", "content": STREAM_ANSWER_SYSTEM_MSG},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=0.1,
+                max_tokens=800,
+                stream=True,
+            )
+
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    yield sse_event("token", {"text": token})
+        except Exception as e:
+            yield sse_event("error", {"detail": f"LLM API error: {str(e)}"})
+            return
+
+        done = {
+            "not_found": False,
+            "question": question,
+            "avg_similarity": round(avg_sim, 3),
+            "confidence": similarity_confidence(avg_sim, retrieval["thresholds"]),
+        }
+        if retrieval["force_low_confidence"]:
+            done["confidence"] = "low"
+            done["warning"] = "Answer based on limited context relevance"
+
+        yield sse_event("done", done)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/query/batch")
+async def query_batch(batch: BatchQueryRequest):
+    if len(batch.queries) > QUERY_BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {QUERY_BATCH_MAX_QUESTIONS} questions per batch",
+        )
+
+    try:
+        results = rag_system.query_batch(
+            [item.question for item in batch.queries],
+            [item.version_id for item in batch.queries],
+            k=batch.k,
+            latest_only=batch.latest_only,
+            mode=batch.mode,
+            nprobe=batch.nprobe,
+            ef_search=batch.ef_search,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def result_stream():
+        # Newline-delimited JSON, one line per question in completion order;
+        # "index" is the question's position in the request.
+        while True:
+            try:
+                item = await run_blocking(next, results, None)
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+                return
+            if item is None:
+                return
+
+            index, sources = item
+            yield json.dumps(
+                {
+                    "index": index,
+                    "question": batch.queries[index].question,
+                    "version_id": batch.queries[index].version_id,
+                    "results": sources,
+                }
+            ) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
 @app.get("/api/documents")
 async def list_documents():
     try:
-        documents = rag_system.get_all_documents()
+        documents = await run_blocking(rag_system.get_all_documents)
         return documents
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -334,7 +766,7 @@ async def list_documents():
 @app.get("/api/documents/{doc_name}/versions")
 async def get_document_versions(doc_name: str):
     try:
-        versions = rag_system.get_document_versions(doc_name)
+        versions = await run_blocking(rag_system.get_document_versions, doc_name)
         if not versions:
             raise HTTPException(
                 status_code=404, detail=f"Document '{doc_name}' not found"
@@ -346,61 +778,100 @@ async def get_document_versions(doc_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/documents/{doc_name}/versions/{version_id}/diff")
-async def get_version_diff(doc_name: str, version_id: int):
+@app.delete("/api/documents/{doc_name}")
+async def delete_document(doc_name: str):
     try:
-        session = get_db_session()
-
-        try:
-            current_version = (
-                session.query(DocumentVersion).filter_by(id=version_id).first()
+        result = await run_blocking(rag_system.delete_document, doc_name)
+        if result is None:
+            raise HTTPException(
+                status_code=404, detail=f"Document '{doc_name}' not found"
             )
+        await run_blocking(
+            analysis_cache.delete_for_versions, result["deleted_version_ids"]
+        )
+        return {"success": True, **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-            if not current_version:
-                raise HTTPException(status_code=404, detail="Version not found")
 
-            prev_version = (
-                session.query(DocumentVersion)
-                .filter_by(
-                    document_id=current_version.document_id,
-                    version_number=current_version.version_number - 1,
-                )
-                .first()
+@app.delete("/api/documents/{doc_name}/versions/{version_id}")
+async def delete_document_version(doc_name: str, version_id: int):
+    try:
+        result = await run_blocking(rag_system.delete_version, doc_name, version_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Version not found")
+        await run_blocking(
+            analysis_cache.delete_for_versions, result["deleted_version_ids"]
+        )
+        return {"success": True, **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def version_snapshot(version: DocumentVersion) -> dict:
+    return {
+        "id": version.id,
+        "number": version.version_number,
+        "date": version.upload_date.isoformat(),
+        "chunks": [chunk.content for chunk in version.chunks],
+    }
+
+
+def load_version_with_previous(version_id: int):
+    session = get_db_session(rag_system.database_url)
+
+    try:
+        current_version = session.query(DocumentVersion).filter_by(id=version_id).first()
+
+        if not current_version:
+            return None, None
+
+        # Versions can be deleted, so "previous" is the closest older one.
+        prev_version = (
+            session.query(DocumentVersion)
+            .filter(
+                DocumentVersion.document_id == current_version.document_id,
+                DocumentVersion.version_number < current_version.version_number,
             )
+            .order_by(DocumentVersion.version_number.desc())
+            .first()
+        )
 
-            if not prev_version:
-                return {
-                    "success": True,
-                    "message": "This is the first version",
-                    "is_first_version": True,
-                    "current_version": current_version.version_number,
-                }
+        return (
+            version_snapshot(current_version),
+            version_snapshot(prev_version) if prev_version else None,
+        )
+    finally:
+        session.close()
 
-            current_chunks = [chunk.content for chunk in current_version.chunks]
-            prev_chunks = [chunk.content for chunk in prev_version.chunks]
 
-            current_text = "\n\n".join(current_chunks)
-            prev_text = "\n\n".join(prev_chunks)
+def load_versions(*version_ids: int) -> list:
+    session = get_db_session(rag_system.database_url)
+
+    try:
+        snapshots = []
+        for version_id in version_ids:
+            version = session.query(DocumentVersion).filter_by(id=version_id).first()
+            snapshots.append(version_snapshot(version) if version else None)
+        return snapshots
+    finally:
+        session.close()
 
-            stats = {
-                "chunks_added": len(current_chunks) - len(prev_chunks),
-                "current_chunks": len(current_chunks),
-                "previous_chunks": len(prev_chunks),
-                "current_version": current_version.version_number,
-                "previous_version": prev_version.version_number,
-            }
 
-            system_msg = """You are analyzing document changes. 
+DIFF_SYSTEM_MSG = """You are analyzing document changes. 
 Identify what changed between two versions.
 Be specific and concise.
 You must respond with valid JSON only."""
 
-            user_prompt = f"""
-Previous Version:
-{prev_text[:3000]}...
+DIFF_PROMPT_TEMPLATE = """
+Chunk-level diff from the previous to the current version: {diff_summary}.
+Only the changed regions are shown; everything else is identical.
 
-Current Version:
-{current_text[:3000]}...
+{changes}
 
 Analyze the changes and return valid JSON in this format:
 {{
@@ -411,11 +882,135 @@ Analyze the changes and return valid JSON in this format:
   "impact": "low|medium|high"
 }}
 """
+
+COMPARE_QUESTION_SYSTEM_MSG = """Compare how two document versions answer the same question.
+Identify specific differences."""
+
+COMPARE_QUESTION_PROMPT_TEMPLATE = """
+Question: {question}
+
+Version {v1_number} says:
+{context_v1}
+
+Version {v2_number} says:
+{context_v2}
+
+Return JSON:
+{{
+  "answer_v1": "Answer from version 1",
+  "answer_v2": "Answer from version 2",
+  "changed": true/false,
+  "differences": [
+    {{"aspect": "what changed", "v1": "old value", "v2": "new value"}}
+  ],
+  "summary": "Overall comparison"
+}}
+"""
+
+COMPARE_SYSTEM_MSG = """Compare two document versions.
+Identify all significant changes."""
+
+COMPARE_PROMPT_TEMPLATE = """
+Chunk-level diff from version {v1_number} to version {v2_number}: {diff_summary}.
+Only the changed regions are shown; everything else is identical.
+
+{changes}
+
+Return JSON:
+{{
+  "overall_change": "high|medium|low",
+  "summary": "What changed overall",
+  "sections_changed": ["section 1", "section 2"],
+  "key_differences": [
+    {{"category": "category", "description": "what changed", "type": "added|modified|removed"}}
+  ],
+  "recommendations": "Who should review these changes"
+}}
+"""
+
+# Versions are immutable, so an analysis only goes stale when the model or the
+# prompt changes; both are part of the cache key.
+DIFF_PROMPT_HASH = prompt_template_hash(DIFF_SYSTEM_MSG, DIFF_PROMPT_TEMPLATE)
+COMPARE_QUESTION_PROMPT_HASH = prompt_template_hash(
+    COMPARE_QUESTION_SYSTEM_MSG, COMPARE_QUESTION_PROMPT_TEMPLATE
+)
+COMPARE_PROMPT_HASH = prompt_template_hash(COMPARE_SYSTEM_MSG, COMPARE_PROMPT_TEMPLATE)
+
+
+def diff_stats(chunk_diff: ChunkDiff) -> dict:
+    return {f"chunks_{name}": count for name, count in chunk_diff.stats().items()}
+
+
+def local_diff_analysis(chunk_diff: ChunkDiff, impact: str) -> dict:
+    # Deterministic analysis from the chunk diff alone, used when there is
+    # nothing for the LLM to summarize or the LLM call fails.
+    stats = chunk_diff.stats()
+    return {
+        "summary": chunk_diff.summary(),
+        "key_changes": [
+            {
+                "type": change_type,
+                "description": f"{stats[change_type]} chunks {change_type}",
+            }
+            for change_type in ("modified", "added", "removed")
+            if stats[change_type]
+        ],
+        "impact": impact,
+    }
+
+
+async def cached_analysis(cache_key: str, generate):
+    analysis = await run_blocking(analysis_cache.get, cache_key)
+    if analysis is not None:
+        return analysis
+    return await analysis_flights.do(cache_key, generate)
+
+
+@app.get("/api/documents/{doc_name}/versions/{version_id}/diff")
+async def get_version_diff(doc_name: str, version_id: int):
+    try:
+        current_version, prev_version = await run_blocking(
+            load_version_with_previous, version_id
+        )
+
+        if not current_version:
+            raise HTTPException(status_code=404, detail="Version not found")
+
+        if not prev_version:
+            return {
+                "success": True,
+                "message": "This is the first version",
+                "is_first_version": True,
+                "current_version": current_version["number"],
+            }
+
+        current_chunks = current_version["chunks"]
+        prev_chunks = prev_version["chunks"]
+        chunk_diff = await run_blocking(diff_chunks, prev_chunks, current_chunks)
+
+        stats = {
+            **diff_stats(chunk_diff),
+            "current_chunks": len(current_chunks),
+            "previous_chunks": len(prev_chunks),
+            "current_version": current_version["number"],
+            "previous_version": prev_version["number"],
+        }
+
+        version_ids = (prev_version["id"], current_version["id"])
+        cache_key = analysis_cache_key(
+            "diff", version_ids, LLM_MODEL, DIFF_PROMPT_HASH
+        )
+
+        async def generate():
+            user_prompt = DIFF_PROMPT_TEMPLATE.format(
+                diff_summary=chunk_diff.summary(),
+                changes=chunk_diff.format_for_prompt(),
+            )
             try:
-                resp = client.chat.completions.create(
-                    model="llama-3.3-70b-versatile",
+                resp = await llm_client().chat.completions.create(
+                    model=LLM_MODEL,
                     messages=[
-                        {"role": "system", "content": system_msg},
+                        {"role": "system", "content": DIFF_SYSTEM_MSG},
                         {"role": "user", "content": user_prompt},
                     ],
                     temperature=0.1,
@@ -429,51 +1024,47 @@ Analyze the changes and return valid JSON in this format:
                     diff_analysis = json.loads(llm_response)
                 except json.JSONDecodeError as e:
                     print(f"Failed to parse LLM response: {llm_response}")
-                    diff_analysis = {
-                        "summary": f"Version {current_version.version_number} has {len(current_chunks) - len(prev_chunks)} more chunks than version {prev_version.version_number}",
-                        "key_changes": [
-                            {
-                                "type": "modified",
-                                "description": f"Content updated with {abs(len(current_chunks) - len(prev_chunks))} chunk difference",
-                            }
-                        ],
-                        "impact": "medium",
-                    }
+                    return local_diff_analysis(chunk_diff, "medium")
 
             except Exception as llm_error:
                 print(f"LLM API error: {llm_error}")
-                diff_analysis = {
-                    "summary": "Unable to generate detailed analysis",
-                    "key_changes": [
-                        {
-                            "type": "modified",
-                            "description": f"{len(current_chunks)} chunks in current version vs {len(prev_chunks)} in previous",
-                        }
-                    ],
-                    "impact": "unknown",
-                }
+                return local_diff_analysis(chunk_diff, "unknown")
+
+            # Fallbacks above are not cached so the next request retries.
+            await run_blocking(
+                analysis_cache.put,
+                cache_key,
+                "diff",
+                version_ids,
+                LLM_MODEL,
+                DIFF_PROMPT_HASH,
+                diff_analysis,
+            )
+            return diff_analysis
 
-            return {
-                "success": True,
-                "is_first_version": False,
-                "stats": stats,
-                "analysis": diff_analysis,
-                "version_info": {
-                    "current": {
-                        "id": current_version.id,
-                        "number": current_version.version_number,
-                        "date": current_version.upload_date.isoformat(),
-                    },
-                    "previous": {
-                        "id": prev_version.id,
-                        "number": prev_version.version_number,
-                        "date": prev_version.upload_date.isoformat(),
-                    },
-                },
-            }
+        if chunk_diff.has_changes:
+            diff_analysis = await cached_analysis(cache_key, generate)
+        else:
+            diff_analysis = local_diff_analysis(chunk_diff, "low")
 
-        finally:
-            session.close()
+        return {
+            "success": True,
+            "is_first_version": False,
+            "stats": stats,
+            "analysis": diff_analysis,
+            "version_info": {
+                "current": {
+                    "id": current_version["id"],
+                    "number": current_version["number"],
+                    "date": current_version["date"],
+                },
+                "previous": {
+                    "id": prev_version["id"],
+                    "number": prev_version["number"],
+                    "date": prev_version["date"],
+                },
+            },
+        }
 
     except HTTPException:
         raise
@@ -489,93 +1080,72 @@ Analyze the changes and return valid JSON in this format:
 async def compare_versions_detailed(comparison: ComparisonRequest):
 
     try:
-        session = get_db_session()
+        v1, v2 = await run_blocking(
+            load_versions, comparison.version_id_1, comparison.version_id_2
+        )
 
-        try:
-            v1 = (
-                session.query(DocumentVersion)
-                .filter_by(id=comparison.version_id_1)
-                .first()
-            )
-            v2 = (
-                session.query(DocumentVersion)
-                .filter_by(id=comparison.version_id_2)
-                .first()
-            )
+        if not v1 or not v2:
+            raise HTTPException(status_code=404, detail="Version not found")
 
-            if not v1 or not v2:
-                raise HTTPException(status_code=404, detail="Version not found")
+        v1_chunks = v1["chunks"]
+        v2_chunks = v2["chunks"]
 
-            v1_chunks = [chunk.content for chunk in v1.chunks]
-            v2_chunks = [chunk.content for chunk in v2.chunks]
+        v1_text = "\n\n".join(v1_chunks)
+        v2_text = "\n\n".join(v2_chunks)
+        chunk_diff = await run_blocking(diff_chunks, v1_chunks, v2_chunks)
 
-            v1_text = "\n\n".join(v1_chunks)
-            v2_text = "\n\n".join(v2_chunks)
+        version_ids = (v1["id"], v2["id"])
+        if comparison.question:
+            kind = "compare_question"
+            prompt_hash = COMPARE_QUESTION_PROMPT_HASH
+            question, k = comparison.question, comparison.k
+        else:
+            kind = "compare"
+            prompt_hash = COMPARE_PROMPT_HASH
+            question, k = None, None
+        cache_key = analysis_cache_key(
+            kind, version_ids, LLM_MODEL, prompt_hash, question, k
+        )
 
+        async def generate():
             if comparison.question:
-                results_v1 = rag_system.query(
-                    question=comparison.question,
-                    version_id=comparison.version_id_1,
-                    k=comparison.k,
+                results_v1, results_v2 = await asyncio.gather(
+                    run_blocking(
+                        rag_system.query,
+                        question=comparison.question,
+                        version_id=comparison.version_id_1,
+                        k=comparison.k,
+                    ),
+                    run_blocking(
+                        rag_system.query,
+                        question=comparison.question,
+                        version_id=comparison.version_id_2,
+                        k=comparison.k,
+                    ),
                 )
 
-                results_v2 = rag_system.query(
+                system_msg = COMPARE_QUESTION_SYSTEM_MSG
+                user_prompt = COMPARE_QUESTION_PROMPT_TEMPLATE.format(
                     question=comparison.question,
-                    version_id=comparison.version_id_2,
-                    k=comparison.k,
+                    v1_number=v1["number"],
+                    v2_number=v2["number"],
+                    context_v1="\n".join([r["content"] for r in results_v1[:2]]),
+                    context_v2="\n".join([r["content"] for r in results_v2[:2]]),
                 )
-
-                context_v1 = "\n".join([r["content"] for r in results_v1[:2]])
-                context_v2 = "\n".join([r["content"] for r in results_v2[:2]])
-
-                system_msg = """Compare how two document versions answer the same question.
-                Identify specific differences."""
-
-                user_prompt = f"""
-Question: {comparison.question}
-
-Version {v1.version_number} says:
-{context_v1}
-
-Version {v2.version_number} says:
-{context_v2}
-
-Return JSON:
-{{
-  "answer_v1": "Answer from version 1",
-  "answer_v2": "Answer from version 2",
-  "changed": true/false,
-  "differences": [
-    {{"aspect": "what changed", "v1": "old value", "v2": "new value"}}
-  ],
-  "summary": "Overall comparison"
-}}
-"""
             else:
-                system_msg = """Compare two document versions.
-                Identify all significant changes."""
-
-                user_prompt = f"""
-Version {v1.version_number}:
-{v1_text[:4000]}...
-
-Version {v2.version_number}:
-{v2_text[:4000]}...
-
-Return JSON:
-{{
-  "overall_change": "high|medium|low",
-  "summary": "What changed overall",
-  "sections_changed": ["section 1", "section 2"],
-  "key_differences": [
-    {{"category": "category", "description": "what changed", "type": "added|modified|removed"}}
-  ],
-  "recommendations": "Who should review these changes"
-}}
-"""
+                system_msg = COMPARE_SYSTEM_MSG
+                user_prompt = COMPARE_PROMPT_TEMPLATE.format(
+                    v1_number=v1["number"],
+                    v2_number=v2["number"],
+                    diff_summary=chunk_diff.summary(),
+                    changes=chunk_diff.format_for_prompt(
+                        old_label=f"Version {v1['number']}",
+                        new_label=f"Version {v2['number']}",
+                    ),
+                )
 
-            resp = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
+            resp = await llm_client().chat.completions.create(
+                model=LLM_MODEL,
                 messages=[
                     {"role": "system", "content": system_msg},
                     {"role": "user", "content": user_prompt},
@@ -586,33 +1156,54 @@ Return JSON:
 
             analysis = json.loads(resp.choices[0].message.content)
 
-            return {
-                "success": True,
-                "question": comparison.question if comparison.question else None,
-                "version_info": {
-                    "version_1": {
-                        "id": v1.id,
-                        "number": v1.version_number,
-                        "date": v1.upload_date.isoformat(),
-                        "chunks": len(v1_chunks),
-                    },
-                    "version_2": {
-                        "id": v2.id,
-                        "number": v2.version_number,
-                        "date": v2.upload_date.isoformat(),
-                        "chunks": len(v2_chunks),
-                    },
-                },
-                "analysis": analysis,
-                "stats": {
-                    "chunks_difference": len(v2_chunks) - len(v1_chunks),
-                    "text_length_v1": len(v1_text),
-                    "text_length_v2": len(v2_text),
-                },
+            await run_blocking(
+                analysis_cache.put,
+                cache_key,
+                kind,
+                version_ids,
+                LLM_MODEL,
+                prompt_hash,
+                analysis,
+                question=question,
+            )
+            return analysis
+
+        if comparison.question or chunk_diff.has_changes:
+            analysis = await cached_analysis(cache_key, generate)
+        else:
+            analysis = {
+                "overall_change": "low",
+                "summary": chunk_diff.summary(),
+                "sections_changed": [],
+                "key_differences": [],
+                "recommendations": "No review needed",
             }
 
-        finally:
-            session.close()
+        return {
+            "success": True,
+            "question": comparison.question if comparison.question else None,
+            "version_info": {
+                "version_1": {
+                    "id": v1["id"],
+                    "number": v1["number"],
+                    "date": v1["date"],
+                    "chunks": len(v1_chunks),
+                },
+                "version_2": {
+                    "id": v2["id"],
+                    "number": v2["number"],
+                    "date": v2["date"],
+                    "chunks": len(v2_chunks),
+                },
+            },
+            "analysis": analysis,
+            "stats": {
+                "chunks_difference": len(v2_chunks) - len(v1_chunks),
+                **diff_stats(chunk_diff),
+                "text_length_v1": len(v1_text),
+                "text_length_v2": len(v2_text),
+            },
+        }
 
     except HTTPException:
         raise
@@ -2,10 +2,7 @@
 Incremental RAG System - A production-ready RAG with document versioning
 """
 
-from .rag_system import IncrementalRAGSystem
-from .embeddings import EmbeddingGenerator
-from .vector_store import FAISSVectorStore
-from .document_processor import DocumentProcessor
+import importlib
 
 __version__ = "1.0.0"
 __all__ = [
@@ -14,3 +11,26 @@ __all__ = [
     "FAISSVectorStore",
     "DocumentProcessor",
 ]
+
+# Resolved on first access (PEP 562) so importing a light submodule such as
+# src.database does not drag in torch, faiss and pypdf.
+_LAZY_EXPORTS = {
+    "IncrementalRAGSystem": ".rag_system",
+    "EmbeddingGenerator": ".embeddings",
+    "FAISSVectorStore": ".vector_store",
+    "DocumentProcessor": ".document_processor",
+}
+
+
+def __getattr__(name):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
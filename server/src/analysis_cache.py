@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict, Optional
+
+from src.database import get_db_session, AnalysisCacheEntry
+
+
+def prompt_template_hash(*templates: str) -> str:
+    digest = hashlib.sha256()
+    for template in templates:
+        digest.update(template.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def analysis_cache_key(
+    kind: str,
+    version_ids: tuple,
+    model: str,
+    prompt_hash: str,
+    question: str = None,
+    k: int = None,
+) -> str:
+    payload = json.dumps(
+        [kind, list(version_ids), model, prompt_hash, question, k], sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+
+    def __init__(self, database_url: str = None):
+        self.database_url = database_url
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cache_key: str) -> Optional[dict]:
+        session = get_db_session(self.database_url)
+        try:
+            entry = (
+                session.query(AnalysisCacheEntry)
+                .filter_by(cache_key=cache_key)
+                .first()
+            )
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return json.loads(entry.response)
+        finally:
+            session.close()
+
+    def put(
+        self,
+        cache_key: str,
+        kind: str,
+        version_ids: tuple,
+        model: str,
+        prompt_hash: str,
+        analysis: dict,
+        question: str = None,
+    ):
+        session = get_db_session(self.database_url)
+        try:
+            session.add(
+                AnalysisCacheEntry(
+                    cache_key=cache_key,
+                    kind=kind,
+                    version_id_1=version_ids[0],
+                    version_id_2=version_ids[1],
+                    question=question,
+                    model=model,
+                    prompt_hash=prompt_hash,
+                    response=json.dumps(analysis),
+                )
+            )
+            session.commit()
+        except Exception as e:
+            # Another worker may have stored the same key first.
+            session.rollback()
+            print(f"Analysis cache write skipped: {e}")
+        finally:
+            session.close()
+
+    def delete_for_versions(self, version_ids: list):
+        if not version_ids:
+            return
+
+        session = get_db_session(self.database_url)
+        try:
+            session.query(AnalysisCacheEntry).filter(
+                AnalysisCacheEntry.version_id_1.in_(version_ids)
+                | AnalysisCacheEntry.version_id_2.in_(version_ids)
+            ).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable]):
+        # Identical concurrent requests wait on the first one instead of
+        # issuing their own LLM call.
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+import numpy as np
+
+
+class EmbeddingMicroBatcher:
+
+    def __init__(
+        self, embedder, max_batch_size: int = None, max_wait_ms: float = None
+    ):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size or int(
+            os.getenv("QUERY_BATCH_MAX_SIZE", "64")
+        )
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name="embedding-micro-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+
+            try:
+                vectors = self.embedder.embed_batch(texts, show_progress_bar=False)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.texts += len(batch)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "texts": self.texts,
+                "avg_batch_size": round(self.texts / self.batches, 2)
+                if self.batches
+                else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
@@ -0,0 +1,392 @@
+import argparse
+import math
+import pickle
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from src.document_processor import DocumentProcessor
+from src.vector_store import DEFAULT_INDEX_PARAMS, build_index, search_parameters
+
+
+DEFAULT_ANN_SWEEP = {
+    "flat": [{}],
+    "ivf": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128)],
+    "ivfpq": [{"nprobe": n} for n in (4, 16, 64)],
+}
+
+
+def _latency_summary(samples: List[float]) -> dict:
+    samples_ms = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 3),
+    }
+
+
+def ann_recall_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    sweep: Dict[str, List[dict]] = None,
+    index_params: dict = None,
+) -> List[dict]:
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    sweep = sweep or DEFAULT_ANN_SWEEP
+    params = {**DEFAULT_INDEX_PARAMS, **(index_params or {})}
+    k = min(k, len(vectors))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for index_type, knobs in sweep.items():
+        build_start = time.perf_counter()
+        index = build_index(index_type, vectors.shape[1], vectors, params)
+        build_seconds = time.perf_counter() - build_start
+
+        for knob in knobs:
+            search_params = search_parameters(index_type, params, **knob)
+
+            latencies = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                _, found = index.search(query.reshape(1, -1), k, params=search_params)
+                latencies.append(time.perf_counter() - start)
+                hits += len(set(found[0].tolist()) & set(expected.tolist()))
+
+            report.append(
+                {
+                    "index_type": index_type,
+                    **knob,
+                    f"recall@{k}": round(hits / (len(queries) * k), 4),
+                    **_latency_summary(latencies),
+                    "build_s": round(build_seconds, 2),
+                }
+            )
+
+    return report
+
+
+def pdf_extraction_report(
+    file_paths: List[str], workers: List[int], repeats: int = 3
+) -> List[dict]:
+    report = []
+    for file_path in file_paths:
+        baseline = None
+        for num_workers in workers:
+            processor = DocumentProcessor(pdf_workers=num_workers)
+            # Warm-up run so process pool start-up is not billed to the first
+            # timed repeat.
+            text, page_offsets = processor.extract_pdf_text_with_pages(file_path)
+
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                processor.extract_pdf_text_with_pages(file_path)
+                samples.append(time.perf_counter() - start)
+
+            seconds = min(samples)
+            baseline = baseline or seconds
+            report.append(
+                {
+                    "file": Path(file_path).name,
+                    "pages": len(page_offsets),
+                    "chars": len(text),
+                    "workers": num_workers,
+                    "best_s": round(seconds, 3),
+                    "pages_per_s": round(len(page_offsets) / seconds, 1),
+                    "speedup": round(baseline / seconds, 2),
+                }
+            )
+
+    return report
+
+
+def ingest_report(
+    file_paths: List[str], embedder, batch_size: int = 32
+) -> List[dict]:
+    processors = {
+        "chars": DocumentProcessor(chunk_size=512, chunk_overlap=50),
+        "tokens": DocumentProcessor(
+            chunk_mode="tokens",
+            tokenizer=embedder.tokenizer,
+            max_tokens=embedder.max_seq_length,
+        ),
+    }
+
+    report = []
+    for file_path in file_paths:
+        text = processors["chars"].extract_text(file_path)
+
+        for mode, processor in processors.items():
+            start = time.perf_counter()
+            chunks = processor.chunk_text(text)
+            chunk_seconds = time.perf_counter() - start
+
+            lengths = [
+                len(ids) for ids in embedder.tokenizer(chunks)["input_ids"]
+            ] or [0]
+
+            start = time.perf_counter()
+            embedder.embed_batch(chunks, batch_size=batch_size, show_progress_bar=False)
+            embed_seconds = time.perf_counter() - start
+
+            report.append(
+                {
+                    "file": Path(file_path).name,
+                    "mode": mode,
+                    "chunks": len(chunks),
+                    "truncated": sum(n > embedder.max_seq_length for n in lengths),
+                    "mean_tokens": round(float(np.mean(lengths)), 1),
+                    "fill": round(
+                        float(np.mean(np.minimum(lengths, embedder.max_seq_length)))
+                        / embedder.max_seq_length,
+                        3,
+                    ),
+                    "batches": math.ceil(len(chunks) / batch_size),
+                    "chunk_s": round(chunk_seconds, 3),
+                    "embed_s": round(embed_seconds, 3),
+                }
+            )
+
+    return report
+
+
+def embedding_throughput_report(
+    embedder, texts: List[str], processes: List[int], batch_size: int = 32
+) -> List[dict]:
+    def timed(label, cores, encode):
+        start = time.perf_counter()
+        embeddings = encode()
+        seconds = time.perf_counter() - start
+        return embeddings, {
+            "method": label,
+            "processes": cores,
+            "chunks": len(texts),
+            "seconds": round(seconds, 2),
+            "chunks_per_s": round(len(texts) / seconds, 1),
+        }
+
+    baseline, row = timed(
+        "doc-order",
+        1,
+        lambda: embedder.model.encode(
+            texts, batch_size=batch_size, convert_to_numpy=True
+        ),
+    )
+    report = [row]
+
+    for cores in processes:
+        embedder.close()
+        embedder.num_processes = cores
+        embedder.multi_process_min_texts = 0
+        label = "bucketed" if cores <= 1 else "multi-process"
+        embeddings, row = timed(
+            label,
+            cores,
+            lambda: embedder.embed_batch(
+                texts, batch_size=batch_size, show_progress_bar=False
+            ),
+        )
+        # Order must be restored exactly, so every row matches the baseline.
+        row["max_abs_diff"] = float(np.abs(embeddings - baseline).max())
+        report.append(row)
+
+    embedder.close()
+    return report
+
+
+def embedding_drift_report(
+    reference, candidate, texts: List[str], queries: List[str], k: int = 10
+) -> dict:
+    # Cosine agreement with the float model, plus how much the candidate's
+    # top-k neighbours for each query differ from the reference's.
+    def encode(embedder, items):
+        start = time.perf_counter()
+        vectors = embedder.model.encode(items, batch_size=32, convert_to_numpy=True)
+        return np.asarray(vectors, dtype="float32"), time.perf_counter() - start
+
+    ref_docs, ref_seconds = encode(reference, texts)
+    cand_docs, cand_seconds = encode(candidate, texts)
+    ref_queries, _ = encode(reference, queries)
+    cand_queries, _ = encode(candidate, queries)
+
+    def unit(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+    cosine = (unit(ref_docs) * unit(cand_docs)).sum(axis=1)
+
+    k = min(k, len(texts))
+    ref_index = faiss.IndexFlatL2(ref_docs.shape[1])
+    ref_index.add(ref_docs)
+    cand_index = faiss.IndexFlatL2(cand_docs.shape[1])
+    cand_index.add(cand_docs)
+    _, expected = ref_index.search(ref_queries, k)
+    _, found = cand_index.search(cand_queries, k)
+    overlap = np.mean(
+        [len(set(e) & set(f)) / k for e, f in zip(expected.tolist(), found.tolist())]
+    )
+
+    return {
+        "backend": candidate.backend,
+        "texts": len(texts),
+        "mean_cosine": round(float(cosine.mean()), 5),
+        "min_cosine": round(float(cosine.min()), 5),
+        f"top{k}_overlap": round(float(overlap), 4),
+        "reference_chunks_per_s": round(len(texts) / ref_seconds, 1),
+        "candidate_chunks_per_s": round(len(texts) / cand_seconds, 1),
+    }
+
+
+def _load_index_vectors(index_path: str) -> np.ndarray:
+    with open(f"{index_path}.meta", "rb") as f:
+        index_file = pickle.load(f).get("index_file")
+    index_dir = Path(index_path).parent
+    index = faiss.read_index(
+        str(index_dir / index_file) if index_file else f"{index_path}.faiss"
+    )
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def _print_table(rows: List[dict]):
+    columns = []
+    for row in rows:
+        columns.extend(c for c in row if c not in columns)
+
+    print("  ".join(f"{c:>12}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{str(row.get(c, '')):>12}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG system benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ann = subparsers.add_parser("ann", help="ANN recall vs latency against flat")
+    ann.add_argument("--index-path", default=None)
+    ann.add_argument("--synthetic", type=int, default=100000)
+    ann.add_argument("--dim", type=int, default=384)
+    ann.add_argument("--queries", type=int, default=500)
+    ann.add_argument("--k", type=int, default=10)
+    ann.add_argument("--nlist", type=int, default=None)
+
+    pdf = subparsers.add_parser("pdf", help="PDF text extraction throughput")
+    pdf.add_argument("files", nargs="+")
+    pdf.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    pdf.add_argument("--repeats", type=int, default=3)
+
+    ingest = subparsers.add_parser(
+        "ingest", help="Character vs token chunking: truncation and embed cost"
+    )
+    ingest.add_argument("files", nargs="+")
+    ingest.add_argument("--batch-size", type=int, default=32)
+
+    embed = subparsers.add_parser(
+        "embed", help="Embedding throughput: bucketing and worker processes"
+    )
+    embed.add_argument("files", nargs="*")
+    embed.add_argument("--synthetic", type=int, default=5000)
+    embed.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    embed.add_argument("--batch-size", type=int, default=32)
+
+    drift = subparsers.add_parser(
+        "drift", help="Accuracy drift of a quantized/ONNX backend vs the float model"
+    )
+    drift.add_argument("files", nargs="+")
+    drift.add_argument("--backend", required=True)
+    drift.add_argument("--model-dir", default=None)
+    drift.add_argument("--queries", type=int, default=200)
+    drift.add_argument("--k", type=int, default=10)
+    drift.add_argument("--min-cosine", type=float, default=0.99)
+
+    args = parser.parse_args()
+
+    if args.command == "drift":
+        from src.embeddings import EmbeddingGenerator
+
+        processor = DocumentProcessor()
+        texts = [
+            chunk
+            for file_path in args.files
+            for chunk in processor.chunk_text(processor.extract_text(file_path))
+        ]
+        # First sentence of sampled chunks stands in for user questions.
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(texts), min(args.queries, len(texts)), replace=False)
+        queries = [texts[i].split(". ")[0] for i in sample]
+
+        reference = EmbeddingGenerator(backend="torch")
+        candidate = EmbeddingGenerator(backend=args.backend, model_dir=args.model_dir)
+        report = embedding_drift_report(reference, candidate, texts, queries, args.k)
+        _print_table([report])
+
+        if report["min_cosine"] < args.min_cosine:
+            raise SystemExit(
+                f"min cosine {report['min_cosine']} is below {args.min_cosine}"
+            )
+
+    if args.command == "embed":
+        from src.embeddings import EmbeddingGenerator
+
+        embedder = EmbeddingGenerator()
+        if args.files:
+            processor = DocumentProcessor()
+            texts = [
+                chunk
+                for file_path in args.files
+                for chunk in processor.chunk_text(processor.extract_text(file_path))
+            ]
+        else:
+            # Mixed lengths, as in real chunk streams with short headings.
+            rng = np.random.default_rng(0)
+            words = [f"word{i}" for i in range(2000)]
+            texts = [
+                " ".join(rng.choice(words, size=int(rng.integers(3, 200))))
+                for _ in range(args.synthetic)
+            ]
+
+        _print_table(
+            embedding_throughput_report(
+                embedder, texts, args.processes, args.batch_size
+            )
+        )
+
+    if args.command == "ingest":
+        from src.embeddings import EmbeddingGenerator
+
+        embedder = EmbeddingGenerator()
+        _print_table(ingest_report(args.files, embedder, args.batch_size))
+
+    if args.command == "pdf":
+        _print_table(pdf_extraction_report(args.files, args.workers, args.repeats))
+
+    if args.command == "ann":
+        rng = np.random.default_rng(0)
+        if args.index_path:
+            vectors = _load_index_vectors(args.index_path)
+        else:
+            vectors = rng.standard_normal((args.synthetic, args.dim), dtype="float32")
+
+        # Perturbed copies of stored vectors behave like real paraphrased queries.
+        sample = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+        queries = vectors[sample] + rng.normal(
+            scale=0.05, size=(len(sample), vectors.shape[1])
+        ).astype("float32")
+
+        index_params = {"nlist": args.nlist} if args.nlist else None
+        _print_table(ann_recall_report(vectors, queries, args.k, index_params=index_params))
+
+
+if __name__ == "__main__":
+    main()
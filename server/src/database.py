@@ -1,16 +1,23 @@
 from sqlalchemy import (
     create_engine,
+    event,
+    inspect,
+    text,
     Column,
     Integer,
     String,
     DateTime,
     Text,
     ForeignKey,
+    LargeBinary,
+    UniqueConstraint,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import StaticPool
 from datetime import datetime
 import os
+import threading
 
 Base = declarative_base()
 
@@ -40,7 +47,7 @@ class DocumentVersion(Base):
     version_number = Column(Integer, nullable=False)
     file_path = Column(String(512), nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
-    file_hash = Column(String(64))
+    file_hash = Column(String(64), index=True)
     doc_metadata = Column(Text)
     document = relationship("Document", back_populates="versions")
     chunks = relationship(
@@ -58,6 +65,7 @@ class DocumentChunk(Base):
     id = Column(Integer, primary_key=True)
     version_id = Column(Integer, ForeignKey("document_versions.id"), nullable=False)
     chunk_index = Column(Integer, nullable=False)
+    page_number = Column(Integer)
     content = Column(Text, nullable=False)
     faiss_index = Column(Integer)
 
@@ -67,17 +75,140 @@ class DocumentChunk(Base):
         return f"<DocumentChunk(id={self.id}, chunk_index={self.chunk_index})>"
 
 
-def init_db(database_url: str = None):
+class EmbeddingCacheEntry(Base):
+
+    __tablename__ = "embedding_cache"
+    __table_args__ = (UniqueConstraint("model_name", "content_hash"),)
+
+    id = Column(Integer, primary_key=True)
+    model_name = Column(String(255), nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    embedding = Column(LargeBinary, nullable=False)
+    last_used = Column(DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<EmbeddingCacheEntry(model='{self.model_name}', hash='{self.content_hash}')>"
+
+
+class AnalysisCacheEntry(Base):
+
+    __tablename__ = "analysis_cache"
+
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(64), nullable=False, unique=True)
+    kind = Column(String(32), nullable=False)
+    version_id_1 = Column(Integer, index=True)
+    version_id_2 = Column(Integer, index=True)
+    question = Column(Text)
+    model = Column(String(255), nullable=False)
+    prompt_hash = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<AnalysisCacheEntry(kind='{self.kind}', v{self.version_id_1}-v{self.version_id_2})>"
+
+
+_engines = {}  # database_url -> (engine, SessionLocal)
+_engines_lock = threading.Lock()
+
+
+def _resolve_database_url(database_url: str = None) -> str:
     if database_url is None:
         database_url = os.getenv("DATABASE_URL", "sqlite:///./rag_system.db")
+    return database_url
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+    cursor.close()
+
+
+def _create_engine(database_url: str):
+    if database_url.startswith("sqlite"):
+        kwargs = {"connect_args": {"check_same_thread": False}}
+        if ":memory:" in database_url or database_url in ("sqlite://", "sqlite:///"):
+            # In-memory databases only exist per connection, so share one.
+            kwargs["poolclass"] = StaticPool
+        else:
+            kwargs["pool_size"] = int(os.getenv("DB_POOL_SIZE", "5"))
+            kwargs["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+        engine = create_engine(database_url, echo=False, **kwargs)
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        return engine
+
+    return create_engine(
+        database_url,
+        echo=False,
+        pool_pre_ping=True,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    )
+
+
+def _migrate_schema(engine):
+    # create_all() does not alter existing tables. Add any nullable columns and
+    # indexes introduced since the database was created so older databases
+    # keep working.
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {table.name} "
+                        f"ADD COLUMN {column.name} {column_type}"
+                    )
+                )
+
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
 
-    engine = create_engine(database_url, echo=False)
-    Base.metadata.create_all(engine)
 
-    SessionLocal = sessionmaker(bind=engine)
-    return engine, SessionLocal
+def init_db(database_url: str = None):
+    database_url = _resolve_database_url(database_url)
+
+    cached = _engines.get(database_url)
+    if cached is not None:
+        return cached
+
+    with _engines_lock:
+        cached = _engines.get(database_url)
+        if cached is not None:
+            return cached
+
+        engine = _create_engine(database_url)
+        _migrate_schema(engine)
+        Base.metadata.create_all(engine)
+
+        SessionLocal = sessionmaker(bind=engine)
+        _engines[database_url] = (engine, SessionLocal)
+        return engine, SessionLocal
 
 
 def get_db_session(database_url: str = None):
     _, SessionLocal = init_db(database_url)
     return SessionLocal()
+
+
+def dispose_engines():
+    with _engines_lock:
+        for engine, _ in _engines.values():
+            engine.dispose()
+        _engines.clear()
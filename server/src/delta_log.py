@@ -0,0 +1,74 @@
+import os
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterator, List
+
+
+# Record layout: magic, payload length, crc32 of payload, pickled payload.
+_HEADER = struct.Struct("<4sQI")
+_MAGIC = b"RDLG"
+
+
+class DeltaLog:
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def append(self, records: List[dict]):
+        if not records:
+            return
+
+        buffer = bytearray()
+        for record in records:
+            payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            buffer += _HEADER.pack(_MAGIC, len(payload), zlib.crc32(payload))
+            buffer += payload
+
+        with open(self.path, "ab") as f:
+            f.write(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay(self) -> Iterator[dict]:
+        if not Path(self.path).exists():
+            return
+
+        valid_end = 0
+        with open(self.path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if not header:
+                    break
+
+                if len(header) < _HEADER.size:
+                    break
+                magic, length, crc = _HEADER.unpack(header)
+                if magic != _MAGIC:
+                    break
+
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+
+                valid_end = f.tell()
+                yield pickle.loads(payload)
+
+        if valid_end < self.size():
+            # A crash mid-append leaves a torn tail; drop it so new records
+            # are not written after garbage.
+            print(f"Truncating torn delta log tail at byte {valid_end}")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def reset(self):
+        with open(self.path, "wb") as f:
+            f.flush()
+            os.fsync(f.fileno())
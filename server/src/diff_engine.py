@@ -0,0 +1,190 @@
+import difflib
+import hashlib
+from typing import List
+
+
+# Chunks in a replaced region are reported as "modified" when at least this
+# similar; weaker pairs count as one removal plus one addition.
+MODIFIED_MIN_SIMILARITY = 0.5
+# Replaced regions needing more old x new comparisons than this are paired by
+# position instead, keeping the diff linear on wholesale rewrites.
+MAX_PAIRING_COMPARISONS = 2_500
+
+# Size of the changed-region excerpt sent to the LLM.
+PROMPT_CHAR_BUDGET = 6000
+PROMPT_CHUNK_CHARS = 600
+
+
+def _chunk_key(chunk: str) -> bytes:
+    # Chunks are aligned on a normalized digest so whitespace-only edits
+    # (re-wrapped lines, trailing spaces) count as unchanged.
+    normalized = " ".join(chunk.split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+
+def _similarity(a: List[str], b: List[str]) -> float:
+    # Word-level: an order of magnitude cheaper than comparing characters.
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    # The cheap upper bounds reject most unrelated pairs before the full ratio.
+    if matcher.real_quick_ratio() < MODIFIED_MIN_SIMILARITY:
+        return 0.0
+    if matcher.quick_ratio() < MODIFIED_MIN_SIMILARITY:
+        return 0.0
+    return matcher.ratio()
+
+
+class ChunkDiff:
+
+    def __init__(self, old_chunks: List[str], new_chunks: List[str]):
+        self.old_chunks = old_chunks
+        self.new_chunks = new_chunks
+        self.unchanged = 0
+        # Each change: type (added|removed|modified), old_index, new_index and
+        # similarity (modified only), in document order.
+        self.changes: List[dict] = []
+        # (old_start, old_end, new_start, new_end) of each run of changes.
+        self.regions: List[tuple] = []
+        self._compute()
+
+    def _compute(self):
+        self._words = {}
+        old_keys = [_chunk_key(chunk) for chunk in self.old_chunks]
+        new_keys = [_chunk_key(chunk) for chunk in self.new_chunks]
+
+        matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                self.unchanged += i2 - i1
+                continue
+
+            self.regions.append((i1, i2, j1, j2))
+            if tag == "delete":
+                self._add_removed(range(i1, i2))
+            elif tag == "insert":
+                self._add_added(range(j1, j2))
+            else:
+                self._pair_replaced(i1, i2, j1, j2)
+
+    def _add_removed(self, old_indices):
+        for i in old_indices:
+            self.changes.append(
+                {"type": "removed", "old_index": i, "new_index": None}
+            )
+
+    def _add_added(self, new_indices):
+        for j in new_indices:
+            self.changes.append(
+                {"type": "added", "old_index": None, "new_index": j}
+            )
+
+    def _pair_replaced(self, i1: int, i2: int, j1: int, j2: int):
+        # Greedy in-order pairing: each old chunk takes the most similar new
+        # chunk after the previous match, so pairs never cross.
+        positional = (i2 - i1) * (j2 - j1) > MAX_PAIRING_COMPARISONS
+        next_j = j1
+        for i in range(i1, i2):
+            if next_j >= j2:
+                self._add_removed(range(i, i2))
+                return
+
+            if positional:
+                best_j = next_j
+                best_score = self._similarity(i, best_j)
+            else:
+                best_j, best_score = None, 0.0
+                for j in range(next_j, j2):
+                    score = self._similarity(i, j)
+                    if score > best_score:
+                        best_j, best_score = j, score
+
+            if best_j is None or best_score < MODIFIED_MIN_SIMILARITY:
+                self._add_removed([i])
+                continue
+
+            self._add_added(range(next_j, best_j))
+            self.changes.append(
+                {
+                    "type": "modified",
+                    "old_index": i,
+                    "new_index": best_j,
+                    "similarity": round(best_score, 3),
+                }
+            )
+            next_j = best_j + 1
+
+        self._add_added(range(next_j, j2))
+
+    def _similarity(self, i: int, j: int) -> float:
+        old_words = self._words.get(("old", i))
+        if old_words is None:
+            old_words = self._words[("old", i)] = self.old_chunks[i].split()
+        new_words = self._words.get(("new", j))
+        if new_words is None:
+            new_words = self._words[("new", j)] = self.new_chunks[j].split()
+        return _similarity(old_words, new_words)
+
+    def count(self, change_type: str) -> int:
+        return sum(1 for change in self.changes if change["type"] == change_type)
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.changes)
+
+    def stats(self) -> dict:
+        return {
+            "unchanged": self.unchanged,
+            "added": self.count("added"),
+            "removed": self.count("removed"),
+            "modified": self.count("modified"),
+        }
+
+    def format_for_prompt(
+        self,
+        char_budget: int = PROMPT_CHAR_BUDGET,
+        chunk_chars: int = PROMPT_CHUNK_CHARS,
+        old_label: str = "Previous",
+        new_label: str = "Current",
+    ) -> str:
+        # Only changed regions, each chunk clipped, until the budget runs out;
+        # unchanged text never reaches the LLM.
+        parts = []
+        used = 0
+        for number, (i1, i2, j1, j2) in enumerate(self.regions, start=1):
+            lines = [f"Change {number}:"]
+            for label, chunks in (
+                (old_label, self.old_chunks[i1:i2]),
+                (new_label, self.new_chunks[j1:j2]),
+            ):
+                if chunks:
+                    text = " ... ".join(_clip(chunk, chunk_chars) for chunk in chunks)
+                    lines.append(f"{label}: {text}")
+            block = "\n".join(lines)
+
+            if parts and used + len(block) > char_budget:
+                omitted = len(self.regions) - number + 1
+                parts.append(f"({omitted} more changed regions omitted)")
+                break
+            parts.append(block)
+            used += len(block)
+
+        return "\n\n".join(parts)
+
+    def summary(self) -> str:
+        stats = self.stats()
+        if not self.has_changes:
+            return "No content changes"
+        return (
+            f"{stats['modified']} chunks modified, {stats['added']} added and "
+            f"{stats['removed']} removed; {stats['unchanged']} unchanged"
+        )
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + " ..."
+
+
+def diff_chunks(old_chunks: List[str], new_chunks: List[str]) -> ChunkDiff:
+    return ChunkDiff(old_chunks, new_chunks)
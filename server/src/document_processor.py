@@ -1,40 +1,246 @@
-import hashlib
-from typing import List, Tuple
+import bisect
+import math
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
 import pypdf
 
+from src.hashing import hash_file
+
+
+PDF_EXTRACT_WORKERS = int(
+    os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+# Below this many pages, process start-up and pickling cost more than they save.
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+
+TEXT_READ_BLOCK_CHARS = 1 << 20
+
+_NON_SPACE = re.compile(r"\S")
+# Sentence ends: terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace, or a blank line.
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+|\n\s*\n")
+
+CHUNK_MODES = ("chars", "tokens")
+MAX_PENDING_SENTENCE_CHARS = 1 << 16
+
+_pdf_pools = {}
+_pdf_pools_lock = threading.Lock()
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    with open(file_path, "rb") as file:
+        pdf_reader = pypdf.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    with _pdf_pools_lock:
+        pool = _pdf_pools.get(workers)
+        if pool is None:
+            # spawn rather than fork: the server process is multi-threaded.
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pdf_pools[workers] = pool
+        return pool
+
+
+def shutdown_pdf_pools():
+    with _pdf_pools_lock:
+        for pool in _pdf_pools.values():
+            pool.shutdown(wait=True)
+        _pdf_pools.clear()
+
 
 class DocumentProcessor:
 
-    def __init__(self, chunk_size: int = 512, chunk_overlap: int = 50):
+    def __init__(
+        self,
+        chunk_size: int = 512,
+        chunk_overlap: int = 50,
+        pdf_workers: int = None,
+        chunk_mode: str = "chars",
+        tokenizer=None,
+        max_tokens: int = None,
+        overlap_tokens: int = 32,
+    ):
+        if chunk_mode not in CHUNK_MODES:
+            raise ValueError(
+                f"Unknown chunk mode '{chunk_mode}', expected one of {CHUNK_MODES}"
+            )
+        if not 0 <= chunk_overlap <= chunk_size // 2:
+            # Chunk starts only move forward (which streaming chunking relies
+            # on) when the overlap is at most half a chunk.
+            raise ValueError("chunk_overlap must be between 0 and chunk_size / 2")
+
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.pdf_workers = pdf_workers or PDF_EXTRACT_WORKERS
+        self.chunk_mode = chunk_mode
 
-    def extract_text_from_pdf(self, file_path: str) -> str:
-        text = ""
+        if chunk_mode == "tokens":
+            if tokenizer is None or not max_tokens:
+                raise ValueError("Token chunking needs a tokenizer and max_tokens")
+            if not getattr(tokenizer, "is_fast", False):
+                raise ValueError("Token chunking needs a fast (Rust) tokenizer")
+
+            self.tokenizer = tokenizer
+            # Leave room for the [CLS]/[SEP]-style tokens the model adds.
+            self.max_tokens = max_tokens - tokenizer.num_special_tokens_to_add()
+            self.overlap_tokens = min(overlap_tokens, self.max_tokens // 2)
+
+    def iter_pdf_pages(self, file_path: str) -> Iterator[str]:
         try:
             with open(file_path, "rb") as file:
-                pdf_reader = pypdf.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+                num_pages = len(pypdf.PdfReader(file).pages)
+
+            if self.pdf_workers <= 1 or num_pages < PDF_PARALLEL_MIN_PAGES:
+                yield from _extract_page_range(file_path, 0, num_pages)
+                return
+
+            # Several ranges per worker so one slow range does not hold up
+            # the rest of the pool. Only a bounded window of ranges is in
+            # flight, so pages are not all held in memory at once.
+            range_size = max(1, math.ceil(num_pages / (self.pdf_workers * 4)))
+            pool = _get_pdf_pool(self.pdf_workers)
+            ranges = [
+                (start, min(start + range_size, num_pages))
+                for start in range(0, num_pages, range_size)
+            ]
+
+            in_flight = deque()
+            for start, end in ranges:
+                in_flight.append(
+                    pool.submit(_extract_page_range, file_path, start, end)
+                )
+                if len(in_flight) >= self.pdf_workers * 2:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
         except Exception as e:
             raise ValueError(f"Error reading PDF: {str(e)}")
 
-        return text.strip()
+    def extract_pdf_pages(self, file_path: str) -> List[str]:
+        return list(self.iter_pdf_pages(file_path))
 
-    def chunk_text(self, text: str) -> List[str]:
-        if not text:
-            return []
+    def extract_text_from_pdf(self, file_path: str) -> str:
+        text, _ = self.extract_pdf_text_with_pages(file_path)
+        return text
 
-        chunks = []
-        start = 0
-        text_length = len(text)
+    def extract_pdf_text_with_pages(self, file_path: str) -> Tuple[str, List[int]]:
+        pages = self.extract_pdf_pages(file_path)
+
+        page_offsets = []
+        offset = 0
+        for page in pages:
+            page_offsets.append(offset)
+            offset += len(page) + 1
+
+        raw = "\n".join(pages)
+        text = raw.lstrip()
+        leading = len(raw) - len(text)
+        text = text.rstrip()
+
+        page_offsets = [max(0, o - leading) for o in page_offsets]
+        return text, page_offsets
+
+    def iter_text_blocks(
+        self, file_path: str
+    ) -> Iterator[Tuple[str, Optional[int]]]:
+        # Yields (text, page_number) pieces of the document in order;
+        # page_number is set on the piece that starts a PDF page.
+        file_ext = Path(file_path).suffix.lower()
+
+        if file_ext == ".pdf":
+            for i, page in enumerate(self.iter_pdf_pages(file_path)):
+                if i:
+                    yield "\n", None
+                yield page, i + 1
+        elif file_ext == ".txt":
+            with open(file_path, "r", encoding="utf-8") as f:
+                for block in iter(lambda: f.read(TEXT_READ_BLOCK_CHARS), ""):
+                    yield block, None
+        else:
+            raise ValueError(f"Unsupported file type: {file_ext}")
+
+    def iter_document_chunks(
+        self, file_path: str
+    ) -> Iterator[Tuple[str, Optional[int]]]:
+        strip = Path(file_path).suffix.lower() == ".pdf"
+        for chunk, _, page_number in self._iter_spans(
+            self.iter_text_blocks(file_path), strip=strip
+        ):
+            yield chunk, page_number
 
-        while start < text_length:
+    def _iter_spans(
+        self, blocks: Iterable[Tuple[str, Optional[int]]], strip: bool = False
+    ) -> Iterator[Tuple[str, int, Optional[int]]]:
+        if self.chunk_mode == "tokens":
+            return self._iter_token_spans(blocks, strip)
+        return self._iter_char_spans(blocks, strip)
+
+    def _iter_char_spans(
+        self, blocks: Iterable[Tuple[str, Optional[int]]], strip: bool = False
+    ) -> Iterator[Tuple[str, int, Optional[int]]]:
+        # Same boundaries as chunking the concatenated blocks in one go, but
+        # only a window around the current chunk is kept in memory. With
+        # strip=True the text is chunked as if it had been stripped first.
+        blocks = iter(blocks)
+        buffer = ""
+        buffer_start = 0
+        exhausted = False
+        leading = strip
+        page_offsets: List[int] = []
+        page_numbers: List[int] = []
+
+        def read_block():
+            nonlocal buffer, exhausted, leading
+            try:
+                block, page_number = next(blocks)
+            except StopIteration:
+                exhausted = True
+                return
+
+            if leading:
+                block = block.lstrip()
+                leading = not block
+            if page_number is not None:
+                page_offsets.append(buffer_start + len(buffer))
+                page_numbers.append(page_number)
+            buffer += block
+
+        def has_text_from(offset: int) -> bool:
+            # True if the (stripped) text extends past `offset`, reading
+            # ahead only as far as needed to tell.
+            while True:
+                position = offset - buffer_start
+                if strip:
+                    if _NON_SPACE.search(buffer, position):
+                        return True
+                elif len(buffer) > position:
+                    return True
+                if exhausted:
+                    return False
+                read_block()
+
+        def page_at(offset: int) -> Optional[int]:
+            i = bisect.bisect_right(page_offsets, offset)
+            return page_numbers[i - 1] if i else None
+
+        start = 0
+        while has_text_from(start):
             end = start + self.chunk_size
-            chunk = text[start:end]
+            more = has_text_from(end)
+            chunk = buffer[start - buffer_start : end - buffer_start]
 
-            if end < text_length:
+            if more:
                 last_period = chunk.rfind(".")
                 last_newline = chunk.rfind("\n")
                 break_point = max(last_period, last_newline)
@@ -43,32 +249,213 @@ class DocumentProcessor:
                     chunk = chunk[: break_point + 1]
                     end = start + break_point + 1
 
-            chunks.append(chunk.strip())
+            stripped = chunk.strip()
+            if stripped:
+                offset = start + len(chunk) - len(chunk.lstrip())
+                yield stripped, offset, page_at(offset)
 
             start = end - self.chunk_overlap
 
-        return [c for c in chunks if c]
+            # Drop consumed text once it is at least half the buffer, which
+            # keeps trimming amortized O(1) per character.
+            consumed = start - buffer_start
+            if consumed > 0 and consumed * 2 >= len(buffer):
+                buffer = buffer[consumed:]
+                buffer_start = start
+                keep = bisect.bisect_right(page_offsets, start) - 1
+                if keep > 0:
+                    del page_offsets[:keep]
+                    del page_numbers[:keep]
 
-    def process_document(self, file_path: str) -> Tuple[str, List[str]]:
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        encoded = self.tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def _split_long_sentence(
+        self, sentence: str, offset: int
+    ) -> List[Tuple[str, int, int]]:
+        # Cut at token boundaries so no piece exceeds the model's window.
+        spans = self.tokenizer(
+            sentence, add_special_tokens=False, return_offsets_mapping=True
+        )["offset_mapping"]
+
+        pieces = []
+        for i in range(0, len(spans), self.max_tokens):
+            window = spans[i : i + self.max_tokens]
+            start = window[0][0]
+            if i + self.max_tokens < len(spans):
+                end = spans[i + self.max_tokens][0]
+            else:
+                end = len(sentence)
+            pieces.append((sentence[start:end], offset + start, len(window)))
+        return pieces
+
+    def _sentence_units(
+        self, text: str, text_start: int, final: bool
+    ) -> Tuple[List[Tuple[str, int, int]], int]:
+        # Splits text into (raw text, offset of first non-space char, tokens)
+        # units. Unless final, the trailing sentence may still be growing and
+        # is left unconsumed; returns the units and how much text was consumed.
+        bounds = [m.end() for m in _SENTENCE_END.finditer(text)]
+        if final and (not bounds or bounds[-1] < len(text)):
+            bounds.append(len(text))
+
+        pieces = []
+        previous = 0
+        for bound in bounds:
+            raw = text[previous:bound]
+            stripped = raw.strip()
+            if stripped:
+                leading = len(raw) - len(raw.lstrip())
+                pieces.append((raw, stripped, text_start + previous + leading))
+            previous = bound
+
+        lengths = self._token_lengths([stripped for _, stripped, _ in pieces])
+
+        units = []
+        for (raw, stripped, offset), length in zip(pieces, lengths):
+            if length > self.max_tokens:
+                split_pieces = self._split_long_sentence(stripped, offset)
+                # Keep the separator so the next sentence does not run on.
+                piece_text, piece_offset, tokens = split_pieces[-1]
+                split_pieces[-1] = (
+                    piece_text + raw[len(raw.rstrip()) :],
+                    piece_offset,
+                    tokens,
+                )
+                units.extend(split_pieces)
+            else:
+                units.append((raw, offset, length))
+        return units, previous
+
+    def _iter_token_spans(
+        self, blocks: Iterable[Tuple[str, Optional[int]]], strip: bool = False
+    ) -> Iterator[Tuple[str, int, Optional[int]]]:
+        # Packs whole sentences until the next one would push the chunk past
+        # the model's token window. Consecutive chunks share trailing
+        # sentences worth up to overlap_tokens. WordPiece-style tokenizers
+        # split on whitespace first, so sentence token counts add up exactly.
+        buffer = ""
+        buffer_start = 0
+        leading = strip
+        page_offsets: List[int] = []
+        page_numbers: List[int] = []
+
+        current: List[Tuple[str, int, int]] = []
+        current_tokens = 0
+
+        def page_at(offset: int) -> Optional[int]:
+            i = bisect.bisect_right(page_offsets, offset)
+            return page_numbers[i - 1] if i else None
+
+        def emit(units):
+            offset = units[0][1]
+            return "".join(raw for raw, _, _ in units).strip(), offset, page_at(offset)
+
+        def pack(units):
+            nonlocal current, current_tokens
+            for unit in units:
+                if current and current_tokens + unit[2] > self.max_tokens:
+                    yield emit(current)
+
+                    carry = []
+                    carry_tokens = 0
+                    for previous in reversed(current):
+                        if carry_tokens + previous[2] > self.overlap_tokens:
+                            break
+                        carry.insert(0, previous)
+                        carry_tokens += previous[2]
+                    if carry_tokens + unit[2] > self.max_tokens:
+                        carry, carry_tokens = [], 0
+                    current, current_tokens = carry, carry_tokens
+
+                current.append(unit)
+                current_tokens += unit[2]
+
+        for block, page_number in blocks:
+            if leading:
+                block = block.lstrip()
+                leading = not block
+            if page_number is not None:
+                page_offsets.append(buffer_start + len(buffer))
+                page_numbers.append(page_number)
+            buffer += block
+
+            units, consumed = self._sentence_units(buffer, buffer_start, final=False)
+            if len(buffer) - consumed > MAX_PENDING_SENTENCE_CHARS:
+                # No sentence boundary in sight; cut at the last whitespace so
+                # unpunctuated input cannot grow the buffer without bound.
+                cut = max(buffer.rfind(" ") + 1, buffer.rfind("\n") + 1, consumed)
+                if cut == consumed:
+                    cut = len(buffer)
+                tail_units, _ = self._sentence_units(
+                    buffer[consumed:cut], buffer_start + consumed, final=True
+                )
+                units += tail_units
+                consumed = cut
+
+            buffer = buffer[consumed:]
+            buffer_start += consumed
+            yield from pack(units)
+
+        units, _ = self._sentence_units(buffer, buffer_start, final=True)
+        yield from pack(units)
+        if current:
+            yield emit(current)
+
+    def _chunk_spans(self, text: str) -> List[Tuple[str, int]]:
+        spans = self._iter_spans([(text, None)])
+        return [(chunk, offset) for chunk, offset, _ in spans]
+
+    def chunk_text(self, text: str) -> List[str]:
+        return [chunk for chunk, _ in self._chunk_spans(text)]
+
+    def chunk_text_with_pages(
+        self, text: str, page_offsets: Optional[List[int]] = None
+    ) -> Tuple[List[str], List[Optional[int]]]:
+        spans = self._chunk_spans(text)
+        chunks = [chunk for chunk, _ in spans]
+
+        if not page_offsets:
+            return chunks, [None] * len(chunks)
+
+        page_numbers = [
+            bisect.bisect_right(page_offsets, offset) for _, offset in spans
+        ]
+        return chunks, page_numbers
+
+    def extract_text_with_pages(
+        self, file_path: str
+    ) -> Tuple[str, Optional[List[int]]]:
 
         file_ext = Path(file_path).suffix.lower()
 
         if file_ext == ".pdf":
-            text = self.extract_text_from_pdf(file_path)
+            return self.extract_pdf_text_with_pages(file_path)
         elif file_ext == ".txt":
             with open(file_path, "r", encoding="utf-8") as f:
-                text = f.read()
+                return f.read(), None
         else:
             raise ValueError(f"Unsupported file type: {file_ext}")
 
+    def extract_text(self, file_path: str) -> str:
+        text, _ = self.extract_text_with_pages(file_path)
+        return text
+
+    def process_document(self, file_path: str) -> Tuple[str, List[str]]:
+
+        text = self.extract_text(file_path)
         chunks = self.chunk_text(text)
 
         return text, chunks
 
     @staticmethod
     def compute_file_hash(file_path: str) -> str:
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return hash_file(file_path)
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+
+
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx")
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+
+
+def load_backend(backend: str, model_name: str, model_dir: str = None):
+    # Every backend returns an object with the SentenceTransformer surface
+    # EmbeddingGenerator relies on: encode(), tokenizer, max_seq_length and
+    # get_sentence_embedding_dimension().
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend '{backend}', "
+            f"expected one of {EMBEDDING_BACKENDS}"
+        )
+
+    if backend == "onnx":
+        if not model_dir:
+            raise ValueError(
+                "The onnx backend loads from EMBEDDING_MODEL_DIR; create it with "
+                "`python -m src.embedding_backends export --output <dir>`"
+            )
+        return OnnxSentenceEncoder(model_dir)
+
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_dir or model_name)
+    if backend == "int8":
+        model = quantize_int8(model)
+    return model
+
+
+def quantize_int8(model):
+    import torch
+
+    # Linear layers dominate MiniLM/BERT inference on CPU; int8 weights with
+    # dynamic activation scales need no calibration data.
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class OnnxSentenceEncoder:
+
+    def __init__(self, model_dir: str, onnx_file: str = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_dir = Path(model_dir)
+        self.onnx_file = onnx_file or os.getenv("EMBEDDING_ONNX_FILE", ONNX_FILE)
+        onnx_path = self.model_dir / self.onnx_file
+        if not onnx_path.exists():
+            raise FileNotFoundError(f"ONNX model not found: {onnx_path}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = int(os.getenv("ORT_NUM_THREADS", "0"))
+        self.session = ort.InferenceSession(
+            str(onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_dir))
+        self.pooling, self.normalize = self._read_sentence_transformers_config()
+        self.max_seq_length = self._read_json("sentence_bert_config.json").get(
+            "max_seq_length", min(self.tokenizer.model_max_length, 512)
+        )
+        self.embedding_dim = self._read_json("config.json")["hidden_size"]
+
+    def _read_json(self, name: str) -> dict:
+        path = self.model_dir / name
+        if not path.exists():
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _read_sentence_transformers_config(self):
+        pooling = "mean"
+        normalize = False
+        for module in self._read_json("modules.json") or []:
+            module_type = module.get("type", "")
+            if module_type.endswith("Pooling"):
+                config = self._read_json(f"{module['path']}/config.json")
+                if config.get("pooling_mode_cls_token"):
+                    pooling = "cls"
+            elif module_type.endswith("Normalize"):
+                normalize = True
+        return pooling, normalize
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.embedding_dim
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            encoded = self.tokenizer(
+                sentences[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {
+                name: encoded[name].astype("int64")
+                for name in self._input_names
+                if name in encoded
+            }
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            if self.pooling == "cls":
+                pooled = token_embeddings[:, 0]
+            else:
+                mask = encoded["attention_mask"][..., None].astype("float32")
+                pooled = (token_embeddings * mask).sum(axis=1) / np.clip(
+                    mask.sum(axis=1), 1e-9, None
+                )
+
+            if self.normalize:
+                pooled = pooled / np.clip(
+                    np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None
+                )
+            outputs.append(pooled.astype("float32"))
+
+        embeddings = (
+            np.concatenate(outputs)
+            if outputs
+            else np.zeros((0, self.embedding_dim), dtype="float32")
+        )
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = False) -> Path:
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Saving the SentenceTransformer first writes the tokenizer, pooling and
+    # normalization config the ONNX encoder reads back.
+    model = SentenceTransformer(model_name, device="cpu")
+    model.save(str(output_dir))
+
+    transformer = model[0].auto_model.eval()
+    dummy = model.tokenizer(
+        ["an example sentence"], padding=True, return_tensors="pt"
+    )
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in dummy
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    onnx_path = output_dir / ONNX_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(dummy[name] for name in input_names),
+            str(onnx_path),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    print(f"Exported {model_name} to {onnx_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = output_dir / ONNX_INT8_FILE
+        quantize_dynamic(
+            str(onnx_path), str(quantized_path), weight_type=QuantType.QInt8
+        )
+        print(f"Wrote int8 model to {quantized_path}")
+
+    return onnx_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding model backends")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="Export the model to ONNX")
+    export.add_argument(
+        "--model", default=os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    )
+    export.add_argument("--output", required=True)
+    export.add_argument("--quantize", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model, args.output, args.quantize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import hashlib
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from src.database import get_db_session, EmbeddingCacheEntry
+
+
+# Keeps IN (...) lists under SQLite's bound-parameter limit.
+_QUERY_BATCH = 500
+
+# The entry count is tracked in memory between writes; it is re-read from the
+# table this often, since other workers write to the same table.
+_RECOUNT_EVERY_WRITES = 100
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+
+    def __init__(
+        self, database_url: str = None, model_name: str = "", max_entries: int = None
+    ):
+        self.database_url = database_url
+        self.model_name = model_name
+        self.max_entries = max_entries or int(
+            os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")
+        )
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entry_count = None
+        self._writes_since_count = 0
+
+    def embed_batch(self, embedder, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, embedder.get_embedding_dim()), dtype="float32")
+
+        hashes = [content_hash(text) for text in texts]
+        cached = self.get_many(hashes)
+
+        missing: Dict[str, str] = {}
+        for text, key in zip(texts, hashes):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = embedder.embed_batch(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.put_many(computed)
+            cached.update(computed)
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        return np.stack([cached[key] for key in hashes]).astype("float32")
+
+    def get_many(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        unique = list(dict.fromkeys(hashes))
+        found: Dict[str, np.ndarray] = {}
+
+        session = get_db_session(self.database_url)
+        try:
+            for start in range(0, len(unique), _QUERY_BATCH):
+                batch = unique[start : start + _QUERY_BATCH]
+                rows = (
+                    session.query(
+                        EmbeddingCacheEntry.content_hash, EmbeddingCacheEntry.embedding
+                    )
+                    .filter(
+                        EmbeddingCacheEntry.model_name == self.model_name,
+                        EmbeddingCacheEntry.content_hash.in_(batch),
+                    )
+                    .all()
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+
+                if rows:
+                    session.query(EmbeddingCacheEntry).filter(
+                        EmbeddingCacheEntry.model_name == self.model_name,
+                        EmbeddingCacheEntry.content_hash.in_([key for key, _ in rows]),
+                    ).update(
+                        {EmbeddingCacheEntry.last_used: datetime.utcnow()},
+                        synchronize_session=False,
+                    )
+
+            session.commit()
+        except Exception as e:
+            # A cache failure should only cost extra model calls.
+            session.rollback()
+            print(f"Embedding cache lookup failed: {e}")
+        finally:
+            session.close()
+
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]):
+        if not vectors:
+            return
+
+        session = get_db_session(self.database_url)
+        try:
+            now = datetime.utcnow()
+            rows = [
+                {
+                    "model_name": self.model_name,
+                    "content_hash": key,
+                    "embedding": np.asarray(vector, dtype="float32").tobytes(),
+                    "last_used": now,
+                }
+                for key, vector in vectors.items()
+            ]
+            # The ingestion embed worker and a streaming upload can cache the
+            # same chunk text concurrently; keep whichever row landed first
+            # instead of failing the whole batch on the unique constraint.
+            session.execute(_insert_ignore(session).values(rows))
+            session.commit()
+
+            self._evict(session, len(rows))
+        except Exception as e:
+            session.rollback()
+            print(f"Embedding cache write failed: {e}")
+        finally:
+            session.close()
+
+    def _evict(self, session, inserted: int):
+        # COUNT(*) scans the table, so it only runs when the tracked count
+        # (an upper bound: conflicting rows were not inserted) says the cache
+        # may be full, or periodically to pick up other workers' writes.
+        with self._lock:
+            self._writes_since_count += 1
+            if self._entry_count is not None:
+                self._entry_count += inserted
+            recount = (
+                self._entry_count is None
+                or self._entry_count > self.max_entries
+                or self._writes_since_count >= _RECOUNT_EVERY_WRITES
+            )
+        if not recount:
+            return
+
+        total = session.query(EmbeddingCacheEntry).count()
+        overflow = total - self.max_entries
+        with self._lock:
+            self._entry_count = min(total, self.max_entries)
+            self._writes_since_count = 0
+        if overflow <= 0:
+            return
+
+        oldest = (
+            session.query(EmbeddingCacheEntry.id)
+            .order_by(EmbeddingCacheEntry.last_used)
+            .limit(overflow)
+            .subquery()
+        )
+        session.query(EmbeddingCacheEntry).filter(
+            EmbeddingCacheEntry.id.in_(oldest.select())
+        ).delete(synchronize_session=False)
+        session.commit()
+
+        with self._lock:
+            self.evictions += overflow
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model_name": self.model_name,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _insert_ignore(session):
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy import insert
+
+        return insert(EmbeddingCacheEntry).prefix_with("IGNORE")
+    return insert(EmbeddingCacheEntry).on_conflict_do_nothing(
+        index_elements=["model_name", "content_hash"]
+    )
@@ -1,33 +1,147 @@
 from typing import List
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import os
+import threading
+from pathlib import Path
+
+from src.embedding_backends import load_backend
 
 
 class EmbeddingGenerator:
 
-    def __init__(self, model_name: str = None):
+    def __init__(
+        self, model_name: str = None, backend: str = None, model_dir: str = None
+    ):
         self.model_name = model_name or os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
-        print(f"Loading embedding model: {self.model_name}")
-        self.model = SentenceTransformer(self.model_name)
+        self.backend = backend or os.getenv("EMBEDDING_BACKEND", "torch")
+        self.model_dir = model_dir or os.getenv("EMBEDDING_MODEL_DIR")
+        print(f"Loading embedding model: {self.model_name} ({self.backend})")
+        self.model = load_backend(self.backend, self.model_name, self.model_dir)
+        # Cached vectors are only reused for the same weights: a custom model
+        # directory, a quantized backend and each ONNX export (fp32 or int8)
+        # get their own namespace.
+        namespace = [self.model_name]
+        if self.model_dir:
+            namespace.append(str(Path(self.model_dir).resolve()))
+        if self.backend != "torch":
+            namespace.append(self.backend)
+        if self.backend == "onnx":
+            namespace.append(self.model.onnx_file)
+        self.cache_namespace = ":".join(namespace)
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
         print(f"Model loaded. Embedding dimension: {self.embedding_dim}")
 
+        # Padded tokens per forward pass; batches of short texts grow to fill it.
+        self.token_budget = int(os.getenv("EMBED_TOKEN_BUDGET", "8192"))
+        self.max_batch_size = int(os.getenv("EMBED_MAX_BATCH_SIZE", "256"))
+        # Worker processes for large ingests; 0 or 1 keeps encoding in-process.
+        self.num_processes = int(os.getenv("EMBED_PROCESSES", "0"))
+        self.multi_process_min_texts = int(
+            os.getenv("EMBED_MULTI_PROCESS_MIN_TEXTS", "2000")
+        )
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
     def embed_text(self, text: str) -> np.ndarray:
         return self.model.encode(text, convert_to_numpy=True)
 
-    def embed_batch(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+    def embed_batch(
+        self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = None
+    ) -> np.ndarray:
         if not texts:
             return np.array([])
 
-        embeddings = self.model.encode(
+        if show_progress_bar is None:
+            show_progress_bar = len(texts) > 10
+
+        if len(texts) <= batch_size:
+            return self._encode(texts, batch_size, show_progress_bar)
+
+        # Sort by token length so each batch pads to similar lengths, then
+        # scatter the results back into input order.
+        lengths = np.asarray(self.token_lengths(texts))
+        order = np.argsort(lengths, kind="stable")
+        sorted_texts = [texts[i] for i in order]
+
+        if (
+            self.num_processes > 1
+            and self.backend == "torch"
+            and len(texts) >= self.multi_process_min_texts
+        ):
+            sorted_embeddings = self.model.encode_multi_process(
+                sorted_texts, self._get_pool(), batch_size=batch_size
+            )
+        else:
+            sorted_embeddings = np.concatenate(
+                [
+                    self._encode(
+                        sorted_texts[start:end], end - start, show_progress_bar=False
+                    )
+                    for start, end in self._buckets(lengths[order].tolist())
+                ]
+            )
+
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+    def _encode(
+        self, texts: List[str], batch_size: int, show_progress_bar: bool
+    ) -> np.ndarray:
+        return self.model.encode(
             texts,
             batch_size=batch_size,
             convert_to_numpy=True,
-            show_progress_bar=len(texts) > 10,
+            show_progress_bar=show_progress_bar,
         )
 
-        return embeddings
+    def _buckets(self, sorted_lengths: List[int]):
+        # Lengths are ascending, so a batch's padded size is its last length
+        # times its size. Close the batch before that would exceed the budget.
+        start = 0
+        for i, length in enumerate(sorted_lengths):
+            size = i - start + 1
+            if i > start and (
+                length * size > self.token_budget or size > self.max_batch_size
+            ):
+                yield start, i
+                start = i
+        if start < len(sorted_lengths):
+            yield start, len(sorted_lengths)
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        encoded = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                print(f"Starting {self.num_processes} embedding worker processes")
+                self._pool = self.model.start_multi_process_pool(
+                    target_devices=["cpu"] * self.num_processes
+                )
+            return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
 
     def get_embedding_dim(self) -> int:
         return self.embedding_dim
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    @property
+    def max_seq_length(self) -> int:
+        # Inputs longer than this many tokens are silently truncated by encode().
+        return self.model.max_seq_length
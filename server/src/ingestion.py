@@ -0,0 +1,332 @@
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class IngestionJob:
+
+    def __init__(
+        self,
+        file_path: str,
+        doc_name: str,
+        delete_source: bool = False,
+        file_hash: str = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.doc_name = doc_name
+        self.delete_source = delete_source
+        self.file_hash = file_hash
+        self.streaming = False
+        self.stage_dir: Optional[str] = None
+        self.num_batches = 0
+
+        self.status = "queued"
+        self.created_at = datetime.utcnow()
+        self.updated_at = self.created_at
+        self.stage_seconds = {}
+        self._stage_started = time.perf_counter()
+
+        self.chunks: List[str] = []
+        self.page_numbers: List[Optional[int]] = []
+        self.embeddings: Optional[np.ndarray] = None
+        self.num_chunks = 0
+        self.embedded = 0
+
+        self.result = None
+        self.error = None
+        self.future = Future()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def set_status(self, status: str):
+        now = time.perf_counter()
+        self.stage_seconds[self.status] = round(now - self._stage_started, 3)
+        self._stage_started = now
+        self.status = status
+        self.updated_at = datetime.utcnow()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "document_name": self.doc_name,
+            "status": self.status,
+            "streaming": self.streaming,
+            "num_chunks": self.num_chunks,
+            "chunks_embedded": self.embedded,
+            "progress": round(self.embedded / self.num_chunks, 3)
+            if self.num_chunks
+            else (1.0 if self.status == "completed" else 0.0),
+            "stage_seconds": dict(self.stage_seconds),
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class IngestionPipeline:
+    # extract -> chunk -> embed -> index, each stage on its own thread(s) and
+    # connected by queues. The embed stage packs chunks from every queued
+    # document into shared model batches; the index stage is single-threaded
+    # because it assigns version numbers and FAISS ids. Files too large to
+    # hold in memory are chunked and embedded to a staging directory on an
+    # extract worker, so the index stage only reads the staged batches back.
+
+    def __init__(
+        self,
+        rag_system,
+        max_queue_depth: int = None,
+        extract_workers: int = None,
+        embed_batch_size: int = None,
+        embed_wait_ms: float = None,
+        max_finished_jobs: int = 1000,
+    ):
+        self.rag_system = rag_system
+        self.max_queue_depth = max_queue_depth or int(
+            os.getenv("INGEST_MAX_QUEUE_DEPTH", "32")
+        )
+        extract_workers = extract_workers or int(
+            os.getenv("INGEST_EXTRACT_WORKERS", "2")
+        )
+        self.embed_batch_size = embed_batch_size or int(
+            os.getenv("INGEST_EMBED_BATCH_SIZE", "128")
+        )
+        if embed_wait_ms is None:
+            embed_wait_ms = float(os.getenv("INGEST_EMBED_WAIT_MS", "20"))
+        self.embed_wait = embed_wait_ms / 1000
+        self.max_finished_jobs = max_finished_jobs
+
+        self._extract_queue: "queue.Queue[IngestionJob]" = queue.Queue()
+        self._chunk_queue: "queue.Queue[tuple]" = queue.Queue()
+        self._embed_queue: "queue.Queue[tuple]" = queue.Queue()
+        self._index_queue: "queue.Queue[IngestionJob]" = queue.Queue()
+
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._active = 0
+        self.completed = 0
+        self.failed = 0
+
+        workers = [
+            (self._extract_worker, f"ingest-extract-{i}")
+            for i in range(extract_workers)
+        ]
+        workers += [
+            (self._chunk_worker, "ingest-chunk"),
+            (self._embed_worker, "ingest-embed"),
+            (self._index_worker, "ingest-index"),
+        ]
+        for target, name in workers:
+            threading.Thread(target=target, name=name, daemon=True).start()
+
+    def submit(
+        self,
+        file_path: str,
+        doc_name: str,
+        delete_source: bool = False,
+        file_hash: str = None,
+    ) -> IngestionJob:
+        with self._lock:
+            if self._active >= self.max_queue_depth:
+                raise QueueFullError(
+                    f"Ingestion queue is full ({self.max_queue_depth} jobs pending)"
+                )
+            self._active += 1
+
+            job = IngestionJob(file_path, doc_name, delete_source, file_hash)
+            self._jobs[job.id] = job
+            self._trim_finished()
+
+        self._extract_queue.put(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _trim_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _finish(self, job: IngestionJob, result: dict = None, error: Exception = None):
+        if error is not None:
+            print(f"Ingestion job {job.id} failed: {error}")
+            job.error = str(error)
+            job.set_status("failed")
+            job.future.set_exception(error)
+        else:
+            job.result = result
+            job.set_status("completed")
+            job.future.set_result(result)
+
+        # Drop per-job buffers; only the status stays in the registry.
+        job.embeddings = None
+        job.chunks = []
+        job.page_numbers = []
+        if job.stage_dir is not None:
+            shutil.rmtree(job.stage_dir, ignore_errors=True)
+            job.stage_dir = None
+
+        if job.delete_source and Path(job.file_path).exists():
+            Path(job.file_path).unlink()
+
+        with self._lock:
+            self._active -= 1
+            if error is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def _extract_worker(self):
+        processor = self.rag_system.processor
+        while True:
+            job = self._extract_queue.get()
+            try:
+                size = Path(job.file_path).stat().st_size
+                if size >= self.rag_system.stream_min_bytes:
+                    # Too large to hold in memory: chunk and embed it batch by
+                    # batch to disk here, off the index thread.
+                    job.streaming = True
+                    job.set_status("embedding")
+                    job.stage_dir, job.num_batches = self.rag_system.stage_document(
+                        job.file_path
+                    )
+                    self._index_queue.put(job)
+                    continue
+
+                job.set_status("extracting")
+                text, page_offsets = processor.extract_text_with_pages(
+                    job.file_path
+                )
+                self._chunk_queue.put((job, text, page_offsets))
+            except Exception as e:
+                self._finish(job, error=e)
+
+    def _chunk_worker(self):
+        processor = self.rag_system.processor
+        embedding_dim = self.rag_system.embedder.get_embedding_dim()
+        while True:
+            job, text, page_offsets = self._chunk_queue.get()
+            try:
+                job.set_status("chunking")
+                job.chunks, job.page_numbers = processor.chunk_text_with_pages(
+                    text, page_offsets
+                )
+                job.num_chunks = len(job.chunks)
+                job.embeddings = np.empty(
+                    (len(job.chunks), embedding_dim), dtype="float32"
+                )
+
+                if not job.chunks:
+                    self._index_queue.put(job)
+                    continue
+
+                job.set_status("embedding")
+                for start in range(0, len(job.chunks), self.embed_batch_size):
+                    texts = job.chunks[start : start + self.embed_batch_size]
+                    self._embed_queue.put((job, start, texts))
+            except Exception as e:
+                self._finish(job, error=e)
+
+    def _collect_embed_batch(self) -> List[tuple]:
+        items = [self._embed_queue.get()]
+        size = len(items[0][2])
+        deadline = time.monotonic() + self.embed_wait
+
+        while size < self.embed_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._embed_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            size += len(item[2])
+
+        return [item for item in items if not item[0].finished]
+
+    def _embed_worker(self):
+        while True:
+            items = self._collect_embed_batch()
+            if not items:
+                continue
+
+            texts = [text for _, _, batch in items for text in batch]
+            try:
+                vectors = self.rag_system.embedding_cache.embed_batch(
+                    self.rag_system.embedder, texts
+                )
+            except Exception as e:
+                for job in {id(job): job for job, _, _ in items}.values():
+                    self._finish(job, error=e)
+                continue
+
+            offset = 0
+            for job, start, batch in items:
+                job.embeddings[start : start + len(batch)] = vectors[
+                    offset : offset + len(batch)
+                ]
+                offset += len(batch)
+                job.embedded += len(batch)
+                job.updated_at = datetime.utcnow()
+
+                if job.embedded == len(job.chunks):
+                    self._index_queue.put(job)
+
+    def _index_worker(self):
+        while True:
+            job = self._index_queue.get()
+            try:
+                job.set_status("indexing")
+                if job.streaming:
+                    result = self.rag_system.index_staged_document(
+                        job.file_path,
+                        job.doc_name,
+                        job.stage_dir,
+                        job.num_batches,
+                        job.file_hash,
+                    )
+                    job.num_chunks = job.embedded = result["num_chunks"]
+                    self._finish(job, result=result)
+                    continue
+
+                result = self.rag_system.index_document(
+                    job.file_path,
+                    job.doc_name,
+                    job.chunks,
+                    job.embeddings,
+                    job.page_numbers,
+                    job.file_hash,
+                )
+                self._finish(job, result=result)
+            except Exception as e:
+                self._finish(job, error=e)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "active_jobs": self._active,
+                "max_queue_depth": self.max_queue_depth,
+                "completed": self.completed,
+                "failed": self.failed,
+                "embed_batch_size": self.embed_batch_size,
+            }
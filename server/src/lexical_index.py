@@ -0,0 +1,176 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.locks import ReadWriteLock
+
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def bm25_similarity(score: float) -> float:
+    # Squashes an unbounded BM25 score into (0, 1) for the similarity_score
+    # field. Its spread differs from dense similarities, so lexical results
+    # are judged against their own confidence thresholds.
+    return score / (1.0 + score)
+
+
+def _merged(parts: List[np.ndarray]) -> np.ndarray:
+    if len(parts) > 1:
+        # Batches are appended as separate arrays; merge them on first read.
+        parts[:] = [np.concatenate(parts)]
+    return parts[0]
+
+
+# BM25 inverted index over chunk text, keyed by FAISS vector id: a chunk that
+# several versions share is indexed once, like its vector. Each term's
+# postings are id and term-frequency arrays; version, latest-only and
+# tombstone filtering are applied to the matched ids at query time.
+class LexicalIndex:
+
+    def __init__(self, k1: float = None, b: float = None, compactions: int = 0):
+        self.k1 = BM25_K1 if k1 is None else k1
+        self.b = BM25_B if b is None else b
+        # Vector store compactions reflected in the ids; the store's own
+        # counter runs ahead while a remap is pending.
+        self.compactions = compactions
+
+        self._terms: Dict[str, int] = {}
+        self._posting_ids: List[List[np.ndarray]] = []
+        self._posting_tfs: List[List[np.ndarray]] = []
+        # Token count per vector id; -1 for ids that were never indexed.
+        self._doc_lengths = np.full(0, -1, dtype="int32")
+        self.num_docs = 0
+        self.total_length = 0
+        self._lock = ReadWriteLock()
+
+    def add(self, ids: List[int], texts: List[str]):
+        if not ids:
+            return
+
+        # Tokenized outside the lock; each term gets one array per batch.
+        batch: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = []
+        for faiss_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_ids, tfs = batch.setdefault(term, ([], []))
+                term_ids.append(faiss_id)
+                tfs.append(tf)
+
+        with self._lock.write():
+            self._reserve(max(ids) + 1)
+            self._doc_lengths[ids] = lengths
+            self.num_docs += len(ids)
+            self.total_length += sum(lengths)
+
+            for term, (term_ids, tfs) in batch.items():
+                term_id = self._terms.get(term)
+                if term_id is None:
+                    term_id = self._terms[term] = len(self._posting_ids)
+                    self._posting_ids.append([])
+                    self._posting_tfs.append([])
+                self._posting_ids[term_id].append(np.asarray(term_ids, dtype="int64"))
+                self._posting_tfs[term_id].append(np.asarray(tfs, dtype="int32"))
+
+    def _reserve(self, size: int):
+        if size <= len(self._doc_lengths):
+            return
+        lengths = np.full(max(size, 2 * len(self._doc_lengths), 1024), -1, "int32")
+        lengths[: len(self._doc_lengths)] = self._doc_lengths
+        self._doc_lengths = lengths
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        candidates: Optional[np.ndarray] = None,
+        exclude: Optional[np.ndarray] = None,
+    ) -> List[Tuple[float, int]]:
+        # Returns (bm25 score, vector id), best first. Only ids in
+        # `candidates` (when given) and not in `exclude` are returned.
+        terms = set(tokenize(query))
+
+        id_parts = []
+        score_parts = []
+        with self._lock.read():
+            if not self.num_docs:
+                return []
+            avg_length = self.total_length / self.num_docs
+
+            for term in terms:
+                term_id = self._terms.get(term)
+                if term_id is None:
+                    continue
+
+                ids = _merged(self._posting_ids[term_id])
+                tfs = _merged(self._posting_tfs[term_id])
+                idf = math.log(1 + (self.num_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._doc_lengths[ids] / avg_length
+                )
+                id_parts.append(ids)
+                score_parts.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        if not id_parts:
+            return []
+
+        ids, inverse = np.unique(np.concatenate(id_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+
+        keep = np.ones(len(ids), dtype=bool)
+        if candidates is not None:
+            keep &= np.isin(ids, candidates)
+        if exclude is not None and len(exclude):
+            keep &= ~np.isin(ids, exclude)
+        ids, scores = ids[keep], scores[keep]
+
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(float(scores[i]), int(ids[i])) for i in top]
+
+    def remap(self, remap: np.ndarray):
+        # Applies an index compaction: old id -> new id, -1 for dropped ids.
+        with self._lock.write():
+            for term_id in range(len(self._posting_ids)):
+                ids = _merged(self._posting_ids[term_id])
+                tfs = _merged(self._posting_tfs[term_id])
+                new_ids = remap[ids]
+                live = new_ids >= 0
+                self._posting_ids[term_id] = [new_ids[live]]
+                self._posting_tfs[term_id] = [tfs[live]]
+
+            old_lengths = self._doc_lengths[: len(remap)]
+            live = remap[: len(old_lengths)] >= 0
+            lengths = np.full(max(len(remap), 1024), -1, dtype="int32")
+            lengths[remap[: len(old_lengths)][live]] = old_lengths[live]
+
+            self._doc_lengths = lengths
+            indexed = lengths >= 0
+            self.num_docs = int(indexed.sum())
+            self.total_length = int(lengths[indexed].sum())
+            self.compactions += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "documents": self.num_docs,
+            "terms": len(self._terms),
+            "avg_length": round(self.total_length / self.num_docs, 1)
+            if self.num_docs
+            else 0.0,
+        }
@@ -0,0 +1,276 @@
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+ROW_DTYPE = np.dtype(
+    [
+        ("document_id", "int64"),
+        ("version_id", "int64"),
+        ("chunk_index", "int32"),
+        ("page_number", "int32"),
+        ("content_offset", "int64"),
+        ("content_length", "int32"),
+    ]
+)
+
+# Columns describing which chunk a vector is; the rest locate its text.
+CHUNK_FIELDS = ("document_id", "version_id", "chunk_index", "page_number")
+
+_COPY_BLOCK = 16 << 20
+
+
+# Per-vector chunk metadata as NumPy columns keyed by FAISS id. Chunk text
+# lives in a UTF-8 blob: the part covered by the last snapshot is memory-mapped
+# from disk, newer text is spilled to a side file on each persist and only the
+# text added since then sits in an in-memory tail.
+class ChunkMetadataStore:
+
+    def __init__(self):
+        self.rows = np.zeros(0, dtype=ROW_DTYPE)
+        self.size = 0
+        self.doc_names: Dict[int, str] = {}
+        self.version_numbers: Dict[int, int] = {}
+
+        self._text_file = None
+        self._text_base = b""
+        self._text_base_size = 0
+        self._spill_file = None
+        self._spill_path = None
+        self._spill_size = 0
+        self._text_tail = bytearray()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, faiss_id: int) -> bool:
+        return 0 <= faiss_id < self.size
+
+    def __getitem__(self, faiss_id: int) -> dict:
+        metadata = self.get(faiss_id)
+        if metadata is None:
+            raise KeyError(faiss_id)
+        return metadata
+
+    def get(self, faiss_id: int, default: Optional[dict] = None) -> Optional[dict]:
+        if not 0 <= faiss_id < self.size:
+            return default
+
+        row = self.rows[faiss_id]
+        document_id = int(row["document_id"])
+        version_id = int(row["version_id"])
+        page_number = int(row["page_number"])
+        return {
+            "document_id": document_id,
+            "version_id": version_id,
+            "chunk_index": int(row["chunk_index"]),
+            "page_number": page_number if page_number >= 0 else None,
+            "doc_name": self.doc_names.get(document_id, ""),
+            "version_number": self.version_numbers.get(version_id, ""),
+            "content": self.content(faiss_id),
+        }
+
+    def content(self, faiss_id: int) -> str:
+        return self._content_bytes(faiss_id).decode("utf-8")
+
+    def _content_bytes(self, faiss_id: int) -> bytes:
+        row = self.rows[faiss_id]
+        offset = int(row["content_offset"])
+        length = int(row["content_length"])
+
+        if offset < self._text_base_size:
+            return self._text_base[offset : offset + length]
+        offset -= self._text_base_size
+        if offset < self._spill_size:
+            return os.pread(self._spill_file.fileno(), length, offset)
+        start = offset - self._spill_size
+        return bytes(self._text_tail[start : start + length])
+
+    def _text_size(self) -> int:
+        return self._text_base_size + self._spill_size + len(self._text_tail)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.rows[name][: self.size]
+
+    def append(self, start_id: int, metadata: List[dict]):
+        if start_id != self.size:
+            raise ValueError(
+                f"Metadata out of sequence: expected id {self.size}, got {start_id}"
+            )
+
+        self._reserve(len(metadata))
+
+        for offset, meta in enumerate(metadata):
+            content = meta.get("content", "").encode("utf-8")
+            content_offset = self._text_size()
+            self._text_tail += content
+
+            document_id = meta.get("document_id", -1)
+            version_id = meta.get("version_id", -1)
+            page_number = meta.get("page_number")
+            self.rows[self.size + offset] = (
+                document_id,
+                version_id,
+                meta.get("chunk_index", -1),
+                -1 if page_number is None else page_number,
+                content_offset,
+                len(content),
+            )
+
+            if "doc_name" in meta:
+                self.doc_names[document_id] = meta["doc_name"]
+            if "version_number" in meta:
+                self.version_numbers[version_id] = meta["version_number"]
+
+        self.size += len(metadata)
+
+    def update(self, ids: np.ndarray, **columns):
+        # Rewrites chunk columns in place, e.g. when a shared vector's owning
+        # version is deleted and it now belongs to a later one.
+        if not self.rows.flags.writeable:
+            self.rows = np.array(self.rows)
+        for name, values in columns.items():
+            self.rows[name][ids] = values
+
+    def subset(self, ids: np.ndarray) -> "ChunkMetadataStore":
+        # New store holding only `ids`, renumbered 0..len(ids)-1, with their
+        # text packed into a fresh blob.
+        store = ChunkMetadataStore()
+        rows = np.array(self.rows[ids])
+        lengths = rows["content_length"].astype("int64")
+        rows["content_offset"] = np.cumsum(lengths) - lengths
+
+        store.rows = rows
+        store.size = len(rows)
+        store._text_tail = bytearray(
+            b"".join(self._content_bytes(int(i)) for i in ids)
+        )
+        store.doc_names = dict(self.doc_names)
+        store.version_numbers = dict(self.version_numbers)
+        return store
+
+    def spill_text(self, spill_path: str):
+        # Moves the in-memory tail to the side file. Not fsynced: the delta
+        # log holds the durable copy, and the next snapshot folds the side
+        # file into the text blob and removes it.
+        if not self._text_tail:
+            return
+        if self._spill_file is None:
+            # Truncates a side file left behind by an earlier process.
+            self._spill_file = open(spill_path, "w+b")
+            self._spill_path = spill_path
+        self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(self._text_tail)
+        self._spill_file.flush()
+        self._spill_size += len(self._text_tail)
+        self._text_tail = bytearray()
+
+    def _reserve(self, count: int):
+        needed = self.size + count
+        if needed <= len(self.rows) and self.rows.flags.writeable:
+            return
+
+        capacity = max(needed, 2 * len(self.rows), 1024)
+        rows = np.zeros(capacity, dtype=ROW_DTYPE)
+        rows[: self.size] = self.rows[: self.size]
+        self.rows = rows
+
+    @classmethod
+    def from_dicts(cls, id_to_metadata: Dict[int, dict]) -> "ChunkMetadataStore":
+        store = cls()
+        if id_to_metadata:
+            count = max(id_to_metadata) + 1
+            store.append(0, [id_to_metadata.get(i, {}) for i in range(count)])
+        return store
+
+    def save(self, prefix: str) -> dict:
+        rows_file = f"{prefix}.rows.npy"
+        text_file = f"{prefix}.text"
+
+        with open(f"{rows_file}.tmp", "wb") as f:
+            np.save(f, self.rows[: self.size])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{rows_file}.tmp", rows_file)
+
+        with open(f"{text_file}.tmp", "wb") as f:
+            for start in range(0, self._text_base_size, _COPY_BLOCK):
+                f.write(self._text_base[start : start + _COPY_BLOCK])
+            for start in range(0, self._spill_size, _COPY_BLOCK):
+                f.write(
+                    os.pread(
+                        self._spill_file.fileno(),
+                        min(_COPY_BLOCK, self._spill_size - start),
+                        start,
+                    )
+                )
+            f.write(self._text_tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{text_file}.tmp", text_file)
+
+        self._open_text(text_file)
+
+        return {
+            "rows_file": Path(rows_file).name,
+            "text_file": Path(text_file).name,
+            "doc_names": dict(self.doc_names),
+            "version_numbers": dict(self.version_numbers),
+        }
+
+    @classmethod
+    def load(
+        cls, directory: str, state: dict, mmap: bool = False
+    ) -> "ChunkMetadataStore":
+        store = cls()
+        rows = np.load(
+            Path(directory) / state["rows_file"], mmap_mode="r" if mmap else None
+        )
+        if rows.dtype != ROW_DTYPE:
+            # Snapshot written before a column was added; fill it with -1.
+            upgraded = np.full(len(rows), -1, dtype=ROW_DTYPE)
+            for name in rows.dtype.names:
+                upgraded[name] = rows[name]
+            rows = upgraded
+        store.rows = rows
+        store.size = len(store.rows)
+        store.doc_names = dict(state["doc_names"])
+        store.version_numbers = dict(state["version_numbers"])
+        store._open_text(str(Path(directory) / state["text_file"]))
+        return store
+
+    def _open_text(self, text_file: str):
+        self.close()
+
+        size = os.path.getsize(text_file)
+        if size:
+            self._text_file = open(text_file, "rb")
+            self._text_base = mmap.mmap(
+                self._text_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self._text_base = b""
+        self._text_base_size = size
+        self._text_tail = bytearray()
+
+    def close(self):
+        if isinstance(self._text_base, mmap.mmap):
+            self._text_base.close()
+        if self._text_file is not None:
+            self._text_file.close()
+        self._text_file = None
+        self._text_base = b""
+        self._text_base_size = 0
+
+        if self._spill_file is not None:
+            self._spill_file.close()
+            os.remove(self._spill_path)
+        self._spill_file = None
+        self._spill_path = None
+        self._spill_size = 0
+
+    def nbytes(self) -> int:
+        return self.rows.nbytes + self._text_size()
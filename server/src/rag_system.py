@@ -1,9 +1,15 @@
+import itertools
+import json
 import os
 import shutil
+import tempfile
+import threading
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Iterable, Iterator, List, Tuple, Optional
 from datetime import datetime
 
+import numpy as np
+
 from src.database import (
     init_db,
     get_db_session,
@@ -13,7 +19,22 @@ from src.database import (
 )
 from src.document_processor import DocumentProcessor
 from src.embeddings import EmbeddingGenerator
+from src.embedding_cache import EmbeddingCache, content_hash
 from src.vector_store import FAISSVectorStore
+from src.lexical_index import LexicalIndex, bm25_similarity
+from src.query_cache import TTLCache, normalize_question
+from src.batching import EmbeddingMicroBatcher
+from src.timing import timed_phase
+
+
+QUERY_MODES = ("dense", "lexical", "hybrid")
+
+# Reciprocal rank fusion constant; dampens the weight of the very top ranks.
+RRF_K = 60
+
+# query_batch embeds and searches this many questions at a time, so results
+# stream back while later questions are still being processed.
+QUERY_BATCH_CHUNK_SIZE = int(os.getenv("QUERY_BATCH_CHUNK_SIZE", "256"))
 
 
 class IncrementalRAGSystem:
@@ -27,25 +48,110 @@ class IncrementalRAGSystem:
     ):
 
         print("Initializing Incremental RAG System...")
+        # Seconds per startup phase, reported by the readiness endpoint.
+        self.startup_timings = {}
 
         self.database_url = database_url or os.getenv(
             "DATABASE_URL", "sqlite:///./rag_system.db"
         )
-        init_db(self.database_url)
-
-        self.processor = DocumentProcessor(chunk_size=512, chunk_overlap=50)
-        self.embedder = EmbeddingGenerator(model_name=embedding_model)
-        self.vector_store = FAISSVectorStore(
-            embedding_dim=self.embedder.get_embedding_dim(),
-            index_path=index_path or "./data/faiss_index",
+        with timed_phase(self.startup_timings, "database"):
+            init_db(self.database_url)
+
+        with timed_phase(self.startup_timings, "embedding_model"):
+            self.embedder = EmbeddingGenerator(model_name=embedding_model)
+        self.processor = self._create_processor(os.getenv("CHUNK_MODE", "chars"))
+        # Concurrent questions share one encode call.
+        self.query_batcher = EmbeddingMicroBatcher(self.embedder)
+        self.embedding_cache = EmbeddingCache(
+            database_url=self.database_url, model_name=self.embedder.cache_namespace
+        )
+        with timed_phase(self.startup_timings, "vector_store"):
+            self.vector_store = FAISSVectorStore(
+                embedding_dim=self.embedder.get_embedding_dim(),
+                index_path=index_path or "./data/faiss_index",
+            )
+        self.default_query_mode = os.getenv("QUERY_MODE", "dense")
+
+        cache_size = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+        cache_ttl = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+        self.query_embedding_cache = TTLCache(cache_size, cache_ttl)
+        # Keyed by (normalized question, version_id, k, latest_only, mode,
+        # nprobe, ef_search).
+        self.result_cache = TTLCache(cache_size, cache_ttl)
+        self._index_epoch = 0
+        # Serializes uploads so version numbers and FAISS ids stay consistent
+        # when handlers run on worker threads.
+        self._write_lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+        # Built on the first lexical or hybrid query (or at startup when that
+        # is the default mode), then kept current under the write lock.
+        self.lexical_index: Optional[LexicalIndex] = None
+        if self.default_query_mode != "dense":
+            with timed_phase(self.startup_timings, "lexical_index"):
+                self._get_lexical_index()
+        # Files at least this large are chunked, embedded and indexed in
+        # fixed-size batches instead of being loaded whole.
+        self.stream_min_bytes = int(
+            os.getenv("INGEST_STREAM_MIN_BYTES", str(64 << 20))
         )
+        self.stream_batch_size = int(os.getenv("INGEST_STREAM_BATCH_SIZE", "256"))
+        # Where streamed batches are staged between embedding and indexing;
+        # defaults to the system temp directory.
+        self.stream_staging_dir = os.getenv("INGEST_STAGING_DIR") or None
 
         self.upload_dir = upload_dir or "./uploads"
         Path(self.upload_dir).mkdir(parents=True, exist_ok=True)
 
         print("RAG System initialized successfully!")
 
-    def add_document(self, file_path: str, doc_name: str = None) -> dict:
+    def _get_lexical_index(self) -> LexicalIndex:
+        if self.lexical_index is None:
+            # Under the write lock so no upload or compaction lands between
+            # reading the stored text and publishing the index.
+            with self._write_lock:
+                if self.lexical_index is None:
+                    self.lexical_index = self._build_lexical_index()
+        return self.lexical_index
+
+    def _build_lexical_index(self, batch_size: int = 4096) -> LexicalIndex:
+        # Not persisted: built from the stored chunk text, then kept current
+        # as vectors are added and compacted.
+        print("Building lexical index...")
+        store = self.vector_store
+        lexical_index = LexicalIndex(compactions=store.compactions)
+        for start in range(0, store.current_id, batch_size):
+            ids = [
+                i
+                for i in range(start, min(start + batch_size, store.current_id))
+                if i not in store.tombstones
+            ]
+            lexical_index.add(ids, [store.id_to_metadata.content(i) for i in ids])
+        return lexical_index
+
+    def warmup(self):
+        # The first encode pays for lazy weight init and allocator growth, and
+        # the first search faults in index pages; do both before serving.
+        with timed_phase(self.startup_timings, "warmup"):
+            query_embedding = self.query_batcher.embed("warmup query")
+            if self.vector_store.index.ntotal:
+                self.vector_store.search(query_embedding, k=1)
+
+    def _create_processor(self, chunk_mode: str) -> DocumentProcessor:
+        if chunk_mode == "tokens":
+            # Chunks sized in the embedding model's own tokens, packed up to
+            # its max sequence length so nothing is truncated at encode time.
+            return DocumentProcessor(
+                chunk_mode="tokens",
+                tokenizer=self.embedder.tokenizer,
+                max_tokens=self.embedder.max_seq_length,
+                overlap_tokens=int(os.getenv("CHUNK_OVERLAP_TOKENS", "32")),
+            )
+        return DocumentProcessor(chunk_size=512, chunk_overlap=50)
+
+    def add_document(
+        self, file_path: str, doc_name: str = None, file_hash: str = None
+    ) -> dict:
 
         if not Path(file_path).exists():
             raise FileNotFoundError(f"File not found: {file_path}")
@@ -53,17 +159,194 @@ class IncrementalRAGSystem:
         if doc_name is None:
             doc_name = Path(file_path).stem
 
+        if file_hash is None:
+            file_hash = self.processor.compute_file_hash(file_path)
+
+        duplicate = self.find_duplicate_version(doc_name, file_hash)
+        if duplicate is not None:
+            return duplicate
+
+        if Path(file_path).stat().st_size >= self.stream_min_bytes:
+            return self.add_document_streaming(file_path, doc_name, file_hash)
+
         print(f"\nProcessing document: {doc_name}")
 
-        full_text, chunks = self.processor.process_document(file_path)
-        file_hash = self.processor.compute_file_hash(file_path)
+        full_text, page_offsets = self.processor.extract_text_with_pages(file_path)
+        chunks, page_numbers = self.processor.chunk_text_with_pages(
+            full_text, page_offsets
+        )
 
         print(f"  - Extracted {len(chunks)} chunks")
 
+        print(f"  - Generating embeddings...")
+        embeddings = self.embedding_cache.embed_batch(self.embedder, chunks)
+
+        return self.index_document(
+            file_path, doc_name, chunks, embeddings, page_numbers, file_hash
+        )
+
+    def add_document_streaming(
+        self, file_path: str, doc_name: str = None, file_hash: str = None
+    ) -> dict:
+        if doc_name is None:
+            doc_name = Path(file_path).stem
+
+        print(f"\nStreaming document: {doc_name}")
+
+        if file_hash is None:
+            file_hash = self.processor.compute_file_hash(file_path)
+
+        # Every batch is embedded and staged on disk before the write lock is
+        # taken, so the slow part holds neither the lock nor a database
+        # transaction; indexing then reads the staged batches back.
+        stage_dir, num_batches = self.stage_document(file_path)
+        try:
+            return self.index_staged_document(
+                file_path, doc_name, stage_dir, num_batches, file_hash
+            )
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+    def stage_document(self, file_path: str) -> Tuple[str, int]:
+        # Chunks and embeds file_path into a new staging directory without
+        # taking the write lock; returns (stage_dir, num_batches). The caller
+        # removes stage_dir once it has been indexed.
+        stage_dir = tempfile.mkdtemp(prefix="ingest-", dir=self.stream_staging_dir)
+        try:
+            return stage_dir, self._stage_embedded_batches(file_path, stage_dir)
+        except BaseException:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            raise
+
+    def index_staged_document(
+        self,
+        file_path: str,
+        doc_name: str,
+        stage_dir: str,
+        num_batches: int,
+        file_hash: str = None,
+    ) -> dict:
+        if file_hash is None:
+            file_hash = self.processor.compute_file_hash(file_path)
+
+        with self._write_lock:
+            return self._index_document(
+                file_path,
+                doc_name,
+                self._iter_staged_batches(stage_dir, num_batches),
+                file_hash,
+            )
+
+    def find_duplicate_version(self, doc_name: str, file_hash: str) -> Optional[dict]:
+        session = get_db_session(self.database_url)
+        try:
+            return self._find_duplicate_version(session, doc_name, file_hash)
+        finally:
+            session.close()
+
+    def _find_duplicate_version(
+        self, session, doc_name: str, file_hash: str
+    ) -> Optional[dict]:
+        # Only the latest version counts: re-uploading an older version's file
+        # (a revert) is a new version, not a duplicate.
+        version = (
+            session.query(DocumentVersion)
+            .join(Document)
+            .filter(Document.doc_name == doc_name)
+            .order_by(DocumentVersion.version_number.desc())
+            .first()
+        )
+        if version is None or version.file_hash != file_hash:
+            return None
+
+        print(f"  - {doc_name} is identical to v{version.version_number}, skipping")
+        num_chunks = (
+            session.query(DocumentChunk).filter_by(version_id=version.id).count()
+        )
+        return {
+            "document_id": version.document_id,
+            "document_name": doc_name,
+            "version_id": version.id,
+            "version_number": version.version_number,
+            "num_chunks": num_chunks,
+            "file_path": version.file_path,
+            "duplicate": True,
+        }
+
+    def _stage_embedded_batches(self, file_path: str, stage_dir: str) -> int:
+        # Writes each batch's vectors (.npy) and chunks (.json) to stage_dir;
+        # returns the number of batches.
+        chunk_stream = self.processor.iter_document_chunks(file_path)
+        for batch_index in itertools.count():
+            batch = list(itertools.islice(chunk_stream, self.stream_batch_size))
+            if not batch:
+                return batch_index
+
+            chunks = [chunk for chunk, _ in batch]
+            page_numbers = [page_number for _, page_number in batch]
+            embeddings = self.embedding_cache.embed_batch(self.embedder, chunks)
+
+            prefix = Path(stage_dir) / f"{batch_index:06d}"
+            np.save(f"{prefix}.npy", np.asarray(embeddings, dtype="float32"))
+            with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+                json.dump({"chunks": chunks, "page_numbers": page_numbers}, f)
+
+    @staticmethod
+    def _iter_staged_batches(stage_dir: str, num_batches: int):
+        for batch_index in range(num_batches):
+            prefix = Path(stage_dir) / f"{batch_index:06d}"
+            with open(f"{prefix}.json", encoding="utf-8") as f:
+                batch = json.load(f)
+            embeddings = np.load(f"{prefix}.npy", mmap_mode="r")
+            yield batch["chunks"], embeddings, batch["page_numbers"]
+
+    def index_document(
+        self,
+        file_path: str,
+        doc_name: str,
+        chunks: List[str],
+        embeddings,
+        page_numbers: Optional[List[Optional[int]]] = None,
+        file_hash: str = None,
+    ) -> dict:
+        if file_hash is None:
+            file_hash = self.processor.compute_file_hash(file_path)
+        if page_numbers is None:
+            page_numbers = [None] * len(chunks)
+
+        # Extraction and embedding run outside the lock; only the part that
+        # assigns version numbers and FAISS ids is serialized.
+        with self._write_lock:
+            return self._index_document(
+                file_path,
+                doc_name,
+                [(chunks, embeddings, page_numbers)],
+                file_hash,
+            )
+
+    def _index_document(
+        self,
+        file_path: str,
+        doc_name: str,
+        batches: Iterable[Tuple[List[str], object, List[Optional[int]]]],
+        file_hash: str,
+    ) -> dict:
         session = get_db_session(self.database_url)
+        # What this upload changed in the in-memory indexes, undone if the
+        # transaction does not commit.
+        version_id = None
+        added_ids: List[int] = []
+        committed = False
 
         try:
+            # Re-checked under the write lock in case an identical upload was
+            # indexed while this one was being embedded.
+            duplicate = self._find_duplicate_version(session, doc_name, file_hash)
+            if duplicate is not None:
+                return duplicate
+
             document = session.query(Document).filter_by(doc_name=doc_name).first()
+            reusable = {}
 
             if document is None:
                 document = Document(doc_name=doc_name)
@@ -72,12 +355,16 @@ class IncrementalRAGSystem:
                 version_number = 1
                 print(f"  - Created new document (ID: {document.id})")
             else:
-                max_version = (
+                latest = (
                     session.query(DocumentVersion)
                     .filter_by(document_id=document.id)
-                    .count()
+                    .order_by(DocumentVersion.version_number.desc())
+                    .first()
                 )
-                version_number = max_version + 1
+                # Numbers are never reused, even after versions are deleted.
+                version_number = latest.version_number + 1 if latest else 1
+                if latest is not None:
+                    reusable = self._reusable_vectors(session, latest.id)
                 print(f"  - Adding version {version_number} to existing document")
 
             dest_path = (
@@ -94,80 +381,564 @@ class IncrementalRAGSystem:
             )
             session.add(version)
             session.flush()
-
-            print(f"  - Generating embeddings...")
-            embeddings = self.embedder.embed_batch(chunks)
-
-            metadata_list = [
-                {
-                    "document_id": document.id,
-                    "version_id": version.id,
-                    "chunk_index": i,
-                    "doc_name": doc_name,
-                    "version_number": version_number,
-                    "content": chunk,
-                }
-                for i, chunk in enumerate(chunks)
-            ]
-
-            faiss_ids = self.vector_store.add_embeddings(embeddings, metadata_list)
-
-            for i, (chunk, faiss_id) in enumerate(zip(chunks, faiss_ids)):
-                db_chunk = DocumentChunk(
-                    version_id=version.id,
-                    chunk_index=i,
-                    content=chunk,
-                    faiss_index=faiss_id,
+            version_id = version.id
+
+            num_chunks = 0
+            reused_chunks = 0
+            for batch_index, (chunks, embeddings, page_numbers) in enumerate(batches):
+                if batch_index:
+                    # Move earlier batches out of memory: vectors to the
+                    # delta log, chunk rows to the database transaction. The
+                    # version mapping is only logged after the commit.
+                    self.vector_store.persist(vectors_only=True)
+                    session.flush()
+
+                # Chunks whose text is already stored for this document point
+                # at the existing vector; only the rest are added to FAISS.
+                hashes = [content_hash(chunk) for chunk in chunks]
+                faiss_ids = [reusable.get(h) for h in hashes]
+                new_positions = [
+                    i for i, faiss_id in enumerate(faiss_ids) if faiss_id is None
+                ]
+
+                metadata_list = [
+                    {
+                        "document_id": document.id,
+                        "version_id": version.id,
+                        "chunk_index": num_chunks + i,
+                        "page_number": page_numbers[i],
+                        "doc_name": doc_name,
+                        "version_number": version_number,
+                        "content": chunks[i],
+                    }
+                    for i in new_positions
+                ]
+
+                if new_positions:
+                    new_ids = self.vector_store.add_embeddings(
+                        embeddings[new_positions],
+                        metadata_list,
+                        register_versions=False,
+                    )
+                    added_ids.extend(new_ids)
+                    for i, faiss_id in zip(new_positions, new_ids):
+                        faiss_ids[i] = faiss_id
+                        reusable.setdefault(hashes[i], faiss_id)
+                    if self.lexical_index is not None:
+                        self.lexical_index.add(
+                            new_ids, [chunks[i] for i in new_positions]
+                        )
+
+                self.vector_store.add_version_chunks(
+                    version.id,
+                    version_number,
+                    document.id,
+                    doc_name,
+                    faiss_ids,
+                    page_numbers,
                 )
-                session.add(db_chunk)
+                reused_chunks += len(chunks) - len(new_positions)
+
+                for i, (chunk, page_number, faiss_id) in enumerate(
+                    zip(chunks, page_numbers, faiss_ids)
+                ):
+                    db_chunk = DocumentChunk(
+                        version_id=version.id,
+                        chunk_index=num_chunks + i,
+                        page_number=page_number,
+                        content=chunk,
+                        faiss_index=faiss_id,
+                    )
+                    session.add(db_chunk)
+
+                num_chunks += len(chunks)
 
             session.commit()
+            committed = True
 
-            self.vector_store.save()
+            self.vector_store.persist()
 
-            print(f"Successfully added {doc_name} v{version_number}")
+            # Only unfiltered searches and searches on the new version can see
+            # the added vectors; results cached for other versions stay valid.
+            self._index_epoch += 1
+            self.result_cache.invalidate(
+                lambda key: key[1] is None or key[1] == version.id
+            )
+
+            print(
+                f"Successfully added {doc_name} v{version_number} "
+                f"({reused_chunks}/{num_chunks} chunks reused)"
+            )
 
             return {
                 "document_id": document.id,
                 "document_name": doc_name,
                 "version_id": version.id,
                 "version_number": version_number,
-                "num_chunks": len(chunks),
+                "num_chunks": num_chunks,
+                "reused_chunks": reused_chunks,
                 "file_path": str(dest_path),
             }
 
         except Exception as e:
             session.rollback()
+            if not committed and version_id is not None:
+                self._discard_version(version_id, added_ids)
             raise e
         finally:
             session.close()
 
+    def _discard_version(self, version_id: int, added_ids: List[int]):
+        # The database rolled back, but the vector store already maps the
+        # version and holds its new vectors (and the lexical index their
+        # postings). SQLite hands the same version id to the next upload, so
+        # the mapping has to go; the new vectors become tombstones, which
+        # both searches skip, and are dropped at the next compaction.
+        if version_id not in self.vector_store.version_to_ids and not added_ids:
+            return
+        self.vector_store.delete_versions([version_id], orphan_ids=added_ids)
+        self.vector_store.persist()
+
+        # Searches that ran meanwhile may have cached the discarded vectors.
+        self._index_epoch += 1
+        self.result_cache.invalidate(
+            lambda key: key[1] is None or key[1] == version_id
+        )
+        self._schedule_compaction()
+
+    def _reusable_vectors(self, session, version_id: int) -> dict:
+        # content hash -> FAISS id for the chunks of the document's latest
+        # version, the one a new upload is most likely to share text with.
+        # Ids come from the vector store so they are current after compaction.
+        ids = self.vector_store.get_version_ids(version_id)
+        rows = (
+            session.query(DocumentChunk.content)
+            .filter_by(version_id=version_id)
+            .order_by(DocumentChunk.chunk_index)
+            .all()
+        )
+        if len(rows) != len(ids):
+            return {}
+
+        return {
+            content_hash(content): int(faiss_id)
+            for (content,), faiss_id in zip(rows, ids)
+        }
+
+    def delete_document(self, doc_name: str) -> Optional[dict]:
+        with self._write_lock:
+            session = get_db_session(self.database_url)
+            try:
+                document = session.query(Document).filter_by(doc_name=doc_name).first()
+                if document is None:
+                    return None
+                return self._delete_versions(session, document, list(document.versions))
+            finally:
+                session.close()
+
+    def delete_version(self, doc_name: str, version_id: int) -> Optional[dict]:
+        with self._write_lock:
+            session = get_db_session(self.database_url)
+            try:
+                version = (
+                    session.query(DocumentVersion)
+                    .join(Document)
+                    .filter(
+                        Document.doc_name == doc_name, DocumentVersion.id == version_id
+                    )
+                    .first()
+                )
+                if version is None:
+                    return None
+                return self._delete_versions(session, version.document, [version])
+            finally:
+                session.close()
+
+    def _delete_versions(self, session, document, versions: list) -> dict:
+        doc_name = document.doc_name
+        version_ids = [v.id for v in versions]
+        file_paths = [v.file_path for v in versions]
+
+        try:
+            session.query(DocumentChunk).filter(
+                DocumentChunk.version_id.in_(version_ids)
+            ).delete(synchronize_session=False)
+            session.query(DocumentVersion).filter(
+                DocumentVersion.id.in_(version_ids)
+            ).delete(synchronize_session=False)
+            remaining = (
+                session.query(DocumentVersion)
+                .filter_by(document_id=document.id)
+                .count()
+            )
+            if not remaining:
+                session.query(Document).filter_by(id=document.id).delete(
+                    synchronize_session=False
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        # Searches stop seeing the versions here; their vectors are dropped
+        # from the index by the next compaction.
+        tombstoned = self.vector_store.delete_versions(version_ids)
+        self.vector_store.persist()
+
+        self._index_epoch += 1
+        deleted = set(version_ids)
+        self.result_cache.invalidate(lambda key: key[1] is None or key[1] in deleted)
+
+        for file_path in file_paths:
+            try:
+                Path(file_path).unlink(missing_ok=True)
+            except OSError as e:
+                print(f"Could not remove {file_path}: {e}")
+
+        print(
+            f"Deleted {len(version_ids)} versions of {doc_name} "
+            f"({tombstoned} vectors tombstoned)"
+        )
+        self._schedule_compaction()
+
+        return {
+            "document_name": doc_name,
+            "deleted_version_ids": version_ids,
+            "document_deleted": not remaining,
+            "tombstoned_vectors": tombstoned,
+        }
+
+    def _schedule_compaction(self):
+        if not self.vector_store.needs_compaction():
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+
+        self._compaction_thread = threading.Thread(
+            target=self._run_compaction, name="index-compaction", daemon=True
+        )
+        self._compaction_thread.start()
+
+    def _run_compaction(self):
+        try:
+            self.compact_index()
+        except Exception as e:
+            print(f"Index compaction failed: {e}")
+
+    def compact_index(self) -> bool:
+        with self._compaction_lock:
+            # Built without the write lock; only the swap waits for uploads.
+            plan = self.vector_store.prepare_compaction()
+            if plan is None:
+                return False
+
+            with self._write_lock:
+                remap = self.vector_store.finish_compaction(plan)
+                if remap is None:
+                    return False
+                if self.lexical_index is not None:
+                    self.lexical_index.remap(remap)
+                self._remap_chunk_ids(remap)
+            return True
+
+    def _remap_chunk_ids(self, remap):
+        session = get_db_session(self.database_url)
+        try:
+            rows = (
+                session.query(DocumentChunk.id, DocumentChunk.faiss_index)
+                .filter(DocumentChunk.faiss_index.isnot(None))
+                .all()
+            )
+            updates = []
+            for chunk_id, faiss_index in rows:
+                new_id = int(remap[faiss_index]) if faiss_index < len(remap) else -1
+                updates.append(
+                    {"id": chunk_id, "faiss_index": new_id if new_id >= 0 else None}
+                )
+            session.bulk_update_mappings(DocumentChunk, updates)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
     def query(
-        self, question: str, version_id: Optional[int] = None, k: int = 5
+        self,
+        question: str,
+        version_id: Optional[int] = None,
+        k: int = 5,
+        latest_only: bool = False,
+        mode: str = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
     ) -> List[dict]:
-        print(f"\nQuerying: '{question}'")
+        # mode: "dense" (embedding search), "lexical" (BM25 only, never runs
+        # the embedding model) or "hybrid" (both, fused by rank). nprobe and
+        # ef_search override the IVF/HNSW search depth for this query.
+        mode = self._resolve_mode(mode)
+        print(f"\nQuerying ({mode}): '{question}'")
+
+        normalized = normalize_question(question)
+        result_key = (normalized, version_id, k, latest_only, mode, nprobe, ef_search)
+        epoch = self._index_epoch
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            print(f"  - Served {len(cached)} chunks from result cache")
+            return [dict(result) for result in cached]
+
+        if mode == "lexical":
+            results = self._lexical_search(normalized, k, version_id, latest_only)
+        elif mode == "dense":
+            results = self._dense_search(
+                normalized, k, version_id, latest_only, nprobe, ef_search
+            )
+        else:
+            # Deeper candidate lists give the fusion something to reorder.
+            depth = max(4 * k, 20)
+            results = self._fuse(
+                self._dense_search(
+                    normalized, depth, version_id, latest_only, nprobe, ef_search
+                ),
+                self._lexical_search(normalized, depth, version_id, latest_only),
+                k,
+            )
 
-        query_embedding = self.embedder.embed_text(question)
+        print(f"  - Found {len(results)} relevant chunks")
 
-        results = self.vector_store.search(
-            query_embedding, k=k, version_filter=version_id
+        formatted_results = self._format_results(results)
+
+        # Skip caching if an upload landed while we were searching.
+        if epoch == self._index_epoch:
+            self.result_cache.put(result_key, formatted_results)
+        return [dict(result) for result in formatted_results]
+
+    def query_batch(
+        self,
+        questions: List[str],
+        version_ids: Optional[List[Optional[int]]] = None,
+        k: int = 5,
+        latest_only: bool = False,
+        mode: str = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> Iterator[Tuple[int, List[dict]]]:
+        # Yields (question index, results) as each chunk of questions
+        # finishes; cached answers come first. Every chunk is one encode call
+        # plus one matrix search per distinct version filter.
+        mode = self._resolve_mode(mode)
+        if version_ids is None:
+            version_ids = [None] * len(questions)
+        if len(version_ids) != len(questions):
+            raise ValueError("version_ids must have one entry per question")
+
+        return self._iter_query_batch(
+            questions, version_ids, k, latest_only, mode, nprobe, ef_search
         )
 
-        print(f"  - Found {len(results)} relevant chunks")
+    def _iter_query_batch(
+        self,
+        questions: List[str],
+        version_ids: List[Optional[int]],
+        k: int,
+        latest_only: bool,
+        mode: str,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+    ) -> Iterator[Tuple[int, List[dict]]]:
+        pending = []
+        for index, (question, version_id) in enumerate(zip(questions, version_ids)):
+            normalized = normalize_question(question)
+            cached = self.result_cache.get(
+                (normalized, version_id, k, latest_only, mode, nprobe, ef_search)
+            )
+            if cached is not None:
+                yield index, [dict(result) for result in cached]
+            else:
+                pending.append((index, normalized, version_id))
+
+        depth = k if mode == "dense" else max(4 * k, 20)
+        for start in range(0, len(pending), QUERY_BATCH_CHUNK_SIZE):
+            chunk = pending[start : start + QUERY_BATCH_CHUNK_SIZE]
+            epoch = self._index_epoch
+
+            if mode != "lexical":
+                dense_results = self._dense_search_batch(
+                    [normalized for _, normalized, _ in chunk],
+                    depth,
+                    [version_id for _, _, version_id in chunk],
+                    latest_only,
+                    nprobe,
+                    ef_search,
+                )
 
-        formatted_results = []
-        for distance, metadata in results:
-            formatted_results.append(
-                {
-                    "content": metadata.get("content", ""),
-                    "document_name": metadata.get("doc_name", ""),
-                    "version": metadata.get("version_number", ""),
-                    "chunk_index": metadata.get("chunk_index", ""),
-                    "similarity_score": 1 / (1 + distance),
-                }
+            for position, (index, normalized, version_id) in enumerate(chunk):
+                if mode == "lexical":
+                    results = self._lexical_search(
+                        normalized, k, version_id, latest_only
+                    )
+                elif mode == "dense":
+                    results = dense_results[position]
+                else:
+                    results = self._fuse(
+                        dense_results[position],
+                        self._lexical_search(
+                            normalized, depth, version_id, latest_only
+                        ),
+                        k,
+                    )
+
+                formatted_results = self._format_results(results)
+                if epoch == self._index_epoch:
+                    self.result_cache.put(
+                        (
+                            normalized,
+                            version_id,
+                            k,
+                            latest_only,
+                            mode,
+                            nprobe,
+                            ef_search,
+                        ),
+                        formatted_results,
+                    )
+                yield index, [dict(result) for result in formatted_results]
+
+    def _resolve_mode(self, mode: Optional[str]) -> str:
+        mode = mode or self.default_query_mode
+        if mode not in QUERY_MODES:
+            raise ValueError(
+                f"Unknown query mode '{mode}', expected one of {QUERY_MODES}"
             )
+        return mode
+
+    @staticmethod
+    def _format_results(results: List[Tuple[float, dict]]) -> List[dict]:
+        return [
+            {
+                "content": metadata.get("content", ""),
+                "document_name": metadata.get("doc_name", ""),
+                "version": metadata.get("version_number", ""),
+                "chunk_index": metadata.get("chunk_index", ""),
+                "page_number": metadata.get("page_number"),
+                "similarity_score": similarity,
+            }
+            for similarity, metadata in results
+        ]
+
+    def _dense_search(
+        self,
+        normalized: str,
+        k: int,
+        version_id: Optional[int],
+        latest_only: bool,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[Tuple[float, dict]]:
+        query_embedding = self.query_embedding_cache.get(normalized)
+        if query_embedding is None:
+            query_embedding = self.query_batcher.embed(normalized)
+            self.query_embedding_cache.put(normalized, query_embedding)
+
+        results = self.vector_store.search(
+            query_embedding,
+            k=k,
+            version_filter=version_id,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            latest_only=latest_only,
+        )
+        return [(1 / (1 + distance), metadata) for distance, metadata in results]
+
+    def _dense_search_batch(
+        self,
+        normalized: List[str],
+        k: int,
+        version_ids: List[Optional[int]],
+        latest_only: bool,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[List[Tuple[float, dict]]]:
+        embeddings = {}
+        for question in normalized:
+            embedding = self.query_embedding_cache.get(question)
+            if embedding is not None:
+                embeddings[question] = embedding
+
+        missing = list(dict.fromkeys(q for q in normalized if q not in embeddings))
+        if missing:
+            # Called directly rather than through the micro-batcher: this is
+            # already one large batch.
+            for question, embedding in zip(
+                missing, self.embedder.embed_batch(missing, show_progress_bar=False)
+            ):
+                embeddings[question] = embedding
+                self.query_embedding_cache.put(question, embedding)
+
+        matrix = np.vstack([embeddings[question] for question in normalized])
+        results = self.vector_store.search_batch(
+            matrix,
+            k=k,
+            version_filters=version_ids,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            latest_only=latest_only,
+        )
+        return [
+            [(1 / (1 + distance), metadata) for distance, metadata in row_results]
+            for row_results in results
+        ]
+
+    def _lexical_search(
+        self, normalized: str, k: int, version_id: Optional[int], latest_only: bool
+    ) -> List[Tuple[float, dict]]:
+        lexical_index = self._get_lexical_index()
+        store = self.vector_store
+
+        # Scoping, ranking and resolving take separate locks, so a compaction
+        # can renumber vector ids between them. The steps agree on ids when
+        # both indexes show the same compaction before and after; otherwise
+        # they are redone under the write lock, which compaction also holds.
+        compactions = store.compactions
+        results = None
+        if lexical_index.compactions == compactions:
+            results = self._lexical_hits(normalized, k, version_id, latest_only)
+            if not (lexical_index.compactions == store.compactions == compactions):
+                results = None
+        if results is None:
+            with self._write_lock:
+                results = self._lexical_hits(normalized, k, version_id, latest_only)
+
+        return [(bm25_similarity(score), metadata) for score, metadata in results]
+
+    def _lexical_hits(
+        self, normalized: str, k: int, version_id: Optional[int], latest_only: bool
+    ) -> List[Tuple[float, dict]]:
+        candidates, exclude = self.vector_store.scope_ids(version_id, latest_only)
+        hits = self.lexical_index.search(normalized, k, candidates, exclude)
+        return self.vector_store.resolve(hits, version_id, latest_only)
+
+    @staticmethod
+    def _fuse(
+        dense: List[Tuple[float, dict]], lexical: List[Tuple[float, dict]], k: int
+    ) -> List[Tuple[float, dict]]:
+        # Reciprocal rank fusion: only ranks are combined, so L2 distances and
+        # BM25 scores never have to share a scale. Reported similarities stay
+        # on the dense scale the confidence thresholds are calibrated for: a
+        # chunk only the lexical side found ranked below every dense hit, so
+        # it gets the lowest dense similarity as an upper bound.
+        floor = min((similarity for similarity, _ in dense), default=0.0)
+        fused = {}
+        for results, lexical_side in ((dense, False), (lexical, True)):
+            for rank, (similarity, metadata) in enumerate(results):
+                key = (metadata.get("version_id"), metadata.get("chunk_index"))
+                entry = fused.setdefault(
+                    key, [0.0, floor if lexical_side else similarity, metadata]
+                )
+                entry[0] += 1 / (RRF_K + rank + 1)
 
-        return formatted_results
+        ranked = sorted(fused.values(), key=lambda entry: entry[0], reverse=True)
+        return [(similarity, metadata) for _, similarity, metadata in ranked[:k]]
 
     def get_document_versions(self, doc_name: str) -> List[dict]:
         session = get_db_session(self.database_url)
@@ -234,6 +1005,15 @@ class IncrementalRAGSystem:
                 "num_versions": num_versions,
                 "num_chunks": num_chunks,
                 "vector_store": vector_stats,
+                "lexical_index": self.lexical_index.get_stats()
+                if self.lexical_index is not None
+                else None,
+                "embedding_cache": self.embedding_cache.get_stats(),
+                "query_cache": {
+                    "embeddings": self.query_embedding_cache.get_stats(),
+                    "results": self.result_cache.get_stats(),
+                },
+                "query_batching": self.query_batcher.get_stats(),
             }
         finally:
             session.close()
@@ -0,0 +1,12 @@
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+@contextmanager
+def timed_phase(timings: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
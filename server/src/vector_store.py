@@ -1,34 +1,253 @@
 import faiss
 import numpy as np
+import os
 import pickle
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Dict, List, Set, Tuple, Optional
+
+from src.delta_log import DeltaLog
+from src.locks import ReadWriteLock
+from src.metadata_store import CHUNK_FIELDS, ChunkMetadataStore
+
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+DEFAULT_INDEX_PARAMS = {
+    "nlist": int(os.getenv("FAISS_NLIST", "1024")),
+    "nprobe": int(os.getenv("FAISS_NPROBE", "16")),
+    "hnsw_m": int(os.getenv("FAISS_HNSW_M", "32")),
+    "ef_construction": int(os.getenv("FAISS_EF_CONSTRUCTION", "200")),
+    "ef_search": int(os.getenv("FAISS_EF_SEARCH", "64")),
+    "pq_m": int(os.getenv("FAISS_PQ_M", "48")),
+    "pq_bits": int(os.getenv("FAISS_PQ_BITS", "8")),
+    "max_train_size": int(os.getenv("FAISS_MAX_TRAIN_SIZE", "200000")),
+}
+
+# The delta log is folded into a new snapshot once it reaches this fraction of
+# the last snapshot's size, which keeps the amortized write cost per upload
+# proportional to the upload itself.
+LOG_COMPACT_RATIO = float(os.getenv("FAISS_LOG_COMPACT_RATIO", "0.5"))
+LOG_COMPACT_MIN_BYTES = int(os.getenv("FAISS_LOG_COMPACT_MIN_BYTES", str(64 << 20)))
+
+# Older faiss builds only map inverted lists; IO_FLAG_MMAP_IFC also maps the
+# codes of flat indexes.
+MMAP_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | getattr(
+    faiss, "IO_FLAG_READ_ONLY", 0
+)
+MMAP_INDEX_TYPES = (
+    INDEX_TYPES if hasattr(faiss, "IO_FLAG_MMAP_IFC") else ("ivf", "ivfpq")
+)
+
+# Deleted vectors stay in the index as tombstones until this fraction of it is
+# dead; compaction then rebuilds the index without them.
+COMPACT_MIN_DEAD_RATIO = float(os.getenv("FAISS_COMPACT_RATIO", "0.2"))
+
+# FAISS warns below ~39 training points per IVF list.
+MIN_POINTS_PER_LIST = 39
+
+
+def detect_index_type(index) -> str:
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def min_training_size(index_type: str, params: dict) -> int:
+    if index_type == "ivf":
+        return params["nlist"] * MIN_POINTS_PER_LIST
+    if index_type == "ivfpq":
+        # The PQ codebooks need at least one training point per centroid.
+        return max(params["nlist"] * MIN_POINTS_PER_LIST, 2 ** params["pq_bits"])
+    return 0
+
+
+def build_index(
+    index_type: str,
+    embedding_dim: int,
+    vectors: np.ndarray,
+    params: dict,
+    train_vectors: np.ndarray = None,
+):
+    # IVF variants are trained on train_vectors (default: vectors), which may
+    # include vectors that are added to the index later.
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}"
+        )
+    train = vectors if train_vectors is None else train_vectors
+    if index_type == "ivfpq" and len(train) < 2 ** params["pq_bits"]:
+        raise ValueError(
+            f"IVF-PQ with pq_bits={params['pq_bits']} needs at least "
+            f"{2 ** params['pq_bits']} training vectors, got {len(train)}"
+        )
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(embedding_dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(embedding_dim, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        index.hnsw.efSearch = params["ef_search"]
+    else:
+        nlist = max(1, min(params["nlist"], len(train) // MIN_POINTS_PER_LIST))
+        quantizer = faiss.IndexFlatL2(embedding_dim)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer, embedding_dim, nlist, params["pq_m"], params["pq_bits"]
+            )
+
+        if len(train) > params["max_train_size"]:
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(train), params["max_train_size"], replace=False)
+            train = train[np.sort(sample)]
+        index.train(train)
+        index.nprobe = params["nprobe"]
+        # Version-filtered search reconstructs vectors by id.
+        index.make_direct_map()
+
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+
+def search_parameters(
+    index_type: str,
+    params: dict,
+    nprobe: int = None,
+    ef_search: int = None,
+    sel=None,
+):
+    if index_type in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe or params["nprobe"], sel=sel)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(
+            efSearch=ef_search or params["ef_search"], sel=sel
+        )
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+
+def _remap_record(record: dict, remap: np.ndarray) -> dict:
+    # A delta log record with its vector ids renumbered by a compaction.
+    if record["op"] == "add":
+        return {**record, "start_id": int(remap[record["start_id"]])}
+    if record["op"] == "version":
+        return {**record, "ids": remap[record["ids"]]}
+    if record["op"] == "delete" and "orphan_ids" in record:
+        orphan_ids = remap[record["orphan_ids"]]
+        return {**record, "orphan_ids": orphan_ids[orphan_ids >= 0]}
+    return record
 
 
 class FAISSVectorStore:
 
-    def __init__(self, embedding_dim: int, index_path: str = None):
+    def __init__(
+        self,
+        embedding_dim: int,
+        index_path: str = None,
+        index_type: str = None,
+        index_params: dict = None,
+        mmap: bool = None,
+    ):
 
         self.embedding_dim = embedding_dim
         self.index_path = index_path or "./data/faiss_index"
+        self.index_type = index_type or os.getenv("FAISS_INDEX_TYPE", "flat")
+        self.index_params = {**DEFAULT_INDEX_PARAMS, **(index_params or {})}
+        if mmap is None:
+            mmap = os.getenv("FAISS_MMAP", "false").lower() in ("1", "true", "yes")
+        self.mmap = mmap
+        self._index_mapped = False
+        self._mapped_file = None
         self.index = None
-        self.id_to_metadata = {}  # Map FAISS ID to metadata
+        self.id_to_metadata = ChunkMetadataStore()  # Map FAISS ID to metadata
+        # Per version, the FAISS id of each chunk in chunk_index order. Chunks
+        # unchanged from an earlier version point at that version's vector.
+        self.version_to_ids: Dict[int, List[np.ndarray]] = {}
+        self.version_to_pages: Dict[int, List[np.ndarray]] = {}
+        # document_id -> (version_number, version_id) of its newest version.
+        self.latest_versions: Dict[int, Tuple[int, int]] = {}
+        self.version_documents: Dict[int, int] = {}
+        # Ids of deleted vectors, skipped by search until compaction.
+        self.tombstones: Set[int] = set()
+        self._tombstone_selector = None
+        # One flag per vector id: is it a chunk of its document's latest
+        # version? Kept current as versions are added; rebuilt after deletes.
+        self._latest_mask: Optional[np.ndarray] = None
+        self._latest_selector = None
+        self.compactions = 0
         self.current_id = 0
+        self.generation = 0
+        self.snapshot_bytes = 0
+        self.delta_log = DeltaLog(f"{self.index_path}.log")
+        self._pending_records: List[dict] = []
+        # Records applied while a compaction is being built, replayed onto
+        # its snapshot when it is swapped in; None when none is running.
+        self._compaction_log: Optional[List[dict]] = None
+        self._snapshot_files: List[str] = []
+        self._needs_snapshot = False
+        # FAISS allows concurrent searches but not searches during an add.
+        self._lock = ReadWriteLock()
 
         Path(self.index_path).parent.mkdir(parents=True, exist_ok=True)
 
-        if Path(f"{self.index_path}.faiss").exists():
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(
+                f"Unknown index type '{self.index_type}', expected one of {INDEX_TYPES}"
+            )
+
+        if Path(f"{self.index_path}.meta").exists():
             self.load()
+            if self._maybe_upgrade_index():
+                # Persist the migration so the next start does not redo it.
+                self._save()
         else:
             self._create_new_index()
 
+    @property
+    def active_index_type(self) -> str:
+        return detect_index_type(self.index)
+
     def _create_new_index(self):
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
-        self.id_to_metadata = {}
+        # IVF variants need training data, so they start out flat and are
+        # migrated once enough vectors have been added.
+        initial_type = "hnsw" if self.index_type == "hnsw" else "flat"
+        self.index = build_index(
+            initial_type,
+            self.embedding_dim,
+            np.empty((0, self.embedding_dim), dtype="float32"),
+            self.index_params,
+        )
+        self.id_to_metadata.close()
+        self.id_to_metadata = ChunkMetadataStore()
+        self.version_to_ids = {}
+        self.version_to_pages = {}
+        self.latest_versions = {}
+        self.version_documents = {}
+        self.tombstones = set()
+        self._tombstone_selector = None
+        self._invalidate_latest()
         self.current_id = 0
+        self._pending_records = []
+        self._index_mapped = False
+        # Nothing is on disk yet, so the first persist writes a full snapshot.
+        self._needs_snapshot = True
         print(f"Created new FAISS index with dimension {self.embedding_dim}")
 
-    def add_embeddings(self, embeddings: np.ndarray, metadata: List[dict]) -> List[int]:
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        metadata: List[dict],
+        register_versions: bool = True,
+    ) -> List[int]:
+        # With register_versions=False the vectors are only stored; the caller
+        # maps them to a version with add_version_chunks().
 
         if embeddings.shape[1] != self.embedding_dim:
             raise ValueError(
@@ -38,89 +257,1085 @@ class FAISSVectorStore:
 
         embeddings = embeddings.astype("float32")
 
-        num_vectors = embeddings.shape[0]
-        ids = list(range(self.current_id, self.current_id + num_vectors))
+        with self._lock.write():
+            record = {
+                "op": "add",
+                "start_id": self.current_id,
+                "vectors": embeddings,
+                "metadata": metadata,
+                "register_versions": register_versions,
+            }
+            # Train any IVF upgrade first, so a failure leaves nothing applied.
+            self._maybe_upgrade_index(embeddings)
+            ids = self._apply_add(record)
+            self._log_record(record)
+
+            print(f"Added {len(ids)} vectors. Total: {self.index.ntotal}")
+            return ids
+
+    def add_version_chunks(
+        self,
+        version_id: int,
+        version_number: int,
+        document_id: int,
+        doc_name: str,
+        ids: List[int],
+        page_numbers: List[Optional[int]],
+    ):
+        # Appends the next chunks of a version, in chunk_index order. The ids
+        # may be new vectors or vectors already owned by an earlier version.
+        with self._lock.write():
+            record = {
+                "op": "version",
+                "version_id": version_id,
+                "version_number": version_number,
+                "document_id": document_id,
+                "doc_name": doc_name,
+                "ids": np.asarray(ids, dtype="int64"),
+                "pages": np.asarray(
+                    [-1 if page is None else page for page in page_numbers],
+                    dtype="int32",
+                ),
+            }
+            self._apply_version(record)
+            self._log_record(record)
+
+    def _apply_version(self, record: dict):
+        ids = record["ids"]
+        if len(ids) and (ids.min() < 0 or ids.max() >= self.current_id):
+            raise ValueError(
+                f"Version {record['version_id']} references unknown vector ids"
+            )
+
+        version_id = record["version_id"]
+        self.version_to_ids.setdefault(version_id, []).append(ids)
+        self.version_to_pages.setdefault(version_id, []).append(record["pages"])
+        self.id_to_metadata.version_numbers[version_id] = record["version_number"]
+        self.id_to_metadata.doc_names[record["document_id"]] = record["doc_name"]
+        self.version_documents[version_id] = record["document_id"]
+
+        previous = self.latest_versions.get(record["document_id"])
+        self._note_version(
+            record["document_id"], version_id, record["version_number"]
+        )
+        if self.latest_versions[record["document_id"]][1] == version_id:
+            if previous is None or previous[1] == version_id:
+                self._mark_latest(ids, True)
+            else:
+                # A newer version took over: swap the whole document over.
+                self._mark_latest(self.get_version_ids(previous[1]), False)
+                self._mark_latest(self.get_version_ids(version_id), True)
+
+    def delete_versions(
+        self, version_ids: List[int], orphan_ids: Optional[List[int]] = None
+    ) -> int:
+        # Versions disappear from version-filtered and latest-only search at
+        # once; vectors no other version references become tombstones.
+        # orphan_ids are vectors added for these versions but not (or not
+        # yet) mapped to them, e.g. by an upload that failed part way.
+        with self._lock.write():
+            record = {
+                "op": "delete",
+                "version_ids": list(version_ids),
+                "orphan_ids": np.asarray(orphan_ids or [], dtype="int64"),
+            }
+            removed = self._apply_delete(record)
+            self._log_record(record)
+            return removed
+
+    def _apply_delete(self, record: dict) -> int:
+        deleted = set(record["version_ids"])
+        documents = {
+            self.version_documents[v] for v in deleted if v in self.version_documents
+        }
+        parts = [self.get_version_ids(v) for v in deleted]
+        if "orphan_ids" in record:
+            parts.append(record["orphan_ids"])
+        candidates = (
+            np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype="int64")
+        )
+
+        for version_id in deleted:
+            self.version_to_ids.pop(version_id, None)
+            self.version_to_pages.pop(version_id, None)
+            self.version_documents.pop(version_id, None)
+            self.id_to_metadata.version_numbers.pop(version_id, None)
+
+        # Vectors are only shared within a document, so only its surviving
+        # versions can still reference them. Iterating oldest first lets the
+        # newest reference win below.
+        version_numbers = self.id_to_metadata.version_numbers
+        surviving = sorted(
+            (v for v, d in self.version_documents.items() if d in documents),
+            key=lambda v: version_numbers.get(v, 0),
+        )
+        still_used: Dict[int, Tuple[int, int]] = {}
+        for version_id in surviving:
+            ids = self.get_version_ids(version_id)
+            for position in np.flatnonzero(np.isin(ids, candidates)):
+                still_used[int(ids[position])] = (version_id, int(position))
+
+        dead = [int(i) for i in candidates if int(i) not in still_used]
+        self.tombstones.update(dead)
+        self._tombstone_selector = None
+        self._invalidate_latest()
 
+        # A surviving vector whose row named a deleted version now reports
+        # the newest version that still contains it.
+        owners = self.id_to_metadata.column("version_id")
+        moved = [i for i in still_used if int(owners[i]) in deleted]
+        if moved:
+            moved_ids = np.asarray(moved, dtype="int64")
+            self.id_to_metadata.update(
+                moved_ids,
+                version_id=[still_used[i][0] for i in moved],
+                chunk_index=[still_used[i][1] for i in moved],
+                page_number=[
+                    self.get_version_pages(still_used[i][0])[still_used[i][1]]
+                    for i in moved
+                ],
+            )
+
+        for document_id in documents:
+            versions = [
+                (version_numbers[v], v)
+                for v in surviving
+                if self.version_documents.get(v) == document_id
+                and v in version_numbers
+            ]
+            if versions:
+                self.latest_versions[document_id] = max(versions)
+            else:
+                self.latest_versions.pop(document_id, None)
+
+        return len(dead)
+
+    def _log_record(self, record: dict):
+        self._pending_records.append(record)
+        if self._compaction_log is not None:
+            self._compaction_log.append(record)
+
+    def _note_version(self, document_id: int, version_id: int, version_number):
+        latest = self.latest_versions.get(document_id)
+        if latest is None or version_number >= latest[0]:
+            self.latest_versions[document_id] = (version_number, version_id)
+
+    def _mark_latest(self, ids: np.ndarray, value: bool):
+        if self._latest_mask is None:
+            return
+        if len(ids) and ids.max() >= len(self._latest_mask):
+            mask = np.zeros(
+                max(int(ids.max()) + 1, 2 * len(self._latest_mask), 1024), dtype=bool
+            )
+            mask[: len(self._latest_mask)] = self._latest_mask
+            self._latest_mask = mask
+        self._latest_mask[ids] = value
+        self._latest_selector = None
+
+    def _invalidate_latest(self):
+        self._latest_mask = None
+        self._latest_selector = None
+
+    def _get_latest_selector(self):
+        # (bitmap, selector) over the latest versions' vectors, so latest-only
+        # search runs on the index itself instead of reconstructing them. The
+        # selector only borrows the bitmap: hold the pair while searching.
+        selector = self._latest_selector
+        if selector is None:
+            if self._latest_mask is None:
+                mask = np.zeros(max(self.current_id, 1024), dtype=bool)
+                for _, version_id in self.latest_versions.values():
+                    mask[self.get_version_ids(version_id)] = True
+                self._latest_mask = mask
+            # IDSelectorBitmap tests bit (id & 7) of byte id >> 3.
+            bitmap = np.packbits(self._latest_mask, bitorder="little")
+            selector = self._latest_selector = (
+                bitmap,
+                faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)),
+            )
+        return selector
+
+    def _ensure_writable(self):
+        if not self._index_mapped:
+            return
+
+        # The mapped pages are shared and read-only; the first write in this
+        # process moves the index into private memory. The snapshot is read
+        # again without the mmap flags: clone_index cannot copy the on-disk
+        # inverted lists a mapped IVF index uses. A mapped index is never
+        # written to, so the file still holds exactly what is in memory.
+        print("Reading memory-mapped index into private memory for writing")
+        self.index = faiss.read_index(self._mapped_file)
+        self._index_mapped = False
+        self._mapped_file = None
+
+    def _apply_add(self, record: dict) -> List[int]:
+        embeddings = record["vectors"]
+        metadata = record["metadata"]
+        ids = list(range(record["start_id"], record["start_id"] + len(embeddings)))
+
+        self._ensure_writable()
         self.index.add(embeddings)
+        self.id_to_metadata.append(record["start_id"], metadata)
+        if record.get("register_versions", True):
+            self._register_version_ids(ids, metadata)
+
+        self.current_id = record["start_id"] + len(embeddings)
+        return ids
+
+    def _apply_record(self, record: dict):
+        if record["op"] == "add":
+            if record["start_id"] != self.current_id:
+                raise ValueError(
+                    f"Delta log out of sequence: expected id {self.current_id}, "
+                    f"got {record['start_id']}"
+                )
+            self._apply_add(record)
+        elif record["op"] == "version":
+            self._apply_version(record)
+        elif record["op"] == "delete":
+            self._apply_delete(record)
+        else:
+            raise ValueError(f"Unknown delta log operation: {record['op']}")
+
+    def _maybe_upgrade_index(self, incoming: np.ndarray = None) -> bool:
+        # incoming are vectors about to be added; they count towards (and are
+        # used for) training but are not added to the rebuilt index.
+        num_incoming = 0 if incoming is None else len(incoming)
+        if self.active_index_type == self.index_type:
+            return False
+        if self.index.ntotal + num_incoming < min_training_size(
+            self.index_type, self.index_params
+        ):
+            return False
+        self._rebuild_index(train_extra=incoming)
+        return True
 
+    def rebuild_index(self, index_type: str = None, **params):
+        with self._lock.write():
+            self._rebuild_index(index_type, **params)
+
+    def _rebuild_index(
+        self, index_type: str = None, train_extra: np.ndarray = None, **params
+    ):
+        index_type = index_type or self.index_type
+        index_params = {**self.index_params, **params}
+
+        previous_type = self.active_index_type
+        if previous_type == "ivfpq":
+            print("Warning: rebuilding from IVF-PQ codes, vectors are approximate")
+
+        vectors = (
+            self.index.reconstruct_n(0, self.index.ntotal)
+            if self.index.ntotal
+            else np.empty((0, self.embedding_dim), dtype="float32")
+        )
+        train_vectors = (
+            None if train_extra is None else np.vstack([vectors, train_extra])
+        )
+        self.index = build_index(
+            index_type, self.embedding_dim, vectors, index_params, train_vectors
+        )
+        self.index_params = index_params
+        self.index_type = index_type
+        self._index_mapped = False
+        # The logged vectors were added to the old index; start a fresh
+        # snapshot so replay never mixes the two.
+        self._needs_snapshot = True
+
+        print(
+            f"Rebuilt FAISS index: {previous_type} -> {index_type} "
+            f"({self.index.ntotal} vectors)"
+        )
+
+    def needs_compaction(self) -> bool:
+        return bool(self.tombstones) and len(self.tombstones) >= (
+            COMPACT_MIN_DEAD_RATIO * self.index.ntotal
+        )
+
+    def prepare_compaction(self) -> Optional[dict]:
+        # First half of compaction: copy out the live vectors and text under
+        # the read lock, then build the new index and write it as a snapshot
+        # with no lock held, so searches and uploads carry on meanwhile.
+        # Changes made in the meantime are recorded for finish_compaction().
+        with self._lock.read():
+            if not self.tombstones:
+                return None
+
+            upto = self.current_id
+            dead = np.array(sorted(self.tombstones), dtype="int64")
+            keep = np.setdiff1d(
+                np.arange(upto, dtype="int64"), dead, assume_unique=True
+            )
+            source_type = self.active_index_type
+            vectors = (
+                self.index.reconstruct_batch(keep)
+                if len(keep)
+                else np.empty((0, self.embedding_dim), dtype="float32")
+            )
+            metadata = self.id_to_metadata.subset(keep)
+            compactions = self.compactions
+            version_ids = {v: self.get_version_ids(v) for v in self.version_to_ids}
+            version_pages = {v: self.get_version_pages(v) for v in self.version_to_ids}
+            latest_versions = dict(self.latest_versions)
+            version_documents = dict(self.version_documents)
+            # Writers are excluded while the read lock is held, so every
+            # change after the copy lands in the compaction log.
+            self._compaction_log = []
+
+        try:
+            if source_type == "ivfpq":
+                print("Warning: compacting from IVF-PQ codes, vectors are approximate")
+            index_type = source_type
+            if len(keep) < max(1, min_training_size(source_type, self.index_params)):
+                index_type = "hnsw" if source_type == "hnsw" else "flat"
+            index = build_index(
+                index_type, self.embedding_dim, vectors, self.index_params
+            )
+
+            # Versions never reference tombstoned vectors, so every id maps.
+            remap = np.full(upto, -1, dtype="int64")
+            remap[keep] = np.arange(len(keep), dtype="int64")
+            snapshot = self._write_snapshot_files(
+                f"{self.index_path}.compacted{compactions + 1}",
+                index,
+                metadata,
+                {v: remap[ids] for v, ids in version_ids.items()},
+                version_pages,
+            )
+        except Exception:
+            with self._lock.write():
+                self._compaction_log = None
+            raise
+
+        return {
+            "upto": upto,
+            "keep": keep,
+            "dead": set(dead.tolist()),
+            "index": index,
+            "metadata": metadata,
+            "source_type": source_type,
+            "compactions": compactions,
+            "snapshot": snapshot,
+            # The snapshot's state, which the compaction log is replayed on.
+            "meta": {
+                "latest_versions": latest_versions,
+                "version_documents": version_documents,
+                "tombstones": [],
+                "compactions": compactions + 1,
+                "current_id": len(keep),
+            },
+        }
+
+    def finish_compaction(self, plan: dict) -> Optional[np.ndarray]:
+        # Second half: swap in the compacted index. Returns old id -> new id
+        # (-1 for dropped vectors), or None if the plan went stale. Only the
+        # changes made since the plan are written here; the snapshot itself
+        # was written without the lock.
+        with self._lock.write():
+            records, self._compaction_log = self._compaction_log or [], None
+            if (
+                plan["compactions"] != self.compactions
+                or plan["source_type"] != self.active_index_type
+            ):
+                plan["metadata"].close()
+                self._remove_snapshot_files(plan["snapshot"]["snapshot_files"])
+                return None
+
+            keep = plan["keep"]
+            index = plan["index"]
+            metadata = plan["metadata"]
+
+            # Vectors added while the new index was being built.
+            extra = np.arange(plan["upto"], self.current_id, dtype="int64")
+            if len(extra):
+                index.add(self.index.reconstruct_batch(extra))
+                metadata.append(
+                    len(keep), [self.id_to_metadata.get(int(i)) for i in extra]
+                )
+
+            live = np.concatenate([keep, extra])
+            remap = np.full(self.current_id, -1, dtype="int64")
+            remap[live] = np.arange(len(live), dtype="int64")
+
+            # Rows may have been re-pointed by deletes since the copy.
+            for name in CHUNK_FIELDS:
+                column = self.id_to_metadata.column(name)
+                metadata.rows[name][: len(keep)] = column[keep]
+            metadata.doc_names = dict(self.id_to_metadata.doc_names)
+            metadata.version_numbers = dict(self.id_to_metadata.version_numbers)
+
+            self.version_to_ids = {
+                version_id: [remap[self.get_version_ids(version_id)]]
+                for version_id in list(self.version_to_ids)
+            }
+            # Tombstoned after the copy: still in the new index, still dead.
+            self.tombstones = {
+                int(remap[i]) for i in self.tombstones if i not in plan["dead"]
+            }
+            self._tombstone_selector = None
+            self._invalidate_latest()
+
+            # Ids changed, so the changes since the plan are logged again in
+            # the new id space under the new generation, then the metadata
+            # file commits the snapshot they replay onto.
+            generation = self.generation + 1
+            self.delta_log.append(
+                [
+                    {**_remap_record(record, remap), "generation": generation}
+                    for record in records
+                ]
+            )
+            self._write_meta(generation, plan["snapshot"], plan["meta"])
+
+            removed = self.index.ntotal - index.ntotal
+            self.id_to_metadata.close()
+            self.id_to_metadata = metadata
+            self.index = index
+            self.current_id = len(live)
+            self._index_mapped = False
+            self.compactions += 1
+            self._pending_records = []
+            self._adopt_snapshot(generation, plan["snapshot"]["snapshot_files"])
+
+            print(f"Compacted FAISS index: removed {removed} vectors")
+            return remap
+
+    def _search_params(self, nprobe: int = None, ef_search: int = None):
+        return search_parameters(
+            self.active_index_type,
+            self.index_params,
+            nprobe,
+            ef_search,
+            sel=self._get_tombstone_selector(),
+        )
+
+    def _get_tombstone_selector(self):
+        if not self.tombstones:
+            return None
+
+        if self._tombstone_selector is None:
+            dead = np.array(sorted(self.tombstones), dtype="int64")
+            batch = faiss.IDSelectorBatch(len(dead), faiss.swig_ptr(dead))
+            # IDSelectorNot only borrows the inner selector; keep both alive.
+            self._tombstone_selector = (batch, faiss.IDSelectorNot(batch))
+        return self._tombstone_selector[1]
+
+    def _register_version_ids(self, ids: List[int], metadata: List[dict]):
+        # Every vector belongs to the version in its own metadata (add records
+        # written before versions could share vectors).
+        grouped: Dict[int, List[int]] = {}
         for i, meta in zip(ids, metadata):
-            self.id_to_metadata[i] = meta
+            version_id = meta.get("version_id")
+            if version_id is not None:
+                grouped.setdefault(version_id, []).append(i)
+                if "document_id" in meta:
+                    self.version_documents[version_id] = meta["document_id"]
+                if "document_id" in meta and "version_number" in meta:
+                    self._note_version(
+                        meta["document_id"], version_id, meta["version_number"]
+                    )
 
-        self.current_id += num_vectors
+        self._invalidate_latest()
+        pages = self.id_to_metadata.column("page_number")
+        for version_id, version_ids in grouped.items():
+            version_ids = np.asarray(version_ids, dtype="int64")
+            self.version_to_ids.setdefault(version_id, []).append(version_ids)
+            self.version_to_pages.setdefault(version_id, []).append(
+                pages[version_ids].astype("int32")
+            )
 
-        print(f"Added {num_vectors} vectors. Total: {self.index.ntotal}")
-        return ids
+    def _rebuild_version_ids(self):
+        versions = self.id_to_metadata.column("version_id")
+        documents = self.id_to_metadata.column("document_id")
+        pages = self.id_to_metadata.column("page_number")
+        order = np.argsort(versions, kind="stable")
+        boundaries = np.flatnonzero(np.diff(versions[order])) + 1
+
+        self.version_to_ids = {}
+        self.version_to_pages = {}
+        self.latest_versions = {}
+        self.version_documents = {}
+        self._invalidate_latest()
+        for group in np.split(order, boundaries):
+            if len(group) and versions[group[0]] >= 0:
+                version_id = int(versions[group[0]])
+                self.version_documents[version_id] = int(documents[group[0]])
+                self.version_to_ids[version_id] = [group.astype("int64")]
+                self.version_to_pages[version_id] = [pages[group].astype("int32")]
+                version_number = self.id_to_metadata.version_numbers.get(version_id)
+                if version_number is not None:
+                    self._note_version(
+                        int(documents[group[0]]), version_id, version_number
+                    )
+
+    @staticmethod
+    def _merged(parts: Optional[List[np.ndarray]], dtype: str) -> np.ndarray:
+        if not parts:
+            return np.empty(0, dtype=dtype)
+
+        if len(parts) > 1:
+            # Batches are appended as separate arrays; merge them on first read.
+            parts[:] = [np.concatenate(parts)]
+        return parts[0]
+
+    def get_version_ids(self, version_id: int) -> np.ndarray:
+        return self._merged(self.version_to_ids.get(version_id), "int64")
+
+    def get_version_pages(self, version_id: int) -> np.ndarray:
+        return self._merged(self.version_to_pages.get(version_id), "int32")
+
+    def _version_metadata(self, version_id: int, position: int) -> dict:
+        # A shared vector's own row describes the version that first stored
+        # it; report it as chunk `position` of the version that was searched.
+        faiss_id = int(self.get_version_ids(version_id)[position])
+        metadata = self.id_to_metadata.get(faiss_id, {})
+
+        page_number = int(self.get_version_pages(version_id)[position])
+        metadata.update(
+            version_id=version_id,
+            version_number=self.id_to_metadata.version_numbers.get(
+                version_id, metadata.get("version_number", "")
+            ),
+            chunk_index=position,
+            page_number=page_number if page_number >= 0 else None,
+        )
+        return metadata
 
     def search(
         self,
         query_embedding: np.ndarray,
         k: int = 5,
         version_filter: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        latest_only: bool = False,
     ) -> List[Tuple[float, dict]]:
 
-        if self.index.ntotal == 0:
-            return []
-
         if query_embedding.ndim == 1:
             query_embedding = query_embedding.reshape(1, -1)
-        query_embedding = query_embedding.astype("float32")
 
-        search_k = k * 10 if version_filter else k
+        return self.search_batch(
+            query_embedding[:1],
+            k,
+            [version_filter],
+            nprobe=nprobe,
+            ef_search=ef_search,
+            latest_only=latest_only,
+        )[0]
+
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = 5,
+        version_filters: Optional[List[Optional[int]]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        latest_only: bool = False,
+    ) -> List[List[Tuple[float, dict]]]:
+        # One result list per query row. Rows sharing a version filter are
+        # searched together as one matrix, so each version's vectors are
+        # reconstructed once per batch rather than once per query.
+        query_embeddings = query_embeddings.astype("float32")
+        if version_filters is None:
+            version_filters = [None] * len(query_embeddings)
+
+        groups: Dict[Optional[int], List[int]] = {}
+        for row, version_filter in enumerate(version_filters):
+            groups.setdefault(version_filter, []).append(row)
+
+        results: List[List[Tuple[float, dict]]] = [[] for _ in version_filters]
+        with self._lock.read():
+            for version_filter, rows in groups.items():
+                queries = query_embeddings[rows]
+                if version_filter is not None:
+                    group_results = self._search_version(queries, k, version_filter)
+                elif latest_only:
+                    group_results = self._search_latest(queries, k, nprobe, ef_search)
+                else:
+                    group_results = self._search(queries, k, nprobe, ef_search)
+
+                for row, row_results in zip(rows, group_results):
+                    results[row] = row_results
+
+        return results
+
+    def _search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+    ) -> List[List[Tuple[float, dict]]]:
+        if self.index.ntotal == 0:
+            return [[] for _ in queries]
+
+        distances, indices = self.index.search(
+            queries,
+            min(k, self.index.ntotal),
+            params=self._search_params(nprobe, ef_search),
+        )
+
+        return [
+            [
+                (float(dist), self.id_to_metadata.get(int(idx), {}))
+                for dist, idx in zip(row_distances, row_indices)
+                if idx != -1
+            ]
+            for row_distances, row_indices in zip(distances, indices)
+        ]
+
+    def _knn(
+        self, queries: np.ndarray, k: int, ids: np.ndarray
+    ) -> List[List[Tuple[float, int]]]:
+        # Exact search over just these vectors: the cost follows len(ids) and
+        # we always get min(k, len(ids)) hits back per query.
+        vectors = self.index.reconstruct_batch(ids)
+        distances, positions = faiss.knn(queries, vectors, min(k, len(ids)))
+        return [
+            [
+                (float(dist), int(pos))
+                for dist, pos in zip(row_distances, row_positions)
+                if pos != -1
+            ]
+            for row_distances, row_positions in zip(distances, positions)
+        ]
+
+    def _search_version(
+        self, queries: np.ndarray, k: int, version_id: int
+    ) -> List[List[Tuple[float, dict]]]:
+        ids = self.get_version_ids(version_id)
+        if len(ids) == 0:
+            return [[] for _ in queries]
+
+        return [
+            [(dist, self._version_metadata(version_id, pos)) for dist, pos in hits]
+            for hits in self._knn(queries, k, ids)
+        ]
+
+    def _search_latest(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+    ) -> List[List[Tuple[float, dict]]]:
+        if self.index.ntotal == 0 or not self.latest_versions:
+            return [[] for _ in queries]
+
+        # Latest versions never reference tombstoned vectors, so the latest
+        # selector alone also excludes deleted ones.
+        bitmap, selector = self._get_latest_selector()
         distances, indices = self.index.search(
-            query_embedding, min(search_k, self.index.ntotal)
+            queries,
+            min(k, self.index.ntotal),
+            params=search_parameters(
+                self.active_index_type,
+                self.index_params,
+                nprobe,
+                ef_search,
+                sel=selector,
+            ),
         )
 
+        documents = self.id_to_metadata.column("document_id")
         results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx == -1:
-                continue
+        for row_distances, row_indices in zip(distances, indices):
+            row_results = []
+            for dist, idx in zip(row_distances, row_indices):
+                if idx == -1:
+                    continue
+                latest = self.latest_versions.get(int(documents[idx]))
+                if latest is None:
+                    continue
+                metadata = self._chunk_metadata(int(idx), latest[1])
+                if metadata is not None:
+                    row_results.append((float(dist), metadata))
+            results.append(row_results)
+        return results
 
-            metadata = self.id_to_metadata.get(int(idx), {})
+    def _chunk_metadata(self, faiss_id: int, version_id: int) -> Optional[dict]:
+        # The vector described as a chunk of `version_id`, if that version
+        # contains it.
+        positions = np.flatnonzero(self.get_version_ids(version_id) == faiss_id)
+        if not len(positions):
+            return None
+        return self._version_metadata(version_id, int(positions[0]))
 
+    def scope_ids(
+        self, version_filter: Optional[int] = None, latest_only: bool = False
+    ) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        # (candidate ids or None for all, tombstoned ids) for callers that rank
+        # vector ids themselves, e.g. the lexical index.
+        with self._lock.read():
+            exclude = np.array(sorted(self.tombstones), dtype="int64")
             if version_filter is not None:
-                if metadata.get("version_id") != version_filter:
-                    continue
+                return self.get_version_ids(version_filter), exclude
+            if latest_only:
+                parts = [
+                    self.get_version_ids(version_id)
+                    for _, version_id in self.latest_versions.values()
+                ]
+                candidates = (
+                    np.concatenate(parts) if parts else np.empty(0, dtype="int64")
+                )
+                return candidates, exclude
+            return None, exclude
 
-            results.append((float(dist), metadata))
+    def resolve(
+        self,
+        hits: List[Tuple[float, int]],
+        version_filter: Optional[int] = None,
+        latest_only: bool = False,
+    ) -> List[Tuple[float, dict]]:
+        # Metadata for (score, vector id) hits, described as chunks of the
+        # version searched, like search() does. Hits whose version was
+        # deleted in the meantime are dropped.
+        results = []
+        with self._lock.read():
+            documents = self.id_to_metadata.column("document_id")
+            for score, faiss_id in hits:
+                if faiss_id in self.tombstones or faiss_id >= self.current_id:
+                    continue
 
-            if len(results) >= k:
-                break
+                version_id = version_filter
+                if version_id is None and latest_only:
+                    latest = self.latest_versions.get(int(documents[faiss_id]))
+                    version_id = latest[1] if latest else None
+                    if version_id is None:
+                        continue
+                if version_id is None:
+                    results.append((score, self.id_to_metadata.get(faiss_id, {})))
+                    continue
 
+                metadata = self._chunk_metadata(faiss_id, version_id)
+                if metadata is not None:
+                    results.append((score, metadata))
         return results
 
+    def persist(self, vectors_only: bool = False):
+        # vectors_only writes just the pending add records and keeps version
+        # mappings in memory. Uploads use it before their database commit, so
+        # a crash cannot replay a version the database never committed; the
+        # vectors it leaves unreferenced are tombstoned on load.
+        with self._lock.write():
+            if vectors_only:
+                if self._needs_snapshot:
+                    return
+                records = [r for r in self._pending_records if r["op"] == "add"]
+                self._pending_records = [
+                    r for r in self._pending_records if r["op"] != "add"
+                ]
+            else:
+                records, self._pending_records = self._pending_records, []
+
+                if self._needs_snapshot or self._log_too_large():
+                    self._save()
+                    return
+
+            self.delta_log.append(
+                [{**record, "generation": self.generation} for record in records]
+            )
+            # Logged text is durable now; keep it on disk rather than in RAM.
+            self.id_to_metadata.spill_text(f"{self.index_path}.text-spill")
+
+    def _log_too_large(self) -> bool:
+        log_bytes = self.delta_log.size()
+        return log_bytes >= max(
+            LOG_COMPACT_MIN_BYTES, self.snapshot_bytes * LOG_COMPACT_RATIO
+        )
+
     def save(self):
-        faiss.write_index(self.index, f"{self.index_path}.faiss")
+        with self._lock.write():
+            self._save()
+
+    def _save(self):
+        generation = self.generation + 1
+        snapshot = self._write_snapshot_files(
+            f"{self.index_path}.{generation}",
+            self.index,
+            self.id_to_metadata,
+            {v: self.get_version_ids(v) for v in self.version_to_ids},
+            {v: self.get_version_pages(v) for v in self.version_to_ids},
+        )
+        self._write_meta(
+            generation,
+            snapshot,
+            {
+                "latest_versions": dict(self.latest_versions),
+                "version_documents": dict(self.version_documents),
+                "tombstones": sorted(self.tombstones),
+                "compactions": self.compactions,
+                "current_id": self.current_id,
+            },
+        )
+
+        self._pending_records = []
+        self._needs_snapshot = False
+        # Older log records carry the previous generation and are ignored on
+        # replay, so truncating after the commit is safe even if it fails.
+        self.delta_log.reset()
+        self._adopt_snapshot(generation, snapshot["snapshot_files"])
 
-        with open(f"{self.index_path}.meta", "wb") as f:
+        print(f"Saved index snapshot to {self.index_path} (generation {generation})")
+
+    def _write_snapshot_files(
+        self,
+        prefix: str,
+        index,
+        metadata: ChunkMetadataStore,
+        version_ids: Dict[int, np.ndarray],
+        version_pages: Dict[int, np.ndarray],
+    ) -> dict:
+        index_file = f"{prefix}.faiss"
+        faiss.write_index(index, f"{index_file}.tmp")
+        os.replace(f"{index_file}.tmp", index_file)
+
+        metadata_state = metadata.save(prefix)
+        version_state = self._save_version_ids(
+            f"{prefix}.versions.npy", version_ids, version_pages
+        )
+        return {
+            "metadata_store": metadata_state,
+            "version_ids": version_state,
+            "index_file": Path(index_file).name,
+            "snapshot_files": [
+                Path(index_file).name,
+                metadata_state["rows_file"],
+                metadata_state["text_file"],
+                version_state["ids_file"],
+                version_state["pages_file"],
+            ],
+        }
+
+    def _write_meta(self, generation: int, snapshot: dict, state: dict):
+        meta_file = f"{self.index_path}.meta"
+        with open(f"{meta_file}.tmp", "wb") as f:
             pickle.dump(
                 {
-                    "id_to_metadata": self.id_to_metadata,
-                    "current_id": self.current_id,
+                    **snapshot,
+                    **state,
                     "embedding_dim": self.embedding_dim,
+                    "generation": generation,
                 },
                 f,
+                protocol=pickle.HIGHEST_PROTOCOL,
             )
+            f.flush()
+            os.fsync(f.fileno())
+
+        # The metadata file names every other snapshot file, so replacing it
+        # is the commit point for the whole snapshot.
+        os.replace(f"{meta_file}.tmp", meta_file)
+
+    def _adopt_snapshot(self, generation: int, snapshot_files: List[str]):
+        previous_files = self._snapshot_files
+        self.generation = generation
+        self._snapshot_files = snapshot_files
+        self.snapshot_bytes = sum(
+            os.path.getsize(self._snapshot_path(name)) for name in snapshot_files
+        )
+        self._remove_snapshot_files(previous_files)
+
+    def _remove_snapshot_files(self, names: List[str]):
+        for name in names:
+            path = self._snapshot_path(name)
+            if name not in self._snapshot_files and Path(path).exists():
+                os.remove(path)
 
-        print(f"Saved index to {self.index_path}")
+    def _save_version_ids(
+        self,
+        ids_file: str,
+        version_ids: Dict[int, np.ndarray],
+        version_pages: Dict[int, np.ndarray],
+    ) -> dict:
+        # All version id (and page) lists go into one array each with
+        # per-version ranges so they can be memory-mapped instead of unpickled.
+        ranges = {}
+        id_parts = []
+        page_parts = []
+        offset = 0
+        for version_id, ids in version_ids.items():
+            ranges[version_id] = (offset, offset + len(ids))
+            id_parts.append(ids)
+            page_parts.append(version_pages[version_id])
+            offset += len(ids)
+
+        pages_file = ids_file.replace(".versions.npy", ".version_pages.npy")
+        for path, parts, dtype in (
+            (ids_file, id_parts, "int64"),
+            (pages_file, page_parts, "int32"),
+        ):
+            values = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+            with open(f"{path}.tmp", "wb") as f:
+                np.save(f, values)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{path}.tmp", path)
+
+        return {
+            "ids_file": Path(ids_file).name,
+            "pages_file": Path(pages_file).name,
+            "ranges": ranges,
+        }
+
+    def _load_version_ids(self, state: dict):
+        mmap_mode = "r" if self.mmap else None
+        all_ids = np.load(self._snapshot_path(state["ids_file"]), mmap_mode=mmap_mode)
+        self.version_to_ids = {
+            version_id: [all_ids[start:end]]
+            for version_id, (start, end) in state["ranges"].items()
+        }
+
+        if "pages_file" in state:
+            all_pages = np.load(
+                self._snapshot_path(state["pages_file"]), mmap_mode=mmap_mode
+            )
+            self.version_to_pages = {
+                version_id: [all_pages[start:end]]
+                for version_id, (start, end) in state["ranges"].items()
+            }
+        else:
+            # Snapshots from before versions could share vectors: each id is
+            # the version's own chunk, so its row has the right page.
+            pages = self.id_to_metadata.column("page_number")
+            self.version_to_pages = {
+                version_id: [pages[ids].astype("int32") for ids in parts]
+                for version_id, parts in self.version_to_ids.items()
+            }
+
+    def _derive_version_documents(self):
+        # Snapshots written before deletes existed; versions only share
+        # vectors within a document, so any of a version's rows names it.
+        documents = self.id_to_metadata.column("document_id")
+        self.version_documents = {}
+        for version_id in self.version_to_ids:
+            ids = self.get_version_ids(version_id)
+            if len(ids):
+                self.version_documents[version_id] = int(documents[ids[0]])
+
+    def _snapshot_path(self, name: str) -> str:
+        return str(Path(self.index_path).parent / name)
 
     def load(self):
         try:
-            self.index = faiss.read_index(f"{self.index_path}.faiss")
-
             with open(f"{self.index_path}.meta", "rb") as f:
                 data = pickle.load(f)
-                self.id_to_metadata = data["id_to_metadata"]
                 self.current_id = data["current_id"]
                 self.embedding_dim = data["embedding_dim"]
+                self.generation = data.get("generation", 0)
 
-            print(f"Loaded index from {self.index_path} ({self.index.ntotal} vectors)")
+            # Layout written before snapshots were versioned.
+            index_name = data.get("index_file", f"{Path(self.index_path).name}.faiss")
+            self._snapshot_files = data.get("snapshot_files", [index_name])
+            if self.mmap:
+                self.index = faiss.read_index(
+                    self._snapshot_path(index_name), MMAP_IO_FLAGS
+                )
+                # Flags this faiss build cannot apply to the index type leave
+                # it read into private memory.
+                self._index_mapped = self.active_index_type in MMAP_INDEX_TYPES
+                self._mapped_file = self._snapshot_path(index_name)
+                if not self._index_mapped:
+                    print(
+                        f"faiss {faiss.__version__} cannot memory-map a "
+                        f"{self.active_index_type} index; loaded it into memory"
+                    )
+            else:
+                self.index = faiss.read_index(self._snapshot_path(index_name))
+
+            if "metadata_store" in data:
+                self.id_to_metadata = ChunkMetadataStore.load(
+                    str(Path(self.index_path).parent),
+                    data["metadata_store"],
+                    mmap=self.mmap,
+                )
+            else:
+                # Converted to the columnar store on the next snapshot.
+                self.id_to_metadata = ChunkMetadataStore.from_dicts(
+                    data["id_to_metadata"]
+                )
+                self._needs_snapshot = True
+
+            self.snapshot_bytes = sum(
+                os.path.getsize(self._snapshot_path(name))
+                for name in self._snapshot_files
+            )
+
+            self.tombstones = set(data.get("tombstones", []))
+            self._tombstone_selector = None
+            self._invalidate_latest()
+            self.compactions = data.get("compactions", 0)
+            if "version_ids" in data and "latest_versions" in data:
+                self._load_version_ids(data["version_ids"])
+                self.latest_versions = dict(data["latest_versions"])
+                self.version_documents = data.get("version_documents")
+                if self.version_documents is None:
+                    self._derive_version_documents()
+            else:
+                # Indexes saved before versions could share vectors: every
+                # vector belongs to the version in its own row.
+                self._rebuild_version_ids()
+
+            replayed = self._replay_log()
+            self._tombstone_unreferenced()
+
+            print(
+                f"Loaded index from {self.index_path} ({self.index.ntotal} vectors, "
+                f"{replayed} log records replayed)"
+            )
         except Exception as e:
-            print(f"Error loading index: {e}")
-            self._create_new_index()
+            # Starting empty here would let the next persist write a new
+            # generation over the unreadable one and prune its files.
+            raise RuntimeError(
+                f"Could not load the index snapshot at {self.index_path}: {e}"
+            ) from e
+
+    def _tombstone_unreferenced(self):
+        # Vectors no version references were logged by an upload that never
+        # committed; live vectors always belong to at least one version.
+        unreferenced = np.ones(self.current_id, dtype=bool)
+        for version_id in self.version_to_ids:
+            unreferenced[self.get_version_ids(version_id)] = False
+        if self.tombstones:
+            unreferenced[sorted(self.tombstones)] = False
+        orphans = np.flatnonzero(unreferenced)
+        if len(orphans):
+            print(f"Tombstoning {len(orphans)} vectors of uncommitted uploads")
+            self.tombstones.update(orphans.tolist())
+            self._tombstone_selector = None
+
+    def _replay_log(self) -> int:
+        replayed = 0
+        for record in self.delta_log.replay():
+            if record.get("generation") != self.generation:
+                continue
+            try:
+                self._apply_record(record)
+            except ValueError as e:
+                print(f"Stopping delta log replay: {e}")
+                self._needs_snapshot = True
+                break
+            replayed += 1
+        return replayed
 
     def get_stats(self) -> dict:
         return {
             "total_vectors": self.index.ntotal if self.index else 0,
             "embedding_dim": self.embedding_dim,
             "index_path": self.index_path,
+            "generation": self.generation,
+            "delta_log_bytes": self.delta_log.size(),
+            "metadata_bytes": self.id_to_metadata.nbytes(),
+            "memory_mapped": self._index_mapped,
+            "index_type": self.active_index_type if self.index else None,
+            "configured_index_type": self.index_type,
+            "versions": len(self.version_to_ids),
+            "tombstoned_vectors": len(self.tombstones),
+            "compactions": self.compactions,
+            # Chunks across all versions vs vectors actually stored.
+            "version_chunks": sum(
+                sum(len(part) for part in parts)
+                for parts in self.version_to_ids.values()
+            ),
         }
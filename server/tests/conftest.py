@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# server_app and the src package are imported from the server directory.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
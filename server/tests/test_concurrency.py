@@ -0,0 +1,87 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import server_app
+
+
+QUERY_SECONDS = 0.5
+CONCURRENT_REQUESTS = 6
+
+
+class SlowRAGSystem:
+    # Stands in for IncrementalRAGSystem: query() blocks like an encode plus
+    # FAISS search would.
+    default_query_mode = "dense"
+
+    def query(self, question, **kwargs):
+        time.sleep(QUERY_SECONDS)
+        return [
+            {
+                "content": "Employees get 25 vacation days.",
+                "document_name": "policy",
+                "version": 1,
+                "chunk_index": 0,
+                "page_number": None,
+                "similarity_score": 0.9,
+            }
+        ]
+
+
+async def _create_completion(**kwargs):
+    message = SimpleNamespace(
+        content=json.dumps({"not_found": False, "answer": "25 days"})
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def ready_app(monkeypatch):
+    monkeypatch.setattr(server_app, "rag_system", SlowRAGSystem())
+    monkeypatch.setattr(
+        server_app,
+        "_llm_client",
+        SimpleNamespace(
+            chat=SimpleNamespace(
+                completions=SimpleNamespace(create=_create_completion)
+            )
+        ),
+    )
+    monkeypatch.setitem(server_app.startup_state, "status", "ready")
+    return server_app.app
+
+
+async def _post_concurrently(app, count):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://testserver"
+    ) as client:
+        return await asyncio.gather(
+            *(
+                client.post(
+                    "/api/query/generate",
+                    json={"question": f"How many vacation days? ({i})"},
+                )
+                for i in range(count)
+            )
+        )
+
+
+def test_blocking_query_does_not_serialize_requests(ready_app):
+    assert CONCURRENT_REQUESTS <= server_app.blocking_executor._max_workers
+
+    start = time.perf_counter()
+    responses = asyncio.run(_post_concurrently(ready_app, CONCURRENT_REQUESTS))
+    elapsed = time.perf_counter() - start
+
+    assert [response.status_code for response in responses] == [200] * len(
+        responses
+    )
+    assert all(response.json()["answer"] == "25 days" for response in responses)
+    # Run on the event loop, the queries would take CONCURRENT_REQUESTS times
+    # as long; off the loop they overlap and take about one query's time.
+    assert elapsed < 2 * QUERY_SECONDS
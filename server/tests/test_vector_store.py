@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+
+from src.vector_store import FAISSVectorStore
+
+
+DIM = 16
+IVF_PARAMS = {"nlist": 4}
+
+
+def _metadata(count, version_id):
+    return [
+        {
+            "document_id": 1,
+            "version_id": version_id,
+            "chunk_index": i,
+            "doc_name": "policy",
+            "version_number": version_id,
+            "content": f"chunk {version_id}.{i}",
+        }
+        for i in range(count)
+    ]
+
+
+def _vectors(count, seed):
+    return np.random.default_rng(seed).random((count, DIM), dtype="float32")
+
+
+def _open(index_path, mmap):
+    return FAISSVectorStore(
+        DIM, str(index_path), index_type="ivf", index_params=IVF_PARAMS, mmap=mmap
+    )
+
+
+@pytest.fixture
+def ivf_index_with_log(tmp_path):
+    # An IVF snapshot plus one delta log record not yet folded into it.
+    index_path = tmp_path / "faiss_index"
+    store = _open(index_path, mmap=False)
+    store.add_embeddings(_vectors(400, 0), _metadata(400, 1))
+    store.persist()
+    store.add_embeddings(_vectors(3, 1), _metadata(3, 2))
+    store.persist()
+    assert store.active_index_type == "ivf"
+    store.id_to_metadata.close()
+    return index_path
+
+
+def test_mmap_ivf_index_replays_log_and_accepts_adds(ivf_index_with_log):
+    store = _open(ivf_index_with_log, mmap=True)
+    assert store.index.ntotal == 403
+    assert len(store.get_version_ids(2)) == 3
+
+    store.add_embeddings(_vectors(2, 2), _metadata(2, 3))
+    store.persist()
+    assert store.index.ntotal == 405
+    store.id_to_metadata.close()
+
+    reopened = _open(ivf_index_with_log, mmap=False)
+    assert reopened.index.ntotal == 405
+    results = reopened.search(_vectors(1, 2)[0], k=1, version_filter=3)
+    assert results[0][1]["content"] == "chunk 3.0"
+
+
+def test_unreadable_snapshot_is_not_replaced(ivf_index_with_log):
+    store = _open(ivf_index_with_log, mmap=False)
+    index_file = store._snapshot_path(store._snapshot_files[0])
+    store.id_to_metadata.close()
+    with open(index_file, "wb") as f:
+        f.write(b"not an index")
+
+    with pytest.raises(RuntimeError):
+        _open(ivf_index_with_log, mmap=False)
+    with open(index_file, "rb") as f:
+        assert f.read() == b"not an index"
+
+
+def test_uncommitted_upload_is_not_replayed(ivf_index_with_log):
+    # An upload logs its vectors mid-way, then the process dies before the
+    # database commit and the version record.
+    store = _open(ivf_index_with_log, mmap=False)
+    ids = store.add_embeddings(
+        _vectors(3, 3), _metadata(3, 4), register_versions=False
+    )
+    store.add_version_chunks(4, 4, 1, "policy", ids, [None] * 3)
+    store.persist(vectors_only=True)
+    store.id_to_metadata.close()
+
+    reopened = _open(ivf_index_with_log, mmap=False)
+    assert reopened.index.ntotal == 406
+    assert 4 not in reopened.version_to_ids
+    assert set(ids) <= reopened.tombstones
+    hits = reopened.search(_vectors(3, 3)[0], k=406)
+    assert not any(metadata["version_id"] == 4 for _, metadata in hits)
+
+
+def _flat_store(index_path):
+    return FAISSVectorStore(DIM, str(index_path), index_type="flat", mmap=False)
+
+
+def _add_version(store, document_id, version_id, count, seed, reused=()):
+    metadata = [
+        {**meta, "document_id": document_id}
+        for meta in _metadata(count, version_id)
+    ]
+    ids = store.add_embeddings(
+        _vectors(count, seed), metadata, register_versions=False
+    )
+    ids = list(reused) + ids
+    store.add_version_chunks(
+        version_id, version_id, document_id, "policy", ids, [None] * len(ids)
+    )
+    return ids
+
+
+def test_compaction_writes_snapshot_outside_lock_and_keeps_later_changes(
+    tmp_path, monkeypatch
+):
+    index_path = tmp_path / "faiss_index"
+    store = _flat_store(index_path)
+    _add_version(store, 1, 1, 10, seed=0)
+    v2 = _add_version(store, 2, 2, 10, seed=1)
+    store.persist()
+    store.delete_versions([1])
+    store.persist()
+
+    plan = store.prepare_compaction()
+
+    # Changes while the compacted index is being built.
+    v3 = _add_version(store, 2, 3, 4, seed=2, reused=v2[:5])
+    store.persist()
+
+    def no_full_write(*args, **kwargs):
+        raise AssertionError("snapshot written while holding the write lock")
+
+    monkeypatch.setattr("src.vector_store.faiss.write_index", no_full_write)
+    remap = store.finish_compaction(plan)
+    monkeypatch.undo()
+
+    assert remap is not None
+    assert store.index.ntotal == 14
+    assert not store.tombstones
+    assert list(store.get_version_ids(3)) == [int(remap[i]) for i in v3]
+    expected = {
+        v: list(store.get_version_ids(v)) for v in store.version_to_ids
+    }
+    latest = dict(store.latest_versions)
+    query = _vectors(4, 2)[1]
+    results = store.search(query, k=3, latest_only=True)
+    store.id_to_metadata.close()
+
+    reopened = _flat_store(index_path)
+    assert reopened.index.ntotal == 14
+    assert {
+        v: list(reopened.get_version_ids(v)) for v in reopened.version_to_ids
+    } == expected
+    assert reopened.latest_versions == latest
+    assert reopened.search(query, k=3, latest_only=True) == results
+
+
+def test_ivfpq_upgrade_waits_for_enough_pq_training_points(tmp_path):
+    # nlist * 39 = 78 points would train the IVF lists, but 8-bit PQ needs 256.
+    index_path = tmp_path / "faiss_index"
+    params = {"nlist": 2, "pq_m": 4, "pq_bits": 8}
+    store = FAISSVectorStore(
+        DIM, str(index_path), index_type="ivfpq", index_params=params, mmap=False
+    )
+    store.add_embeddings(_vectors(100, 0), _metadata(100, 1))
+    assert store.active_index_type == "flat"
+    store.add_embeddings(_vectors(200, 1), _metadata(200, 2))
+    assert store.active_index_type == "ivfpq"
+    assert store.index.ntotal == 300
+    store.persist()
+    store.id_to_metadata.close()
+
+    reopened = FAISSVectorStore(
+        DIM, str(index_path), index_type="ivfpq", index_params=params, mmap=False
+    )
+    assert reopened.index.ntotal == 300
+    assert len(reopened.get_version_ids(2)) == 200
@@ -11,6 +11,18 @@ import { API_URL } from "../config";
 import TestDownloadButton from "./test_btn";
 
 const fileTypes = ["PDF", "TXT", "DOCX"];
+const JOB_POLL_INTERVAL_MS = 1000;
+
+// Uploads are ingested in the background; poll the job until it finishes.
+async function waitForJob(jobId) {
+  while (true) {
+    const { data: json } = await axios.get(`${API_URL}/api/jobs/${jobId}`);
+    const job = json.data;
+    if (job.status === "completed") return job.result;
+    if (job.status === "failed") throw new Error(job.error);
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+}
 
 export default function Upload({
   documents,
@@ -148,11 +160,16 @@ function UploadModal({
           "Content-Type": "multipart/form-data",
         },
       })
-      .then(({ data: json }) => {
-        const { data } = json;
-        const files = [...docFiles];
-        files.push(data);
-        setDocFiles(files);
+      .then(({ data: json }) =>
+        json.data.duplicate ? json.data : waitForJob(json.data.job_id),
+      )
+      .then((data) => {
+        // An identical re-upload resolves to the version already listed.
+        if (!data.duplicate) {
+          const files = [...docFiles];
+          files.push(data);
+          setDocFiles(files);
+        }
         close();
       })
       .catch(() => {